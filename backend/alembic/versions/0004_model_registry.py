@@ -0,0 +1,44 @@
+"""add model registry columns with swipe watermark
+
+Revision ID: 0004_model_registry
+Revises: 0003_add_domains_and_views
+Create Date: 2025-08-11
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '0004_model_registry'
+down_revision = '0003_add_domains_and_views'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Таблица могла быть создана create_all уже с этими колонками — добавляем только недостающие
+    inspector = sa.inspect(op.get_bind())
+    existing = {column['name'] for column in inspector.get_columns('ml_model_meta')}
+    columns = [
+        sa.Column('version', sa.Integer()),
+        sa.Column('training_mode', sa.String()),
+        sa.Column('training_rows', sa.Integer()),
+        sa.Column('swipe_watermark_at', sa.TIMESTAMP(timezone=True)),
+        sa.Column('swipe_watermark_id', postgresql.UUID(as_uuid=True)),
+        sa.Column('details', postgresql.JSON(astext_type=sa.Text())),
+    ]
+    for column in columns:
+        if column.name not in existing:
+            op.add_column('ml_model_meta', column)
+
+    if 'ix_ml_model_meta_version' not in {index['name'] for index in inspector.get_indexes('ml_model_meta')}:
+        op.create_index('ix_ml_model_meta_version', 'ml_model_meta', ['version'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ml_model_meta_version', table_name='ml_model_meta')
+    op.drop_column('ml_model_meta', 'details')
+    op.drop_column('ml_model_meta', 'swipe_watermark_id')
+    op.drop_column('ml_model_meta', 'swipe_watermark_at')
+    op.drop_column('ml_model_meta', 'training_rows')
+    op.drop_column('ml_model_meta', 'training_mode')
+    op.drop_column('ml_model_meta', 'version')
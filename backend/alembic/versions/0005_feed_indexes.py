@@ -0,0 +1,37 @@
+"""add indexes for unseen-idea feed and swipe watermarks
+
+Revision ID: 0005_feed_indexes
+Revises: 0004_model_registry
+Create Date: 2025-08-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005_feed_indexes'
+down_revision = '0004_model_registry'
+branch_labels = None
+depends_on = None
+
+
+def _create_index_if_missing(name: str, table: str, columns: list) -> None:
+    # Индекс мог быть создан create_all вместе с таблицей
+    if name not in {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}:
+        op.create_index(name, table, columns)
+
+
+def upgrade() -> None:
+    # Лента: идеи домена по (created_at, id); anti-join по idea_views
+    # обслуживает уникальный индекс unique_view_user_idea (user_id, idea_id)
+    _create_index_if_missing('ix_ideas_domain_created_at_id', 'ideas', ['domain', 'created_at', 'id'])
+    # Водяные знаки и временной срез свайпов для обучения и оценки
+    _create_index_if_missing('ix_swipes_created_at_id', 'swipes', ['created_at', 'id'])
+    # Агрегаты по идеям (популярность) и каскадное удаление идей
+    _create_index_if_missing('ix_swipes_idea_id', 'swipes', ['idea_id'])
+    _create_index_if_missing('ix_idea_views_idea_id', 'idea_views', ['idea_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_idea_views_idea_id', table_name='idea_views')
+    op.drop_index('ix_swipes_idea_id', table_name='swipes')
+    op.drop_index('ix_swipes_created_at_id', table_name='swipes')
+    op.drop_index('ix_ideas_domain_created_at_id', table_name='ideas')
@@ -0,0 +1,24 @@
+"""index idea_views.viewed_at for seen-set synchronisation
+
+Revision ID: 0006_idea_views_viewed_at
+Revises: 0005_feed_indexes
+Create Date: 2025-08-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006_idea_views_viewed_at'
+down_revision = '0005_feed_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Множества просмотренного догоняют БД по просмотрам после водяного знака
+    # Индекс мог быть создан create_all вместе с таблицей
+    if 'ix_idea_views_viewed_at' not in {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('idea_views')}:
+        op.create_index('ix_idea_views_viewed_at', 'idea_views', ['viewed_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_idea_views_viewed_at', table_name='idea_views')
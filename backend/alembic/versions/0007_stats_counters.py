@@ -0,0 +1,66 @@
+"""maintained per-user and per-domain counters for stats endpoints
+
+Revision ID: 0007_stats_counters
+Revises: 0006_idea_views_viewed_at
+Create Date: 2025-08-21
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '0007_stats_counters'
+down_revision = '0006_idea_views_viewed_at'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # database.py мог уже создать пустые таблицы через create_all — тогда только заполняем
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if 'user_domain_counters' not in existing:
+        op.create_table(
+            'user_domain_counters',
+            sa.Column('user_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('domain', sa.String(), primary_key=True),
+            sa.Column('views', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('swipes', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('likes', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('seen', sa.Integer(), nullable=False, server_default='0'),
+        )
+    if 'domain_counters' not in existing:
+        op.create_table(
+            'domain_counters',
+            sa.Column('domain', sa.String(), primary_key=True),
+            sa.Column('ideas', sa.Integer(), nullable=False, server_default='0'),
+        )
+
+    # Начальные значения — из текущих данных
+    op.execute("DELETE FROM domain_counters")
+    op.execute("DELETE FROM user_domain_counters")
+    op.execute("""
+        INSERT INTO domain_counters (domain, ideas)
+        SELECT domain, count(*) FROM ideas GROUP BY domain
+    """)
+    op.execute("""
+        INSERT INTO user_domain_counters (user_id, domain, views, swipes, likes, seen)
+        SELECT e.user_id, i.domain,
+               count(*) FILTER (WHERE e.viewed),
+               count(*) FILTER (WHERE e.swipe IS NOT NULL),
+               count(*) FILTER (WHERE e.swipe),
+               count(*) FILTER (WHERE e.viewed)
+        FROM (
+            SELECT coalesce(v.user_id, s.user_id) AS user_id,
+                   coalesce(v.idea_id, s.idea_id) AS idea_id,
+                   v.id IS NOT NULL AS viewed,
+                   s.swipe
+            FROM idea_views v
+            FULL JOIN swipes s ON s.user_id = v.user_id AND s.idea_id = v.idea_id
+        ) e
+        JOIN ideas i ON i.id = e.idea_id
+        GROUP BY e.user_id, i.domain
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('domain_counters')
+    op.drop_table('user_domain_counters')
@@ -0,0 +1,21 @@
+"""seen counter counts viewed ideas only
+
+Revision ID: 0008_seen_counts_views_only
+Revises: 0007_stats_counters
+Create Date: 2025-08-22
+"""
+from alembic import op
+
+revision = '0008_seen_counts_views_only'
+down_revision = '0007_stats_counters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Раньше seen учитывал и свайпнутые без просмотра идеи; лента исключает только просмотры
+    op.execute("UPDATE user_domain_counters SET seen = views WHERE seen <> views")
+
+
+def downgrade() -> None:
+    pass
@@ -0,0 +1,32 @@
+"""swipes.updated_at as the incremental-training watermark
+
+Revision ID: 0009_swipes_updated_at
+Revises: 0008_seen_counts_views_only
+Create Date: 2025-08-23
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0009_swipes_updated_at'
+down_revision = '0008_seen_counts_views_only'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Колонка могла появиться через create_all на новой базе
+    inspector = sa.inspect(op.get_bind())
+    if 'updated_at' not in {column['name'] for column in inspector.get_columns('swipes')}:
+        op.add_column(
+            'swipes',
+            sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+        )
+        # Прошлые изменения не отслеживались: водяные знаки реестра (created_at, id) остаются верными
+        op.execute("UPDATE swipes SET updated_at = coalesce(created_at, updated_at)")
+    if 'ix_swipes_updated_at_id' not in {index['name'] for index in inspector.get_indexes('swipes')}:
+        op.create_index('ix_swipes_updated_at_id', 'swipes', ['updated_at', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_swipes_updated_at_id', table_name='swipes')
+    op.drop_column('swipes', 'updated_at')
@@ -0,0 +1,187 @@
+"""
+Кэш аутентифицированного пользователя
+get_current_user на каждом запросе декодирует JWT и выбирает пользователя по email.
+Здесь два ограниченных LRU-кэша процесса:
+
+- token_cache: токен → sub, пока токен не истёк (exp из самого токена)
+- user_cache: email → поля профиля пользователя на AUTH_USER_CACHE_TTL_SECONDS
+
+Роуты, меняющие профиль и домены, читают пользователя из БД с блокировкой строки
+(get_current_user_for_update) и после commit вызывают user_cache.invalidate.
+Изменения, сделанные другим процессом, видны не позже чем через TTL.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from .config import get_settings
+from .models import User
+
+settings = get_settings()
+
+# Поля профиля, которые держим в кэше; hashed_password не кэшируется
+USER_CACHE_FIELDS = ("id", "email", "selected_domains", "onboarding_completed", "created_at")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ExpiringLRU:
+    """LRU с индивидуальным сроком жизни записи; потокобезопасный"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._items[key]
+                self.stats.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats.hits += 1
+            return item[1]
+
+    def put(self, key: Hashable, value: Any, expires_at: float):
+        if self.max_size <= 0 or expires_at <= time.time():
+            return
+        with self._lock:
+            self._put_locked(key, value, expires_at)
+
+    def _put_locked(self, key: Hashable, value: Any, expires_at: float):
+        self._items[key] = (expires_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.stats.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._invalidate_locked(key)
+
+    def _invalidate_locked(self, key: Hashable):
+        if self._items.pop(key, None) is not None:
+            self.stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            size = len(self._items)
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "hit_rate": round(self.stats.hit_rate, 4),
+            "evictions": self.stats.evictions,
+            "invalidations": self.stats.invalidations,
+        }
+
+
+class TokenCache(ExpiringLRU):
+    """Результат проверки подписи JWT: токен → sub до exp токена"""
+
+    def remember(self, token: str, email: str, payload: Dict):
+        exp = payload.get("exp")
+        if exp is not None:
+            self.put(token, email, float(exp))
+
+
+class UserCache(ExpiringLRU):
+    """Поля профиля по email; из них собирается User без запроса к БД.
+
+    Промах кэша читает профиль из БД и кладёт его обратно. Если между чтением
+    и remember профиль инвалидировали, кэш вернул бы старую версию ещё на TTL.
+    Поэтому читающий берёт generation() до SELECT, а remember отбрасывает
+    профиль, если email инвалидирован после этого поколения.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        super().__init__(max_size)
+        self.ttl_seconds = ttl_seconds
+        self._generation = 0
+        # email → поколение последней инвалидации (ограничено как сам кэш)
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+
+    def generation(self) -> int:
+        """Текущее поколение; брать до чтения профиля из БД и передавать в remember"""
+        with self._lock:
+            return self._generation
+
+    def remember(self, user: User, generation: int):
+        fields = {name: getattr(user, name) for name in USER_CACHE_FIELDS}
+        if fields["selected_domains"] is not None:
+            fields["selected_domains"] = list(fields["selected_domains"])
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if self._invalidated.get(user.email, 0) > generation:
+                return  # профиль изменился, пока его читали
+            self._put_locked(user.email, fields, time.time() + self.ttl_seconds)
+
+    def invalidate(self, email: str):
+        with self._lock:
+            self._generation += 1
+            self._invalidated[email] = self._generation
+            self._invalidated.move_to_end(email)
+            while len(self._invalidated) > max(self.max_size, 1):
+                self._invalidated.popitem(last=False)
+            self._invalidate_locked(email)
+
+    def build(self, email: str) -> Optional[User]:
+        """Detached User из кэша (остальные поля — expired, догрузятся по обращению) или None.
+
+        Вызывающий добавляет его в сессию запроса (session.add): изменения профиля
+        и db.refresh работают как с загруженным объектом, без SELECT на входе.
+        """
+        fields = self.get(email)
+        if fields is None:
+            return None
+        user = User(**{
+            **fields,
+            "selected_domains": None if fields["selected_domains"] is None else list(fields["selected_domains"]),
+        })
+        make_transient_to_detached(user)
+        return user
+
+    def snapshot(self) -> Dict:
+        return {**super().snapshot(), "ttl_seconds": self.ttl_seconds}
+
+
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_MAX_SIZE if settings.AUTH_CACHE_ENABLED else 0)
+user_cache = UserCache(
+    settings.AUTH_USER_CACHE_MAX_SIZE if settings.AUTH_CACHE_ENABLED else 0,
+    settings.AUTH_USER_CACHE_TTL_SECONDS,
+)
+
+
+def auth_cache_stats() -> Dict:
+    return {
+        "enabled": settings.AUTH_CACHE_ENABLED,
+        "tokens": token_cache.snapshot(),
+        "users": user_cache.snapshot(),
+    }
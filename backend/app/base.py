@@ -0,0 +1,10 @@
+"""Декларативная база ORM-моделей.
+
+Отдельно от database.py: импорт моделей (например, в воркерах пула обучения)
+не создаёт движки приложения и не запускает create_all.
+"""
+
+from sqlalchemy.orm import declarative_base
+
+
+Base = declarative_base()
@@ -0,0 +1,41 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ...models import User
+from ...passwords import password_hasher
+from ...schemas.auth import UserRegister
+
+
+async def get_user_by_email(db: AsyncSession, email: str) -> User | None:
+    return await db.scalar(select(User).where(User.email == email))
+
+
+async def create_user(db: AsyncSession, user_data: UserRegister) -> User:
+    """Async-версия crud.auth.create_user: bcrypt в пуле процессов, поток не занимается"""
+    hashed_password = await password_hasher.hash_async(user_data.password)
+    
+    user = User(
+        email=user_data.email,
+        hashed_password=hashed_password,
+        selected_domains=None,
+        onboarding_completed=False
+    )
+    
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    return user
+
+
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> User | None:
+    """Async-версия crud.auth.authenticate_user: проверка и пересчёт хэша — в пуле процессов"""
+    user = await get_user_by_email(db, email)
+    if not user:
+        return None
+    valid, new_hash = await password_hasher.verify_and_update_async(password, user.hashed_password)
+    if not valid:
+        return None
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    return user
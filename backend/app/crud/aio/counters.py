@@ -0,0 +1,43 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Iterable, Sequence, Tuple
+import uuid
+
+from ..counters import (
+    _BUMP_DOMAIN_COUNTERS_SQL,
+    _BUMP_USER_COUNTERS_SQL,
+    _USER_STATS_SQL,
+    UserCounterDeltas,
+    domain_counter_params,
+    swipe_counter_deltas,
+    user_counter_params,
+    view_counter_deltas,
+)
+
+
+async def bump_user_counters(db: AsyncSession, deltas: UserCounterDeltas):
+    """Прибавляет дельты к счётчикам пользователей. Без commit — в транзакции вызывающего"""
+
+    params = user_counter_params(deltas)
+    if params:
+        await db.execute(_BUMP_USER_COUNTERS_SQL, params)
+
+
+async def bump_domain_counters(db: AsyncSession, domains: Iterable[str]):
+    params = domain_counter_params(domains)
+    if params:
+        await db.execute(_BUMP_DOMAIN_COUNTERS_SQL, params)
+
+
+async def count_swipes(db: AsyncSession, writes: Iterable):
+    await bump_user_counters(db, swipe_counter_deltas(writes))
+
+
+async def count_views(db: AsyncSession, views: Iterable[Tuple[uuid.UUID, str]]):
+    await bump_user_counters(db, view_counter_deltas(views))
+
+
+async def get_user_stats(db: AsyncSession, user_id: uuid.UUID, domains: Sequence[str]) -> Dict[str, int]:
+    """views/swipes/likes пользователя (по всем доменам), seen_in_domains и ideas_in_domains"""
+
+    row = (await db.execute(_USER_STATS_SQL, {"user_id": user_id, "domains": list(domains or [])})).one()
+    return {key: int(value) for key, value in row._mapping.items()}
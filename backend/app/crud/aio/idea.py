@@ -0,0 +1,133 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from typing import List, Optional, Sequence, Set, Tuple
+import uuid
+
+import numpy as np
+
+from ...config import get_settings
+from ...database import run_with_sync_session
+from ...models import Idea, IdeaView
+from ...ml.seen_sets import seen_sets
+from ..idea import (
+    _INSERT_VIEWS_SQL,
+    _UNSEEN_FEED_SQL,
+    FeedPage,
+    _feed_page,
+    _feed_params,
+    _view_params,
+    record_view_signals,
+)
+from .counters import count_views
+
+settings = get_settings()
+
+# In-memory индексы (seen_sets, popularity_index) принимают синхронную сессию и держат
+# свои блокировки: они выполняются в пуле потоков (run_with_sync_session), а не в цикле событий
+
+
+async def get_idea_by_id(db: AsyncSession, idea_id: uuid.UUID) -> Optional[Idea]:
+    return await db.get(Idea, idea_id)
+
+
+async def get_ideas_by_ids(db: AsyncSession, idea_ids: List[uuid.UUID]) -> List[Idea]:
+    """Получает идеи по списку ID одним запросом, в порядке idea_ids"""
+    
+    if not idea_ids:
+        return []
+    ideas = {idea.id: idea for idea in (await db.scalars(select(Idea).where(Idea.id.in_(idea_ids)))).all()}
+    return [ideas[idea_id] for idea_id in idea_ids if idea_id in ideas]
+
+
+async def get_unseen_feed(
+    db: AsyncSession,
+    user_id: uuid.UUID,
+    user_domains: List[str],
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    balance_domains: bool = True,
+) -> FeedPage:
+    """Async-версия crud.idea.get_unseen_feed"""
+    
+    if not user_domains or limit <= 0:
+        return FeedPage([], None)
+    
+    positions, params = _feed_params(user_id, user_domains, limit, cursor, balance_domains)
+    ideas = (await db.execute(select(Idea).from_statement(_UNSEEN_FEED_SQL), params)).scalars().all()
+    return _feed_page(ideas, positions, limit)
+
+
+async def get_user_unseen_ideas(
+    db: AsyncSession,
+    user_id: uuid.UUID,
+    user_domains: List[str],
+    limit: int = 10
+) -> List[Idea]:
+    """Непросмотренные идеи доменов пользователя (первая страница ленты)"""
+    
+    if settings.ML_SEEN_SETS_ENABLED:
+        if not user_domains or limit <= 0:
+            return []
+        idea_ids = await run_with_sync_session(seen_sets.unseen_idea_ids, user_id, user_domains, limit)
+        return await get_ideas_by_ids(db, idea_ids)
+    return (await get_unseen_feed(db, user_id, user_domains, limit)).ideas
+
+
+async def count_user_unseen_ideas(
+    db: AsyncSession,
+    user_id: uuid.UUID,
+    user_domains: List[str],
+    limit: int = 10
+) -> int:
+    """Сколько непросмотренных идей осталось (не больше limit)"""
+    
+    if not user_domains or limit <= 0:
+        return 0
+    if settings.ML_SEEN_SETS_ENABLED:
+        return len(await run_with_sync_session(seen_sets.unseen_idea_ids, user_id, user_domains, limit))
+    return len((await get_unseen_feed(db, user_id, user_domains, limit)).ideas)
+
+
+async def get_user_seen_idea_ids(db: AsyncSession, user_id: uuid.UUID) -> Set[uuid.UUID]:
+    """ID идей, которые пользователь уже видел (idea_views — то же определение, что в ленте)"""
+    
+    rows = await db.execute(select(IdeaView.idea_id).where(IdeaView.user_id == user_id))
+    return {row[0] for row in rows}
+
+
+async def get_unseen_mask(db: AsyncSession, user_id: uuid.UUID, idea_ids: Sequence[uuid.UUID]) -> np.ndarray:
+    """Маска «пользователь ещё не видел идею» для списка кандидатов"""
+    
+    if settings.ML_SEEN_SETS_ENABLED:
+        return await run_with_sync_session(seen_sets.unseen_mask, user_id, idea_ids)
+    seen = await get_user_seen_idea_ids(db, user_id)
+    return np.fromiter((idea_id not in seen for idea_id in idea_ids), dtype=bool, count=len(idea_ids))
+
+
+async def insert_view_events(
+    db: AsyncSession,
+    events: Sequence[Tuple[uuid.UUID, uuid.UUID]],
+    commit: bool = True,
+) -> List[Tuple[uuid.UUID, uuid.UUID]]:
+    """Async-версия crud.idea.insert_view_events: один INSERT и счётчики в той же транзакции"""
+    
+    events = list(dict.fromkeys(events))
+    if not events:
+        return []
+    
+    rows = (await db.execute(_INSERT_VIEWS_SQL, _view_params(events))).all()
+    await count_views(db, [(row.user_id, row.domain) for row in rows])
+    inserted = [(row.user_id, row.idea_id) for row in rows]
+    
+    if commit:
+        await db.commit()
+        record_view_signals(inserted)
+    return inserted
+
+
+async def mark_ideas_as_viewed(db: AsyncSession, user_id: uuid.UUID, idea_ids: Sequence[uuid.UUID]) -> List[uuid.UUID]:
+    """Отмечает пачку идей просмотренными: один INSERT ... ON CONFLICT DO NOTHING и один commit"""
+    
+    inserted = await insert_view_events(db, [(user_id, idea_id) for idea_id in idea_ids])
+    seen_sets.mark_seen(user_id, idea_ids)
+    return [idea_id for _, idea_id in inserted]
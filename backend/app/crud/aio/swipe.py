@@ -0,0 +1,48 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import exists, select
+from typing import Dict, List, Optional, Sequence, Tuple
+import uuid
+
+from ...models import Swipe
+from ...schemas.swipe import SwipeCreate
+from ..swipe import _UPSERT_SWIPES_SQL, SwipeWrite, _swipe_params, record_swipe_signals
+from .counters import count_swipes
+
+
+async def upsert_swipe_events(
+    db: AsyncSession,
+    events: Sequence[Tuple[uuid.UUID, uuid.UUID, bool]],
+    commit: bool = True,
+) -> Dict[Tuple[uuid.UUID, uuid.UUID], SwipeWrite]:
+    """Async-версия crud.swipe.upsert_swipe_events: тот же оператор и те же счётчики"""
+    
+    latest = {(user_id, idea_id): swipe for user_id, idea_id, swipe in events}
+    if not latest:
+        return {}
+    
+    rows = (await db.execute(_UPSERT_SWIPES_SQL, _swipe_params(latest))).all()
+    writes = {(row.user_id, row.idea_id): SwipeWrite(*row) for row in rows}
+    await count_swipes(db, writes.values())
+    
+    if commit:
+        await db.commit()
+        record_swipe_signals(writes.values())
+    return writes
+
+
+async def upsert_swipes(db: AsyncSession, user_id: uuid.UUID, swipes: Sequence[SwipeCreate]) -> List[SwipeWrite]:
+    """Пачка свайпов пользователя одним оператором и одним commit, в порядке запроса"""
+    
+    writes = await upsert_swipe_events(db, [(user_id, swipe.idea_id, swipe.swipe) for swipe in swipes])
+    idea_ids = dict.fromkeys(swipe.idea_id for swipe in swipes)
+    return [writes[(user_id, idea_id)] for idea_id in idea_ids if (user_id, idea_id) in writes]
+
+
+async def create_swipe(db: AsyncSession, user_id: uuid.UUID, swipe_data: SwipeCreate) -> Optional[SwipeWrite]:
+    writes = await upsert_swipes(db, user_id, [swipe_data])
+    return writes[0] if writes else None
+
+
+async def has_user_swiped(db: AsyncSession, user_id: uuid.UUID) -> bool:
+    """Есть ли у пользователя хотя бы один свайп (иначе — cold-start)"""
+    return bool(await db.scalar(select(exists().where(Swipe.user_id == user_id))))
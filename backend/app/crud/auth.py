@@ -1,32 +1,19 @@
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-import hashlib
 
 from ..models import User
+from ..passwords import password_hasher
 from ..schemas.auth import UserRegister
 
-# Use bcrypt as primary, with argon2 as fallback for very long passwords
-pwd_context = CryptContext(schemes=["bcrypt", "argon2"], deprecated="auto")
-
 
 def get_password_hash(password: str) -> str:
-    """Хэширует пароль"""
-    # For passwords longer than 72 bytes, use SHA-256 hash first, then bcrypt
-    if len(password.encode('utf-8')) > 72:
-        # Hash the password with SHA-256 first to get a fixed 32-byte hash
-        password_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
-        return pwd_context.hash(password_hash)
-    return pwd_context.hash(password)
+    """Хэширует пароль (в пуле процессов, см. passwords.py)"""
+    return password_hasher.hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Проверяет пароль"""
-    # For passwords longer than 72 bytes, use SHA-256 hash first, then verify
-    if len(plain_password.encode('utf-8')) > 72:
-        # Hash the password with SHA-256 first to get a fixed 32-byte hash
-        password_hash = hashlib.sha256(plain_password.encode('utf-8')).hexdigest()
-        return pwd_context.verify(password_hash, hashed_password)
-    return pwd_context.verify(plain_password, hashed_password)
+    valid, _ = password_hasher.verify_and_update(plain_password, hashed_password)
+    return valid
 
 
 def get_user_by_email(db: Session, email: str) -> User | None:
@@ -52,10 +39,14 @@ def create_user(db: Session, user_data: UserRegister) -> User:
 
 
 def authenticate_user(db: Session, email: str, password: str) -> User | None:
-    """Аутентифицирует пользователя"""
+    """Аутентифицирует пользователя; хэш с устаревшими параметрами пересчитывается"""
     user = get_user_by_email(db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = password_hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
         return None
-    return user 
\ No newline at end of file
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+    return user
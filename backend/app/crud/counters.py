@@ -0,0 +1,191 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import Integer, String, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import uuid
+
+
+# Дельты (views, swipes, likes, seen) по (user_id, domain)
+UserCounterDeltas = Dict[Tuple[uuid.UUID, str], Tuple[int, int, int, int]]
+
+_BUMP_USER_COUNTERS_SQL = text("""
+    INSERT INTO user_domain_counters AS c (user_id, domain, views, swipes, likes, seen)
+    SELECT * FROM unnest(:user_ids, :domains, :views, :swipes, :likes, :seen)
+    ON CONFLICT (user_id, domain) DO UPDATE SET
+        views = c.views + EXCLUDED.views,
+        swipes = c.swipes + EXCLUDED.swipes,
+        likes = c.likes + EXCLUDED.likes,
+        seen = c.seen + EXCLUDED.seen
+""").bindparams(
+    bindparam("user_ids", type_=ARRAY(UUID(as_uuid=True))),
+    bindparam("domains", type_=ARRAY(String)),
+    bindparam("views", type_=ARRAY(Integer)),
+    bindparam("swipes", type_=ARRAY(Integer)),
+    bindparam("likes", type_=ARRAY(Integer)),
+    bindparam("seen", type_=ARRAY(Integer)),
+)
+
+_BUMP_DOMAIN_COUNTERS_SQL = text("""
+    INSERT INTO domain_counters AS c (domain, ideas)
+    SELECT * FROM unnest(:domains, :ideas)
+    ON CONFLICT (domain) DO UPDATE SET ideas = c.ideas + EXCLUDED.ideas
+""").bindparams(
+    bindparam("domains", type_=ARRAY(String)),
+    bindparam("ideas", type_=ARRAY(Integer)),
+)
+
+# Счётчики пользователя и число идей в его доменах — одно обращение по первичным ключам
+_USER_STATS_SQL = text("""
+    SELECT coalesce(sum(c.views), 0) AS views,
+           coalesce(sum(c.swipes), 0) AS swipes,
+           coalesce(sum(c.likes), 0) AS likes,
+           coalesce(sum(c.seen) FILTER (WHERE c.domain = ANY(:domains)), 0) AS seen_in_domains,
+           (SELECT coalesce(sum(d.ideas), 0) FROM domain_counters d WHERE d.domain = ANY(:domains)) AS ideas_in_domains
+    FROM user_domain_counters c
+    WHERE c.user_id = :user_id
+""").bindparams(
+    bindparam("user_id", type_=UUID(as_uuid=True)),
+    bindparam("domains", type_=ARRAY(String)),
+)
+
+# Полный пересчёт (после удаления идей или для сверки)
+_RECOUNT_SQL = [
+    # Инкременты других транзакций ждут окончания пересчёта
+    "LOCK TABLE domain_counters, user_domain_counters IN EXCLUSIVE MODE",
+    "DELETE FROM domain_counters",
+    "DELETE FROM user_domain_counters",
+    """
+    INSERT INTO domain_counters (domain, ideas)
+    SELECT domain, count(*) FROM ideas GROUP BY domain
+    """,
+    """
+    INSERT INTO user_domain_counters (user_id, domain, views, swipes, likes, seen)
+    SELECT e.user_id, i.domain,
+           count(*) FILTER (WHERE e.viewed),
+           count(*) FILTER (WHERE e.swipe IS NOT NULL),
+           count(*) FILTER (WHERE e.swipe),
+           count(*) FILTER (WHERE e.viewed)
+    FROM (
+        SELECT coalesce(v.user_id, s.user_id) AS user_id,
+               coalesce(v.idea_id, s.idea_id) AS idea_id,
+               v.id IS NOT NULL AS viewed,
+               s.swipe
+        FROM idea_views v
+        FULL JOIN swipes s ON s.user_id = v.user_id AND s.idea_id = v.idea_id
+    ) e
+    JOIN ideas i ON i.id = e.idea_id
+    GROUP BY e.user_id, i.domain
+    """,
+]
+
+
+def user_counter_params(deltas: UserCounterDeltas) -> Optional[dict]:
+    """Параметры _BUMP_USER_COUNTERS_SQL; None — прибавлять нечего.
+
+    Ключи сортируются: параллельные транзакции берут блокировки строк в одном порядке.
+    """
+
+    rows = sorted((key, delta) for key, delta in deltas.items() if any(delta))
+    if not rows:
+        return None
+    return {
+        "user_ids": [user_id for (user_id, _), _ in rows],
+        "domains": [domain for (_, domain), _ in rows],
+        "views": [delta[0] for _, delta in rows],
+        "swipes": [delta[1] for _, delta in rows],
+        "likes": [delta[2] for _, delta in rows],
+        "seen": [delta[3] for _, delta in rows],
+    }
+
+
+def domain_counter_params(domains: Iterable[str]) -> Optional[dict]:
+    """Параметры _BUMP_DOMAIN_COUNTERS_SQL для новых идей (по одному домену на идею)"""
+
+    counts = sorted(Counter(domains).items())
+    if not counts:
+        return None
+    return {
+        "domains": [domain for domain, _ in counts],
+        "ideas": [count for _, count in counts],
+    }
+
+
+def swipe_counter_deltas(writes: Iterable) -> UserCounterDeltas:
+    """Дельты для записанных свайпов (SwipeWrite): новые — swipes/likes, повторные — сдвиг likes.
+
+    seen считает только просмотры (как и лента), свайп его не меняет.
+    """
+
+    deltas: Dict[Tuple[uuid.UUID, str], List[int]] = {}
+    for write in writes:
+        delta = deltas.setdefault((write.user_id, write.domain), [0, 0, 0, 0])
+        if write.previous is None:
+            delta[1] += 1
+            delta[2] += int(write.swipe)
+        else:
+            delta[2] += int(write.swipe) - int(write.previous)
+    return {key: tuple(delta) for key, delta in deltas.items()}
+
+
+def view_counter_deltas(views: Iterable[Tuple[uuid.UUID, str]]) -> UserCounterDeltas:
+    """Дельты для новых просмотров (user_id, domain): views и seen"""
+
+    deltas: Dict[Tuple[uuid.UUID, str], List[int]] = {}
+    for user_id, domain in views:
+        delta = deltas.setdefault((user_id, domain), [0, 0, 0, 0])
+        delta[0] += 1
+        delta[3] += 1
+    return {key: tuple(delta) for key, delta in deltas.items()}
+
+
+def bump_user_counters(db: Session, deltas: UserCounterDeltas):
+    """Прибавляет дельты к счётчикам пользователей. Без commit — в транзакции вызывающего"""
+
+    params = user_counter_params(deltas)
+    if params:
+        db.execute(_BUMP_USER_COUNTERS_SQL, params)
+
+
+def bump_domain_counters(db: Session, domains: Iterable[str]):
+    """Учитывает новые идеи. Без commit"""
+
+    params = domain_counter_params(domains)
+    if params:
+        db.execute(_BUMP_DOMAIN_COUNTERS_SQL, params)
+
+
+def count_swipes(db: Session, writes: Iterable):
+    bump_user_counters(db, swipe_counter_deltas(writes))
+
+
+def count_views(db: Session, views: Iterable[Tuple[uuid.UUID, str]]):
+    bump_user_counters(db, view_counter_deltas(views))
+
+
+def get_user_stats(db: Session, user_id: uuid.UUID, domains: Sequence[str]) -> Dict[str, int]:
+    """views/swipes/likes пользователя (по всем доменам), seen_in_domains и ideas_in_domains"""
+
+    row = db.execute(_USER_STATS_SQL, {"user_id": user_id, "domains": list(domains or [])}).one()
+    return {key: int(value) for key, value in row._mapping.items()}
+
+
+def recount_counters(db: Session, commit: bool = True):
+    """Пересчитывает все счётчики по таблицам идей, просмотров и свайпов"""
+
+    for statement in _RECOUNT_SQL:
+        db.execute(text(statement))
+    if commit:
+        db.commit()
+
+
+def ensure_counters(db: Session) -> bool:
+    """Заполняет счётчики, если таблицы пусты при непустом каталоге (созданы create_all без миграции)"""
+
+    empty = db.execute(text(
+        "SELECT NOT EXISTS (SELECT 1 FROM domain_counters) AND EXISTS (SELECT 1 FROM ideas)"
+    )).scalar()
+    if empty:
+        recount_counters(db)
+        print("🔢 Счётчики статистики заполнены по текущим данным")
+    return bool(empty)
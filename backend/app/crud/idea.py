@@ -1,32 +1,70 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, not_
-from typing import List, Optional
+from sqlalchemy import String, TIMESTAMP, and_, bindparam, select, text
+from sqlalchemy.dialects.postgresql import ARRAY, UUID, insert as pg_insert
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+import base64
+import csv
+import io
+import json
 import uuid
 
-from ..models import Idea, IdeaView, Swipe
+import numpy as np
+
+from ..config import get_settings
+from ..models import Idea, IdeaView
+from ..ml.near_duplicates import near_duplicate_index
+from ..ml.popularity import popularity_index
+from ..ml.seen_sets import seen_sets
 from ..schemas.idea import IdeaCreate
+from .counters import bump_domain_counters, count_views
+
+settings = get_settings()
+
+
+def _idea_row(idea_data: IdeaCreate) -> dict:
+    return {
+        "id": uuid.uuid4(),
+        "title": idea_data.title,
+        "description": idea_data.description,
+        "tags": idea_data.tags,
+        "domain": idea_data.domain,
+        "generated_for_domains": idea_data.generated_for_domains,
+    }
+
+
+def _detach(db: Session, ideas: List[Idea]) -> List[Idea]:
+    """Отсоединяет созданные идеи до commit: иначе commit пометит их expired,
+    и каждое обращение к полю перечитывало бы строку отдельным SELECT"""
+    for idea in ideas:
+        db.expunge(idea)
+    return ideas
+
+
+def _register_ideas(ideas: Iterable[Idea]):
+    for idea in ideas:
+        popularity_index.register_idea(idea.id, idea.domain)
+        seen_sets.register_idea(idea.id, idea.domain)
 
 
 def create_idea(db: Session, idea_data: IdeaCreate) -> Idea:
-    """Создает новую идею в БД"""
-    
-    # Проверяем, не существует ли уже такая идея
-    existing = db.query(Idea).filter(Idea.title == idea_data.title).first()
-    if existing:
-        return existing
-    
-    idea = Idea(
-        id=uuid.uuid4(),
-        title=idea_data.title,
-        description=idea_data.description,
-        tags=idea_data.tags,
-        domain=idea_data.domain,
-        generated_for_domains=idea_data.generated_for_domains
-    )
+    """Создает новую идею в БД; если идея с таким title уже есть — возвращает её"""
     
-    db.add(idea)
+    stmt = (
+        pg_insert(Idea)
+        .values(_idea_row(idea_data))
+        .on_conflict_do_nothing(index_elements=[Idea.title])
+        .returning(Idea)
+    )
+    idea = db.scalars(stmt).first()
+    if idea is not None:
+        _detach(db, [idea])
+        bump_domain_counters(db, [idea.domain])
     db.commit()
-    db.refresh(idea)
+    
+    if idea is None:
+        return db.query(Idea).filter(Idea.title == idea_data.title).first()
+    _register_ideas([idea])
     return idea
 
 
@@ -50,51 +88,252 @@ def get_ideas_for_user(
     return query.offset(skip).limit(limit).all()
 
 
+class FeedPage(NamedTuple):
+    ideas: List[Idea]
+    next_cursor: Optional[str]  # передаётся в следующий запрос; None — лента закончилась
+
+
+# Нижняя граница keyset-курсора для доменов, по которым курсора ещё нет
+_FEED_START = (datetime(1970, 1, 1, tzinfo=timezone.utc), uuid.UUID(int=0))
+
+# На каждый домен — индексный проход по (domain, created_at, id) с anti-join
+# к idea_views и LIMIT; затем row_number() чередует домены в одной выдаче
+_UNSEEN_FEED_SQL = text("""
+    SELECT ranked.*
+    FROM (
+        SELECT c.*, row_number() OVER (PARTITION BY c.domain ORDER BY c.created_at, c.id) AS domain_rank
+        FROM unnest(:domains, :cursor_ats, :cursor_ids) AS d(domain, cursor_at, cursor_id)
+        CROSS JOIN LATERAL (
+            SELECT i.*
+            FROM ideas i
+            WHERE i.domain = d.domain
+              AND (i.created_at, i.id) > (d.cursor_at, d.cursor_id)
+              AND NOT EXISTS (
+                  SELECT 1 FROM idea_views v
+                  WHERE v.user_id = :user_id AND v.idea_id = i.id
+              )
+            ORDER BY i.created_at, i.id
+            LIMIT :per_domain
+        ) c
+    ) ranked
+    ORDER BY CASE WHEN :balance THEN ranked.domain_rank ELSE 0 END, ranked.created_at, ranked.id
+    LIMIT :limit
+""").bindparams(
+    bindparam("domains", type_=ARRAY(String)),
+    bindparam("cursor_ats", type_=ARRAY(TIMESTAMP(timezone=True))),
+    bindparam("cursor_ids", type_=ARRAY(UUID(as_uuid=True))),
+    bindparam("user_id", type_=UUID(as_uuid=True)),
+)
+
+
+def encode_feed_cursor(positions: Dict[str, Tuple[datetime, uuid.UUID]]) -> str:
+    payload = {domain: [created_at.isoformat(), str(idea_id)] for domain, (created_at, idea_id) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_feed_cursor(cursor: Optional[str]) -> Dict[str, Tuple[datetime, uuid.UUID]]:
+    """Курсор — позиция (created_at, id) последней отданной идеи в каждом домене"""
+    if not cursor:
+        return {}
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid feed cursor") from e
+    
+    # Валидный base64 JSON ещё не курсор: ожидаем {domain: [created_at, id]}
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid feed cursor")
+    positions = {}
+    for domain, position in payload.items():
+        if not isinstance(position, list) or len(position) != 2 or not all(isinstance(v, str) for v in position):
+            raise ValueError("Invalid feed cursor")
+        try:
+            positions[domain] = (datetime.fromisoformat(position[0]), uuid.UUID(position[1]))
+        except ValueError as e:
+            raise ValueError("Invalid feed cursor") from e
+    return positions
+
+
+def get_unseen_feed(
+    db: Session,
+    user_id: uuid.UUID,
+    user_domains: List[str],
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    balance_domains: bool = True,
+) -> FeedPage:
+    """Страница непросмотренных идей из доменов пользователя — один запрос.
+    
+    Порядок стабилен: внутри домена по (created_at, id), домены чередуются
+    (balance_domains). Курсор хранит позицию по каждому домену, поэтому
+    чередование не пропускает идеи при переходе на следующую страницу.
+    """
+    
+    if not user_domains or limit <= 0:
+        return FeedPage([], None)
+    
+    positions, params = _feed_params(user_id, user_domains, limit, cursor, balance_domains)
+    ideas = db.execute(select(Idea).from_statement(_UNSEEN_FEED_SQL), params).scalars().all()
+    return _feed_page(ideas, positions, limit)
+
+
+def _feed_params(
+    user_id: uuid.UUID,
+    user_domains: List[str],
+    limit: int,
+    cursor: Optional[str],
+    balance_domains: bool,
+) -> Tuple[Dict[str, Tuple[datetime, uuid.UUID]], dict]:
+    """Позиции курсора по доменам и параметры _UNSEEN_FEED_SQL"""
+    
+    domains = list(dict.fromkeys(user_domains))
+    positions = decode_feed_cursor(cursor)
+    starts = [positions.get(domain, _FEED_START) for domain in domains]
+    return positions, {
+        "domains": domains,
+        "cursor_ats": [start[0] for start in starts],
+        "cursor_ids": [start[1] for start in starts],
+        "user_id": user_id,
+        "per_domain": limit,
+        "balance": balance_domains,
+        "limit": limit,
+    }
+
+
+def _feed_page(ideas: List[Idea], positions: Dict[str, Tuple[datetime, uuid.UUID]], limit: int) -> FeedPage:
+    if len(ideas) < limit:
+        return FeedPage(ideas, None)
+    for idea in ideas:
+        positions[idea.domain] = (idea.created_at, idea.id)
+    return FeedPage(ideas, encode_feed_cursor(positions))
+
+
 def get_user_unseen_ideas(
     db: Session,
     user_id: uuid.UUID, 
     user_domains: List[str],
     limit: int = 10
 ) -> List[Idea]:
-    """Получает непросмотренные пользователем идеи из его доменов"""
-    
-    if not user_domains:
-        return []
+    """Получает непросмотренные пользователем идеи из его доменов (первая страница ленты).
     
-    # Подзапрос для просмотренных идей
-    viewed_ideas = db.query(IdeaView.idea_id).filter(IdeaView.user_id == user_id)
+    С ML_SEEN_SETS_ENABLED кандидаты выбираются по битовым картам в памяти,
+    а из БД читаются только сами идеи по первичному ключу.
+    """
     
-    # Основной запрос: идеи из доменов пользователя, которые он не видел
-    query = db.query(Idea).filter(
-        and_(
-            Idea.domain.in_(user_domains),
-            not_(Idea.id.in_(viewed_ideas))
-        )
-    ).limit(limit)
+    if settings.ML_SEEN_SETS_ENABLED:
+        if not user_domains or limit <= 0:
+            return []
+        return get_ideas_by_ids(db, seen_sets.unseen_idea_ids(db, user_id, user_domains, limit))
+    return get_unseen_feed(db, user_id, user_domains, limit).ideas
+
+
+def count_user_unseen_ideas(
+    db: Session,
+    user_id: uuid.UUID,
+    user_domains: List[str],
+    limit: int = 10
+) -> int:
+    """Сколько непросмотренных идей осталось (не больше limit) — без чтения самих идей"""
     
-    return query.all()
+    if not user_domains or limit <= 0:
+        return 0
+    if settings.ML_SEEN_SETS_ENABLED:
+        return len(seen_sets.unseen_idea_ids(db, user_id, user_domains, limit))
+    return len(get_unseen_feed(db, user_id, user_domains, limit).ideas)
 
 
 def mark_idea_as_viewed(db: Session, user_id: uuid.UUID, idea_id: uuid.UUID):
     """Отмечает идею как просмотренную пользователем"""
     
-    # Проверяем, не была ли уже просмотрена
-    existing = db.query(IdeaView).filter(
+    insert_view_events(db, [(user_id, idea_id)])
+    return db.query(IdeaView).filter(
         and_(IdeaView.user_id == user_id, IdeaView.idea_id == idea_id)
     ).first()
+
+
+# Новые просмотры вместе с доменом идеи — для счётчиков
+_INSERT_VIEWS_SQL = text("""
+    WITH inserted AS (
+        INSERT INTO idea_views (id, user_id, idea_id)
+        SELECT * FROM unnest(:ids, :user_ids, :idea_ids)
+        ON CONFLICT ON CONSTRAINT unique_view_user_idea DO NOTHING
+        RETURNING user_id, idea_id
+    )
+    SELECT ins.user_id, ins.idea_id, i.domain
+    FROM inserted ins
+    JOIN ideas i ON i.id = ins.idea_id
+""").bindparams(
+    bindparam("ids", type_=ARRAY(UUID(as_uuid=True))),
+    bindparam("user_ids", type_=ARRAY(UUID(as_uuid=True))),
+    bindparam("idea_ids", type_=ARRAY(UUID(as_uuid=True))),
+)
+
+
+def insert_view_events(
+    db: Session,
+    events: Sequence[Tuple[uuid.UUID, uuid.UUID]],
+    commit: bool = True,
+) -> List[Tuple[uuid.UUID, uuid.UUID]]:
+    """Записывает просмотры (user_id, idea_id) одним INSERT ... ON CONFLICT DO NOTHING.
     
-    if existing:
-        return existing
+    Счётчики статистики обновляются в той же транзакции. Возвращает впервые
+    записанные пары. С commit=False транзакцию завершает
+    вызывающий и сам вызывает record_view_signals.
+    """
     
-    view = IdeaView(
-        user_id=user_id,
-        idea_id=idea_id
-    )
+    events = list(dict.fromkeys(events))
+    if not events:
+        return []
     
-    db.add(view)
-    db.commit()
-    db.refresh(view)
-    return view
+    rows = db.execute(_INSERT_VIEWS_SQL, _view_params(events)).all()
+    count_views(db, [(row.user_id, row.domain) for row in rows])
+    inserted = [(row.user_id, row.idea_id) for row in rows]
+    
+    if commit:
+        db.commit()
+        record_view_signals(inserted)
+    return inserted
+
+
+def _view_params(events: Sequence[Tuple[uuid.UUID, uuid.UUID]]) -> dict:
+    return {
+        "ids": [uuid.uuid4() for _ in events],
+        "user_ids": [user_id for user_id, _ in events],
+        "idea_ids": [idea_id for _, idea_id in events],
+    }
+
+
+def record_view_signals(inserted: Iterable[Tuple[uuid.UUID, uuid.UUID]]):
+    """Новые просмотры — в счётчики популярности и множества просмотренного"""
+    for user_id, idea_id in inserted:
+        popularity_index.record_view(idea_id)
+        seen_sets.mark_seen(user_id, [idea_id])
+
+
+def mark_ideas_as_viewed(db: Session, user_id: uuid.UUID, idea_ids: Sequence[uuid.UUID]) -> List[uuid.UUID]:
+    """Отмечает пачку идей просмотренными: один INSERT ... ON CONFLICT DO NOTHING и один commit.
+    
+    Возвращает ID идей, просмотр которых записан впервые (без refresh объектов).
+    """
+    
+    inserted = insert_view_events(db, [(user_id, idea_id) for idea_id in idea_ids])
+    seen_sets.mark_seen(user_id, idea_ids)
+    return [idea_id for _, idea_id in inserted]
+
+
+def get_user_seen_idea_ids(db: Session, user_id: uuid.UUID) -> Set[uuid.UUID]:
+    """ID идей, которые пользователь уже видел (idea_views — то же определение, что в ленте)"""
+    
+    return {row[0] for row in db.query(IdeaView.idea_id).filter(IdeaView.user_id == user_id)}
+
+
+def get_unseen_mask(db: Session, user_id: uuid.UUID, idea_ids: Sequence[uuid.UUID]) -> np.ndarray:
+    """Маска «пользователь ещё не видел идею» для списка кандидатов"""
+    
+    if settings.ML_SEEN_SETS_ENABLED:
+        return seen_sets.unseen_mask(db, user_id, idea_ids)
+    seen = get_user_seen_idea_ids(db, user_id)
+    return np.fromiter((idea_id not in seen for idea_id in idea_ids), dtype=bool, count=len(idea_ids))
 
 
 def get_idea_by_id(db: Session, idea_id: uuid.UUID) -> Optional[Idea]:
@@ -102,32 +341,102 @@ def get_idea_by_id(db: Session, idea_id: uuid.UUID) -> Optional[Idea]:
     return db.query(Idea).filter(Idea.id == idea_id).first()
 
 
+def get_ideas_by_ids(db: Session, idea_ids: List[uuid.UUID]) -> List[Idea]:
+    """Получает идеи по списку ID одним запросом, в порядке idea_ids"""
+    
+    ideas = {idea.id: idea for idea in db.query(Idea).filter(Idea.id.in_(idea_ids)).all()}
+    return [ideas[idea_id] for idea_id in idea_ids if idea_id in ideas]
+
+
 def bulk_create_ideas(db: Session, ideas_data: List[IdeaCreate]) -> List[Idea]:
-    """Массово создает идеи (для генератора)"""
+    """Массово создает идеи (для генератора): один INSERT ... ON CONFLICT (title) DO NOTHING.
     
-    created_ideas = []
+    Дубликаты по title (в БД и внутри пачки) пропускаются; возвращаются только
+    созданные идеи. С IDEA_NEAR_DUP_ENABLED отбрасываются и почти-дубликаты
+    (MinHash LSH). Пачки больше IDEA_COPY_THRESHOLD идут через COPY.
+    """
     
+    unique = list({idea_data.title: idea_data for idea_data in reversed(ideas_data)}.values())[::-1]
+    signatures = {}
+    if unique and settings.IDEA_NEAR_DUP_ENABLED:
+        near_duplicate_index.ensure_loaded(db)
+        unique, rejected, kept_signatures = near_duplicate_index.filter_new(unique)
+        signatures = {idea_data.title: signature for idea_data, signature in zip(unique, kept_signatures)}
+        if rejected:
+            print(f"🧬 Отброшено почти-дубликатов: {len(rejected)} из {len(rejected) + len(unique)}")
+    if not unique:
+        return []
+    if len(unique) > settings.IDEA_COPY_THRESHOLD:
+        return _index_signatures(copy_ideas(db, unique), signatures)
+    
+    stmt = (
+        pg_insert(Idea)
+        .values([_idea_row(idea_data) for idea_data in unique])
+        .on_conflict_do_nothing(index_elements=[Idea.title])
+        .returning(Idea)
+    )
+    created_ideas = _detach(db, db.scalars(stmt).all())
+    bump_domain_counters(db, [idea.domain for idea in created_ideas])
+    db.commit()
+    _register_ideas(created_ideas)
+    return _index_signatures(created_ideas, signatures)
+
+
+def _index_signatures(created_ideas: List[Idea], signatures: Dict[str, np.ndarray]) -> List[Idea]:
+    """Подписи созданных идей — в индекс почти-дубликатов (вставка могла пропустить часть по title)"""
+    for idea in created_ideas:
+        if idea.title in signatures:
+            near_duplicate_index.add(idea.id, signatures[idea.title])
+    return created_ideas
+
+
+# Импорт через COPY: строки уходят во временную таблицу одним потоком,
+# затем set-based INSERT ... SELECT с тем же ON CONFLICT (title) DO NOTHING
+_COPY_STAGE_SQL = """
+    CREATE TEMP TABLE ideas_import (
+        id uuid, title text, description text, tags json, domain text, generated_for_domains json
+    ) ON COMMIT DROP
+"""
+_COPY_INSERT_SQL = text("""
+    INSERT INTO ideas (id, title, description, tags, domain, generated_for_domains)
+    SELECT DISTINCT ON (title) id, title, description, tags, domain, generated_for_domains
+    FROM ideas_import
+    ORDER BY title
+    ON CONFLICT (title) DO NOTHING
+    RETURNING ideas.*
+""")
+
+
+def copy_ideas(db: Session, ideas_data: Iterable[IdeaCreate]) -> List[Idea]:
+    """Большой импорт идей через COPY FROM STDIN: три обращения к БД при любом объёме"""
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
     for idea_data in ideas_data:
-        # Проверяем дубликаты
-        existing = db.query(Idea).filter(Idea.title == idea_data.title).first()
-        if existing:
-            continue
-            
-        idea = Idea(
-            id=uuid.uuid4(),
-            title=idea_data.title,
-            description=idea_data.description,
-            tags=idea_data.tags,
-            domain=idea_data.domain,
-            generated_for_domains=idea_data.generated_for_domains
-        )
-        
-        db.add(idea)
-        created_ideas.append(idea)
+        writer.writerow([
+            uuid.uuid4(),
+            idea_data.title,
+            idea_data.description,
+            json.dumps(idea_data.tags, ensure_ascii=False),
+            idea_data.domain,
+            json.dumps(idea_data.generated_for_domains, ensure_ascii=False)
+            if idea_data.generated_for_domains is not None else "",
+        ])
+    buffer.seek(0)
     
-    if created_ideas:
-        db.commit()
-        for idea in created_ideas:
-            db.refresh(idea)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute(_COPY_STAGE_SQL)
+        cursor.copy_expert(
+            "COPY ideas_import (id, title, description, tags, domain, generated_for_domains) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
     
-    return created_ideas 
\ No newline at end of file
+    created_ideas = _detach(db, db.scalars(select(Idea).from_statement(_COPY_INSERT_SQL)).all())
+    bump_domain_counters(db, [idea.domain for idea in created_ideas])
+    db.commit()
+    _register_ideas(created_ideas)
+    return created_ideas
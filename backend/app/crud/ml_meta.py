@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from sqlalchemy.orm import Session
 from ..models import MLModelMeta
 
@@ -7,7 +7,7 @@ def upsert_meta(db: Session, accuracy: float, precision: float, recall: float, f
     if not meta:
         meta = MLModelMeta(id="current")
         db.add(meta)
-    meta.trained_at = datetime.utcnow()
+    meta.trained_at = datetime.now(timezone.utc)
     meta.accuracy = accuracy
     meta.precision = precision
     meta.recall = recall
@@ -15,4 +15,49 @@ def upsert_meta(db: Session, accuracy: float, precision: float, recall: float, f
     meta.roc_auc = roc_auc
     meta.model_path = model_path
     db.commit()
-    return meta 
\ No newline at end of file
+    return meta 
+
+
+def get_latest_model_version(db: Session) -> MLModelMeta | None:
+    """Последняя зарегистрированная версия модели"""
+    return (
+        db.query(MLModelMeta)
+        .filter(MLModelMeta.version.isnot(None))
+        .order_by(MLModelMeta.version.desc())
+        .first()
+    )
+
+
+def record_model_version(
+    db: Session,
+    metrics: dict,
+    model_path: str,
+    training_mode: str,
+    training_rows: int,
+    watermark: tuple | None,
+    details: dict | None = None,
+) -> MLModelMeta:
+    """Регистрирует новую версию модели вместе с водяным знаком свайпов"""
+    latest = get_latest_model_version(db)
+    version = (latest.version if latest else 0) + 1
+    watermark_at, watermark_id = watermark or (None, None)
+
+    meta = MLModelMeta(
+        id=f"v{version}",
+        version=version,
+        trained_at=datetime.now(timezone.utc),
+        accuracy=metrics.get("accuracy"),
+        precision=metrics.get("precision"),
+        recall=metrics.get("recall"),
+        f1=metrics.get("f1"),
+        roc_auc=metrics.get("roc_auc"),
+        model_path=model_path,
+        training_mode=training_mode,
+        training_rows=training_rows,
+        swipe_watermark_at=watermark_at,
+        swipe_watermark_id=watermark_id,
+        details=details,
+    )
+    db.add(meta)
+    db.commit()
+    return meta
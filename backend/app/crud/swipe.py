@@ -1,41 +1,142 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from typing import List
+from sqlalchemy import Boolean, and_, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
 import uuid
 
 from ..models import Swipe, Idea
+from .counters import count_swipes
+from ..ml.popularity import popularity_index
+from ..ml.user_index import user_neighbor_index
 from ..schemas.swipe import SwipeCreate
 
 
-def create_swipe(db: Session, user_id: uuid.UUID, swipe_data: SwipeCreate) -> Swipe:
-    """Создает новый свайп пользователя"""
+class SwipeWrite(NamedTuple):
+    """Результат upsert свайпа вместе с полями идеи, нужными in-memory индексам"""
+    id: uuid.UUID
+    user_id: uuid.UUID
+    idea_id: uuid.UUID
+    swipe: bool
+    created_at: datetime
+    previous: Optional[bool]  # прежнее значение при повторном свайпе, None — свайп новый
+    domain: str
+    title: str
+    tags: List[str]
+
+
+# Проверка идеи и доменов, прежние значения и upsert — один оператор для свайпов любых
+# пользователей. Идеи, которых нет или которые не из выбранных доменов пользователя
+# (если домены выбраны), просто не вставляются
+_UPSERT_SWIPES_SQL = text("""
+    WITH input AS (
+        SELECT * FROM unnest(:ids, :user_ids, :idea_ids, :swipes) AS s(id, user_id, idea_id, swipe)
+    ),
+    src AS (
+        SELECT input.id, input.user_id, input.swipe, i.id AS idea_id, i.domain, i.title, i.tags
+        FROM input
+        JOIN ideas i ON i.id = input.idea_id
+        JOIN users u ON u.id = input.user_id
+        WHERE CASE
+            WHEN json_typeof(u.selected_domains) = 'array' AND json_array_length(u.selected_domains) > 0
+                THEN i.domain IN (SELECT json_array_elements_text(u.selected_domains))
+            ELSE true
+        END
+    ),
+    prev AS (
+        SELECT s.user_id, s.idea_id, s.swipe
+        FROM swipes s
+        JOIN src ON src.user_id = s.user_id AND src.idea_id = s.idea_id
+    ),
+    upserted AS (
+        INSERT INTO swipes (id, user_id, idea_id, swipe)
+        SELECT src.id, src.user_id, src.idea_id, src.swipe FROM src
+        ON CONFLICT ON CONSTRAINT unique_swipe_user_idea DO UPDATE SET
+            swipe = EXCLUDED.swipe,
+            -- created_at остаётся временем первого свайпа; updated_at — только при смене значения
+            updated_at = CASE WHEN swipes.swipe IS DISTINCT FROM EXCLUDED.swipe THEN now() ELSE swipes.updated_at END
+        RETURNING swipes.id, swipes.user_id, swipes.idea_id, swipes.swipe, swipes.created_at
+    )
+    SELECT up.id, up.user_id, up.idea_id, up.swipe, up.created_at,
+           prev.swipe AS previous, src.domain, src.title, src.tags
+    FROM upserted up
+    JOIN src ON src.user_id = up.user_id AND src.idea_id = up.idea_id
+    LEFT JOIN prev ON prev.user_id = up.user_id AND prev.idea_id = up.idea_id
+""").bindparams(
+    bindparam("ids", type_=ARRAY(UUID(as_uuid=True))),
+    bindparam("user_ids", type_=ARRAY(UUID(as_uuid=True))),
+    bindparam("idea_ids", type_=ARRAY(UUID(as_uuid=True))),
+    bindparam("swipes", type_=ARRAY(Boolean)),
+)
+
+
+def upsert_swipe_events(
+    db: Session,
+    events: Sequence[Tuple[uuid.UUID, uuid.UUID, bool]],
+    commit: bool = True,
+) -> Dict[Tuple[uuid.UUID, uuid.UUID], SwipeWrite]:
+    """Записывает свайпы (user_id, idea_id, swipe) одним INSERT ... ON CONFLICT DO UPDATE.
     
-    # Проверяем, не было ли уже свайпа этой идеи этим пользователем
-    existing_swipe = db.query(Swipe).filter(
-        and_(
-            Swipe.user_id == user_id,
-            Swipe.idea_id == swipe_data.idea_id
-        )
-    ).first()
+    Повторный свайп той же пары — побеждает последний. Счётчики статистики
+    обновляются в той же транзакции. Возвращает записанные свайпы по
+    (user_id, idea_id); отклонённых пар в результате нет. С commit=False
+    транзакцию завершает вызывающий, и сигналы индексам отправляет он же.
+    """
+    
+    latest = {(user_id, idea_id): swipe for user_id, idea_id, swipe in events}
+    if not latest:
+        return {}
     
-    if existing_swipe:
-        # Обновляем существующий свайп
-        existing_swipe.swipe = swipe_data.swipe
+    rows = db.execute(_UPSERT_SWIPES_SQL, _swipe_params(latest)).all()
+    writes = {(row.user_id, row.idea_id): SwipeWrite(*row) for row in rows}
+    count_swipes(db, writes.values())
+    
+    if commit:
         db.commit()
-        db.refresh(existing_swipe)
-        return existing_swipe
+        record_swipe_signals(writes.values())
+    return writes
+
+
+def _swipe_params(latest: Dict[Tuple[uuid.UUID, uuid.UUID], bool]) -> dict:
+    return {
+        "ids": [uuid.uuid4() for _ in latest],
+        "user_ids": [user_id for user_id, _ in latest],
+        "idea_ids": [idea_id for _, idea_id in latest],
+        "swipes": list(latest.values()),
+    }
+
+
+def upsert_swipes(db: Session, user_id: uuid.UUID, swipes: Sequence[SwipeCreate]) -> List[SwipeWrite]:
+    """Пачка свайпов пользователя одним оператором и одним commit, в порядке запроса"""
     
-    # Создаем новый свайп
-    swipe = Swipe(
-        user_id=user_id,
-        idea_id=swipe_data.idea_id,
-        swipe=swipe_data.swipe
-    )
+    writes = upsert_swipe_events(db, [(user_id, swipe.idea_id, swipe.swipe) for swipe in swipes])
+    idea_ids = dict.fromkeys(swipe.idea_id for swipe in swipes)
+    return [writes[(user_id, idea_id)] for idea_id in idea_ids if (user_id, idea_id) in writes]
+
+
+def create_swipe(db: Session, user_id: uuid.UUID, swipe_data: SwipeCreate) -> Optional[SwipeWrite]:
+    """Создает или обновляет свайп пользователя; None — идеи нет или она не из его доменов"""
     
-    db.add(swipe)
-    db.commit()
-    db.refresh(swipe)
-    return swipe
+    writes = upsert_swipes(db, user_id, [swipe_data])
+    return writes[0] if writes else None
+
+
+def record_swipe_signals(writes: Iterable[SwipeWrite]):
+    """Отправляет закоммиченные свайпы in-memory индексам"""
+    for write in writes:
+        _record_swipe_signals(write)
+
+
+def _record_swipe_signals(write: SwipeWrite):
+    """Обновляет in-memory индексы популярности и соседей"""
+    popularity_index.record_swipe(write.idea_id, write.swipe, previous=write.previous, created_at=write.created_at)
+    # SwipeWrite несёт domain, title и tags идеи — этого достаточно индексу соседей
+    user_neighbor_index.record_swipe(write.user_id, write, write.swipe, previous=write.previous)
+
+
+def has_user_swiped(db: Session, user_id: uuid.UUID) -> bool:
+    """Есть ли у пользователя хотя бы один свайп (иначе — cold-start)"""
+    return db.query(db.query(Swipe).filter(Swipe.user_id == user_id).exists()).scalar()
 
 
 def get_user_swipes(
@@ -44,18 +145,22 @@ def get_user_swipes(
     skip: int = 0,
     limit: int = 50,
     liked_only: bool = False
-) -> List[Swipe]:
-    """Получает свайпы пользователя с присоединенными идеями"""
+) -> List:
+    """Получает свайпы пользователя вместе с заголовком и тегами идеи — одним запросом"""
     
-    query = db.query(Swipe).filter(Swipe.user_id == user_id)
+    query = db.query(
+        Swipe.id,
+        Swipe.user_id,
+        Swipe.idea_id,
+        Swipe.swipe,
+        Idea.title.label("idea_title"),
+        Idea.tags.label("idea_tags"),
+    ).join(Idea, Swipe.idea_id == Idea.id).filter(Swipe.user_id == user_id)
     
     if liked_only:
         query = query.filter(Swipe.swipe == True)
     
-    # Присоединяем идеи для получения полной информации
-    query = query.join(Idea, Swipe.idea_id == Idea.id)
-    
-    return query.offset(skip).limit(limit).all()
+    return query.order_by(Swipe.created_at.desc()).offset(skip).limit(limit).all()
 
 
 def get_user_likes(db: Session, user_id: uuid.UUID) -> List[Swipe]:
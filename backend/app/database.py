@@ -1,8 +1,15 @@
-from typing import Generator
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Generator, Iterator
 
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+import zlib
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from .base import Base  # noqa: F401 — реэкспорт для main.py и Alembic
+from .config import get_settings
 
 
 # Читаем URL базы данных из переменных окружения, чтобы совпадало с Alembic/Render
@@ -19,7 +26,30 @@ engine = create_engine(
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
+
+def _async_database_url(url: str) -> str:
+    """URL для asyncpg: тот же сервер, драйвер postgresql+asyncpg, sslmode -> ssl"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "postgresql":
+        return url
+    query = dict(parsed.query)
+    if "sslmode" in query:
+        query["ssl"] = query.pop("sslmode")
+    return parsed.set(drivername="postgresql+asyncpg", query=query).render_as_string(hide_password=False)
+
+
+# Async-движок рядом с синхронным: горячие эндпоинты ждут Postgres, не занимая поток из пула
+_settings = get_settings()
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_database_url(DATABASE_URL)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=_settings.DATABASE_ASYNC_POOL_SIZE,
+    max_overflow=_settings.DATABASE_ASYNC_MAX_OVERFLOW,
+)
+# expire_on_commit=False: после commit объекты не перечитываются (ленивой загрузки в async нет)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 
 def get_db() -> Generator:
@@ -30,6 +60,48 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Async-сессия на запрос (asyncpg)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _call_with_session(fn: Callable[..., Any], *args) -> Any:
+    with SessionLocal() as db:
+        return fn(db, *args)
+
+
+async def run_with_sync_session(fn: Callable[..., Any], *args) -> Any:
+    """Выполняет fn(db, *args) в пуле потоков с собственной синхронной сессией.
+
+    Для CPU-тяжёлого кода (модель, in-memory индексы): AsyncSession.run_sync
+    выполнил бы его в потоке цикла событий и остановил бы все запросы процесса.
+    """
+    return await run_in_threadpool(_call_with_session, fn, *args)
+
+
+@contextmanager
+def try_advisory_lock(name: str) -> Iterator[bool]:
+    """Неблокирующая advisory-блокировка Postgres на время блока (одна на все процессы).
+
+    Отдаёт True, если блокировка получена. На других СУБД всегда True.
+    """
+    if engine.dialect.name != "postgresql":
+        yield True
+        return
+
+    key = zlib.crc32(name.encode("utf-8"))
+    with engine.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+                conn.commit()
+
+
 # Автоматически создаём таблицы при первом запуске, если Alembic ещё не применён
 # Это безопасно: create_all создаёт только отсутствующие объекты и не трогает существующие
 from . import models  # noqa: E402 — регистрирует все ORM-модели
@@ -4,10 +4,13 @@ from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from .auth_cache import token_cache, user_cache
 from .config import get_settings
-from .database import get_db
+from .database import get_async_db, get_db
 from .models import User
 
 settings = get_settings()
@@ -28,24 +31,86 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    """Получает текущего пользователя из JWT токена"""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def _email_from_token(token: str) -> str:
+    """Email (sub) из JWT токена; 401, если токен невалиден. Проверенные токены кэшируются до exp"""
+    email = token_cache.get(token)
+    if email is not None:
+        return email
     
     try:
         payload = jwt.decode(token, settings.SECRET_KEY.get_secret_value(), algorithms=[settings.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
-            raise credentials_exception
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    
+    token_cache.remember(token, email, payload)
+    return email
+
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+    """Получает текущего пользователя из JWT токена (профиль — из user_cache, если он свежий).
+    
+    Профиль из кэша может отставать на AUTH_USER_CACHE_TTL_SECONDS: роуты, которые
+    читают и меняют его, используют get_current_user_for_update.
+    """
+    email = _email_from_token(token)
     
+    user = user_cache.build(email)
+    if user is not None:
+        # Привязываем к сессии запроса без SELECT: изменения профиля сохраняются как обычно
+        db.add(user)
+        return user
+    
+    generation = user_cache.generation()
     user = db.query(User).filter(User.email == email).first()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    
+    user_cache.remember(user, generation)
+    return user
+
+
+def get_current_user_for_update(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+    """Текущий пользователь, перечитанный из БД с блокировкой строки (SELECT ... FOR UPDATE).
+    
+    Для роутов read-modify-write профиля: кэш может быть устаревшим и в других
+    процессах не инвалидируется, а блокировка упорядочивает параллельные изменения
+    до commit. После commit роут вызывает user_cache.invalidate.
+    """
+    email = _email_from_token(token)
+    
+    user = db.query(User).filter(User.email == email).with_for_update().first()
+    if user is None:
+        raise _credentials_exception()
+    return user
+
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db),
+) -> User:
+    """Текущий пользователь для async-роутеров: тот же JWT и кэш, запрос через asyncpg"""
+    email = _email_from_token(token)
+    
+    user = user_cache.build(email)
+    if user is not None:
+        db.add(user)
+        return user
+    
+    generation = user_cache.generation()
+    user = await db.scalar(select(User).where(User.email == email))
+    if user is None:
+        raise _credentials_exception()
     
-    return user 
\ No newline at end of file
+    user_cache.remember(user, generation)
+    return user
@@ -1,7 +1,18 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .routers import auth, ideas, swipes, ml, recommendations
+from .config import get_settings
+from .routers import auth, ideas, swipes, ml, recommendations, metrics
+from .tasks.ml_scheduler import start_scheduler, shutdown_scheduler
+from .ml.near_duplicates import near_duplicate_index
+from .ml.seen_sets import seen_sets
+from .ml.user_index import user_neighbor_index
+from .tasks.write_behind import start_write_behind, shutdown_write_behind
+from .tasks.idea_pool import start_idea_pool, shutdown_idea_pool
+from .sql_metrics import instrument_engine, track_sql
+from .passwords import password_hasher
+
+settings = get_settings()
 
 app = FastAPI(
     title="SmartSwipe API",
@@ -23,10 +34,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# SQL по запросам: Server-Timing, сводка /api/metrics/sql и предупреждения о N+1
+if settings.SQL_METRICS_ENABLED:
+    app.middleware("http")(track_sql)
+
 # ---- ensure tables exist (fallback when Alembic not executed) ----
-from .database import Base, engine
+from .database import Base, SessionLocal, async_engine, engine
+from .crud.counters import ensure_counters
 
 
 @app.on_event("startup")
@@ -37,11 +54,84 @@ def _create_tables_if_missing():
     except Exception as exc:
         print(f"[DB] create_all failed: {exc}")
 
+
+if settings.SQL_METRICS_ENABLED:
+    instrument_engine(engine)
+    instrument_engine(async_engine.sync_engine)
+
+
+@app.on_event("startup")
+def _fill_stats_counters():
+    db = SessionLocal()
+    try:
+        ensure_counters(db)
+    except Exception as exc:
+        print(f"[DB] stats counters check failed: {exc}")
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def _start_ml_scheduler():
+    start_scheduler()
+
+
+@app.on_event("shutdown")
+def _stop_ml_scheduler():
+    shutdown_scheduler()
+
+
+# Write-behind свайпов и просмотров: при остановке очередь сбрасывается до снимка множеств
+@app.on_event("startup")
+def _start_write_behind():
+    start_write_behind()
+
+
+@app.on_event("shutdown")
+def _stop_write_behind():
+    shutdown_write_behind()
+
+
+# Пул идей по доменам: фоновое пополнение по нижней границе
+@app.on_event("startup")
+def _start_idea_pool():
+    start_idea_pool()
+
+
+@app.on_event("shutdown")
+def _stop_idea_pool():
+    shutdown_idea_pool()
+
+
+# Пул процессов bcrypt (создаётся при первом логине)
+@app.on_event("shutdown")
+def _stop_password_pool():
+    password_hasher.shutdown()
+
+
+# Фоновый пересчёт соседей пользователей (запускается при первом свайпе)
+@app.on_event("shutdown")
+def _stop_user_index():
+    user_neighbor_index.stop()
+
+
+# Множества просмотренного: прогрев из снимка и снимок при остановке
+@app.on_event("startup")
+def _restore_seen_sets():
+    seen_sets.restore()
+
+
+@app.on_event("shutdown")
+def _snapshot_seen_sets():
+    seen_sets.snapshot()
+    near_duplicate_index.snapshot()
+
 # Подключаем роутеры с /api префиксом
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(ideas.router, prefix="/api/ideas", tags=["ideas"])
 app.include_router(swipes.router, prefix="/api/swipes", tags=["swipes"])
 app.include_router(ml.router, prefix="/api/ml", tags=["ml"])
+app.include_router(metrics.router, prefix="/api/metrics", tags=["metrics"])
 app.include_router(recommendations.router, prefix="/api/recommendations", tags=["recommendations"])
 
 
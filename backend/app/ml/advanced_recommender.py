@@ -5,21 +5,63 @@
 
 import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.model_selection import train_test_split, cross_val_score
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
+from sklearn.base import clone
 import joblib
+import copy
 import os
 from typing import List, Dict, Tuple, Optional
 import uuid
 from datetime import datetime
 
+from sqlalchemy import case, exists, func, or_, select
+from sqlalchemy.orm import aliased
+
+from ..config import get_settings
 from ..models import User, Idea, Swipe, IdeaView
-from ..crud.swipe import get_user_likes, get_user_swipe_history
+from .training_data import (
+    FEATURE_NAMES,
+    TrainingMatrix,
+    fill_feature_rows,
+    Watermark,
+    iter_idea_text_chunks,
+    iter_training_chunks,
+    latest_watermark,
+    load_delta_user_ids,
+    load_training_cache,
+    load_training_matrix,
+    load_training_matrix_parallel,
+    load_user_stats,
+    merge_training_delta,
+    resample_training_matrix,
+    rows_created_until,
+    save_training_cache,
+    SwipeKey,
+    training_cache_path,
+)
+from .diversity import rerank
+from .explain import build_explainer
+from .evaluation import evaluate_model, load_evaluation_set
+from .model_search import successive_halving
+from .popularity import popularity_index
+from .user_index import user_neighbor_index
+
+settings = get_settings()
+
+# Контентные векторы для разнообразия, пока TF-IDF не обучен
+_hashing_vectorizer = HashingVectorizer(n_features=2 ** 10, alternate_sign=False, stop_words='english')
+
+# Состояние, которое обучение заменяет целиком (snapshot_ensemble хранит ссылки)
+_REPLACED_ON_TRAINING = (
+    'domain_encoder', 'tfidf_vectorizer', 'tfidf_matrix', 'content_similarity_matrix', 'ideas_df',
+    'training_matrix', 'training_watermark', 'training_rows', 'training_positive_rate', 'training_sampling_rate',
+)
 
 
 class AdvancedRecommender:
@@ -33,6 +75,7 @@ class AdvancedRecommender:
         self.content_model = None
         self.user_model = None
         self.ensemble_model = None
+        self.explainer = None
         
         # Предобработчики
         self.tfidf_vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
@@ -40,187 +83,305 @@ class AdvancedRecommender:
         self.scaler = StandardScaler()
         
         # Матрицы сходства
+        self.tfidf_matrix = None
         self.content_similarity_matrix = None
-        self.user_similarity_matrix = None
+        
+        # Соседи пользователей (вместо плотной матрицы users × users)
+        self.user_index = user_neighbor_index
         
         # Метаданные
         self.ideas_df = None
-        self.users_df = None
         self.training_metrics = {}
         
-    
-    def _prepare_idea_features(self, ideas: List[Idea]) -> pd.DataFrame:
-        """Подготавливает признаки идей"""
+        # Состояние последнего обучения ensemble (пишется в реестр моделей)
+        self.training_matrix: Optional[TrainingMatrix] = None  # матрица последнего обучения (не по пачкам)
+        self.best_model_name = None
+        self.training_watermark = None
+        self.training_rows = 0
+        self.training_delta_rows = None
+        self.training_positive_rate = None
+        self.training_sampling_rate = 1.0
         
-        data = []
-        for idea in ideas:
-            # Объединяем title, description, tags в один текст
-            combined_text = f"{idea.title} {idea.description} {' '.join(idea.tags)}"
-            
-            data.append({
-                'id': str(idea.id),
-                'title': idea.title,
-                'description': idea.description,
-                'tags': idea.tags,
-                'domain': idea.domain,
-                'combined_text': combined_text,
-                'text_length': len(combined_text),
-                'tag_count': len(idea.tags),
-                'created_at': idea.created_at
-            })
-        
-        df = pd.DataFrame(data)
+    
+    def _prepare_idea_features(self, db_session) -> pd.DataFrame:
+        """Подготавливает признаки идей (потоково, без ORM-объектов)"""
+        
+        ids, domains, texts, text_lengths, tag_counts = [], [], [], [], []
+        for rows in iter_idea_text_chunks(
+            db_session, settings.ML_TRAINING_CHUNK_SIZE, limit=settings.ML_CONTENT_MAX_IDEAS
+        ):
+            for idea_id, domain, title, description, tags in rows:
+                # Объединяем title, description, tags в один текст
+                combined_text = f"{title} {description} {' '.join(tags)}"
+                ids.append(str(idea_id))
+                domains.append(domain)
+                texts.append(combined_text)
+                text_lengths.append(len(combined_text))
+                tag_counts.append(len(tags))
+        
+        df = pd.DataFrame({
+            'id': ids,
+            'domain': domains,
+            'text_length': text_lengths,
+            'tag_count': tag_counts,
+        })
         
         if len(df) > 0:
-            # Кодируем домены
-            df['domain_encoded'] = self.domain_encoder.fit_transform(df['domain'])
-            
-            # TF-IDF для текста
-            tfidf_matrix = self.tfidf_vectorizer.fit_transform(df['combined_text'])
+            # Новые объекты, а не fit на месте: прежние остаются в snapshot_ensemble для отката
+            # Кодируем домены по полному списку доменов каталога
+            all_domains = db_session.execute(select(Idea.domain).distinct()).scalars().all()
+            self.domain_encoder = LabelEncoder().fit(all_domains)
+            df['domain_encoded'] = self.domain_encoder.transform(df['domain'])
             
-            # Добавляем TF-IDF как признаки
-            tfidf_df = pd.DataFrame(
-                tfidf_matrix.toarray(),
-                columns=[f'tfidf_{i}' for i in range(tfidf_matrix.shape[1])]
-            )
-            
-            df = pd.concat([df.reset_index(drop=True), tfidf_df], axis=1)
+            # TF-IDF для текста остаётся разреженным
+            vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+            self.tfidf_matrix = vectorizer.fit_transform(texts)
+            self.tfidf_vectorizer = vectorizer
         
         return df
     
     
-    def _prepare_user_features(self, db_session, users: List[User]) -> pd.DataFrame:
-        """Подготавливает признаки пользователей"""
-        
-        data = []
-        for user in users:
-            # Получаем статистику пользователя
-            user_likes = get_user_likes(db_session, user.id)
-            user_history = get_user_swipe_history(db_session, user.id)
-            
-            # Статистика доменов
-            liked_domains = [like.idea.domain for like in user_likes if like.idea]
-            domain_stats = {}
-            for domain in set(liked_domains):
-                domain_stats[f'liked_{domain}'] = liked_domains.count(domain)
-            
-            # Общая статистика
-            total_swipes = len(user_history)
-            total_likes = len(user_likes)
-            like_ratio = total_likes / total_swipes if total_swipes > 0 else 0
-            
-            # Средняя длина тегов в лайкнутых идеях
-            avg_tags_per_like = np.mean([len(like.idea.tags) for like in user_likes if like.idea]) if user_likes else 0
-            
-            # Доля лайкнутых доменов
-            user_domains = user.selected_domains or []
-            liked_domains_ratio = len(set(liked_domains)) / len(user_domains) if user_domains else 0
-            
-            user_data = {
-                'id': str(user.id),
-                'total_swipes': total_swipes,
-                'total_likes': total_likes,
-                'like_ratio': like_ratio,
-                'avg_tags_per_like': avg_tags_per_like,
-                'liked_domains_ratio': liked_domains_ratio,
-                'swipe_history_length': total_swipes,
-                'selected_domains_count': len(user_domains),
-                **domain_stats
-            }
-            
-            data.append(user_data)
-        
-        return pd.DataFrame(data)
+    def _domain_codes(self) -> Dict[str, int]:
+        """Коды доменов из обученного domain_encoder"""
+        if not hasattr(self.domain_encoder, 'classes_'):
+            return {}
+        return {domain: code for code, domain in enumerate(self.domain_encoder.classes_)}
     
     
-    def _prepare_training_data(self, db_session) -> Tuple[np.ndarray, np.ndarray]:
-        """Подготавливает данные для обучения"""
+    def _prepare_training_data(self, db_session, since: Optional[Watermark] = None) -> TrainingMatrix:
+        """Подготавливает данные для обучения.
+        
+        С since дочитываются только свайпы, появившиеся или изменившиеся после
+        водяного знака, и вносятся в кэшированную матрицу; без кэша (или при
+        смене доменов) — полная загрузка.
+        """
+        
+        domain_codes = self._domain_codes()
+        cache_path = training_cache_path(self.model_dir)
+        # Снимок до чтения: изменения во время загрузки войдут в следующую дельту
+        until = latest_watermark(db_session)
+        
+        cached = load_training_cache(cache_path) if since is not None else None
+        if (
+            cached is not None
+            and cached[0].watermark == since
+            and cached[0].row_order is not None
+            and cached[1] == list(domain_codes)
+        ):
+            delta_stats = load_user_stats(db_session, load_delta_user_ids(db_session, since, until), until=until)
+            delta = load_training_matrix(
+                db_session,
+                domain_codes,
+                chunk_size=settings.ML_TRAINING_CHUNK_SIZE,
+                max_rows=settings.ML_TRAINING_MAX_ROWS,
+                since=since,
+                until=until,
+                user_stats=delta_stats,
+                with_order=True,
+            )
+            # С выборкой кэш — выборка по всей истории: не усекаем его по времени,
+            # а ужимаем вместе с дельтой до бюджета по сохранённым ключам A-Res
+            max_rows = len(cached[0].y) + len(delta.y) if settings.ML_TRAINING_SAMPLE_BUDGET else settings.ML_TRAINING_MAX_ROWS
+            matrix = merge_training_delta(cached[0], delta, max_rows, delta_stats)
+            if settings.ML_TRAINING_SAMPLE_BUDGET:
+                matrix = resample_training_matrix(
+                    matrix, settings.ML_TRAINING_SAMPLE_BUDGET, settings.ML_SAMPLE_HEAVY_USER_ALPHA
+                )
+            self.training_delta_rows = len(delta.y)
+            print(f"🔁 Инкрементальная загрузка: {len(delta.y)} новых и изменённых свайпов")
+        else:
+            if since is not None:
+                print("⚠️ Кэш матрицы признаков не совпадает с реестром — полная загрузка")
+            n_workers = settings.ML_FEATURE_WORKERS or os.cpu_count() or 1
+            if n_workers > 1:
+                matrix = load_training_matrix_parallel(
+                    db_session,
+                    domain_codes,
+                    chunk_size=settings.ML_TRAINING_CHUNK_SIZE,
+                    max_rows=settings.ML_TRAINING_MAX_ROWS,
+                    n_workers=n_workers,
+                    until=until,
+                    sample_budget=settings.ML_TRAINING_SAMPLE_BUDGET,
+                    heavy_user_alpha=settings.ML_SAMPLE_HEAVY_USER_ALPHA,
+                )
+            else:
+                matrix = load_training_matrix(
+                    db_session,
+                    domain_codes,
+                    chunk_size=settings.ML_TRAINING_CHUNK_SIZE,
+                    max_rows=settings.ML_TRAINING_MAX_ROWS,
+                    sample_budget=settings.ML_TRAINING_SAMPLE_BUDGET,
+                    heavy_user_alpha=settings.ML_SAMPLE_HEAVY_USER_ALPHA,
+                    until=until,
+                    with_order=True,
+                )
+            self.training_delta_rows = None
+        
+        # Кэш пишет publish_training_cache, когда версия принята
+        return matrix
+    
+    
+    def content_is_current(self, db_session) -> bool:
+        """TF-IDF обучен, а коды доменов покрывают домены каталога — пересборка не нужна.
         
-        # Получаем все свайпы
-        swipes = db_session.query(Swipe).join(Idea).join(User).all()
+        Новые идеи получают векторы через transform обученного TF-IDF (content_vectors).
+        """
         
-        training_data = []
-        labels = []
+        if not hasattr(self.tfidf_vectorizer, 'vocabulary_'):
+            return False
+        domains = db_session.execute(select(Idea.domain).distinct()).scalars().all()
+        return sorted(domains) == list(self._domain_codes())
+    
+    
+    def publish_training_cache(self):
+        """Сохраняет матрицу последнего обучения как кэш для следующего инкрементального.
         
-        for swipe in swipes:
-            if not swipe.idea or not swipe.user:
-                continue
-                
-            # Признаки идеи
-            idea = swipe.idea
-            combined_text = f"{idea.title} {idea.description} {' '.join(idea.tags)}"
-            
-            # Признаки пользователя
-            user = swipe.user
-            user_likes = get_user_likes(db_session, user.id)
-            user_history = get_user_swipe_history(db_session, user.id)
-            
-            # Вектор признаков
-            features = [
-                # Признаки идеи
-                len(combined_text),  # длина текста
-                len(idea.tags),      # количество тегов
-                self.domain_encoder.fit_transform([idea.domain])[0] if hasattr(self.domain_encoder, 'classes_') else 0,
-                
-                # Признаки пользователя
-                len(user_history),   # история свайпов
-                len(user_likes),     # количество лайков
-                len(user_likes) / len(user_history) if user_history else 0,  # соотношение лайков
-                len(user.selected_domains or []),  # количество выбранных доменов
-                
-                # Взаимодействие пользователь-идея
-                1 if idea.domain in (user.selected_domains or []) else 0,  # идея в доменах пользователя
-            ]
-            
-            training_data.append(features)
-            labels.append(1 if swipe.swipe else 0)
+        Вызывается после того, как версия принята: отклонённая не сдвигает водяной знак кэша.
+        """
         
-        return np.array(training_data), np.array(labels)
+        if self.training_matrix is not None:
+            save_training_cache(
+                training_cache_path(self.model_dir), self.training_matrix, list(self._domain_codes())
+            )
     
     
-    def train_content_based_model(self, ideas: List[Idea]):
+    def train_content_based_model(self, db_session):
         """Обучает content-based модель"""
         
-        self.ideas_df = self._prepare_idea_features(ideas)
+        self.ideas_df = self._prepare_idea_features(db_session)
         
         if len(self.ideas_df) < 2:
             print("❌ Недостаточно идей для content-based модели")
             return
         
-        # Создаем матрицу сходства по содержанию
-        tfidf_columns = [col for col in self.ideas_df.columns if col.startswith('tfidf_')]
-        if tfidf_columns:
-            tfidf_matrix = self.ideas_df[tfidf_columns].values
-            self.content_similarity_matrix = cosine_similarity(tfidf_matrix)
+        # Создаем матрицу сходства по содержанию (float32, не больше ML_CONTENT_MAX_IDEAS идей)
+        if self.tfidf_matrix is not None:
+            self.content_similarity_matrix = cosine_similarity(self.tfidf_matrix).astype(np.float32)
         
-        print(f"✅ Content-based модель обучена на {len(ideas)} идеях")
+        print(f"✅ Content-based модель обучена на {len(self.ideas_df)} идеях")
     
     
-    def train_user_based_model(self, db_session, users: List[User]):
-        """Обучает user-based модель"""
+    def train_user_based_model(self, db_session, user_ids: List[uuid.UUID]):
+        """Строит индекс k ближайших пользователей (user-based модель)"""
         
-        self.users_df = self._prepare_user_features(db_session, users)
-        
-        if len(self.users_df) < 2:
+        if len(user_ids) < 2:
             print("❌ Недостаточно пользователей для user-based модели")
             return
         
-        # Создаем матрицу сходства пользователей
-        feature_columns = ['like_ratio', 'avg_tags_per_like', 'liked_domains_ratio']
-        available_columns = [col for col in feature_columns if col in self.users_df.columns]
-        
-        if available_columns:
-            user_features = self.users_df[available_columns].fillna(0)
-            user_features_scaled = self.scaler.fit_transform(user_features)
-            self.user_similarity_matrix = cosine_similarity(user_features_scaled)
+        domains = list(self._domain_codes()) or db_session.execute(select(Idea.domain).distinct()).scalars().all()
+        self.user_index.build(
+            db_session,
+            user_ids,
+            load_user_stats(db_session, user_ids=user_ids),
+            domains,
+            chunk_size=settings.ML_TRAINING_CHUNK_SIZE,
+        )
         
-        print(f"✅ User-based модель обучена на {len(users)} пользователях")
+        print(f"✅ User-based модель обучена на {len(user_ids)} пользователях (k={self.user_index.k})")
     
     
-    def train_ensemble_model(self, db_session):
-        """Обучает ensemble модель"""
+    def neighbor_recommendations(self, db_session, user: User, limit: int = 10) -> List[Tuple[uuid.UUID, float]]:
+        """"Пользователи, похожие на вас, лайкнули": идеи соседей, которые пользователь ещё не видел.
+        
+        Скор идеи — сумма сходств соседей, которые её лайкнули.
+        """
+        
+        neighbors = self.user_index.neighbors_of(user.id)
+        if not neighbors:
+            return []
+        
+        similarity = dict(neighbors)
+        score = func.sum(case(similarity, value=Swipe.user_id, else_=0.0))
+        own = aliased(Swipe)
+        seen = or_(
+            exists().where(IdeaView.user_id == user.id, IdeaView.idea_id == Swipe.idea_id),
+            exists().where(own.user_id == user.id, own.idea_id == Swipe.idea_id),
+        )
+        stmt = (
+            select(Swipe.idea_id, score.label('score'))
+            .join(Idea, Swipe.idea_id == Idea.id)
+            .where(
+                Swipe.user_id.in_(list(similarity)),
+                Swipe.swipe.is_(True),
+                Idea.domain.in_(user.selected_domains or []),
+                ~seen,
+            )
+            .group_by(Swipe.idea_id)
+            .order_by(score.desc())
+            .limit(limit)
+        )
+        return [(idea_id, float(value)) for idea_id, value in db_session.execute(stmt)]
+    
+    
+    def _mark_single_class(self, positive_rate: float, samples: int):
+        """Фиксирует в метриках, что обучение невозможно из-за одного класса"""
+        
+        print("❌ Недостаточно классов для обучения (нужны и лайки, и дизлайки)")
+        # Сохраним пояснение в метриках, чтобы отдать его через /api/ml/metrics
+        self.training_metrics["ensemble"] = {
+            "error": "single_class",
+            "message": "Training requires at least two classes in swipe labels",
+            "positive_rate": positive_rate,
+            "samples": samples
+        }
+        # Модель не обучаем
+        self.ensemble_model = None
+        self.explainer = None
+    
+    
+    @property
+    def ensemble_model_path(self) -> str:
+        return os.path.join(self.model_dir, 'ensemble_model.joblib')
+    
+    
+    def _save_ensemble(self):
+        """Сохраняет ensemble модель, scaler и таблицы вкладов признаков на диск"""
+        
+        joblib.dump(self.ensemble_model, self.ensemble_model_path)
         
-        X, y = self._prepare_training_data(db_session)
+        # Вклады по путям деревьев считаются один раз здесь, а не на каждый запрос
+        self.explainer = build_explainer(self.ensemble_model, len(FEATURE_NAMES))
+        joblib.dump(self.explainer, os.path.join(self.model_dir, 'explainer.joblib'))
+        
+        scaler_path = os.path.join(self.model_dir, 'scaler.joblib')
+        joblib.dump(self.scaler, scaler_path)
+    
+    
+    def train_ensemble_model(
+        self,
+        db_session,
+        chunked: Optional[bool] = None,
+        since: Optional[Watermark] = None,
+        search: Optional[bool] = None,
+        previous_rows: Optional[int] = None,
+    ):
+        """Обучает ensemble модель.
+        
+        since — водяной знак предыдущей версии модели из реестра: при нём
+        загружаются только новые свайпы (инкрементальный режим).
+        search — поиск модели и гиперпараметров (successive halving) вместо
+        кросс-валидации трёх моделей с параметрами по умолчанию.
+        previous_rows — training_rows этой версии в реестре: от него считает
+        строки SGD-модель, дообучаемая по пачкам (в памяти счётчик после
+        перезапуска процесса начинается с нуля).
+        """
+        
+        self.best_model_name = None
+        if search is None:
+            search = settings.ML_MODEL_SEARCH
+        if chunked is None:
+            chunked = settings.ML_TRAINING_CHUNKED
+        if chunked:
+            return self._train_chunked_model(db_session, since=since, previous_rows=previous_rows)
+        
+        matrix = self.training_matrix = self._prepare_training_data(db_session, since=since)
+        X, y = matrix.X, matrix.y
+        self.training_watermark = matrix.watermark
+        self.training_rows = len(y)
+        self.training_positive_rate = float(y.mean()) if len(y) > 0 else None
+        self.training_sampling_rate = matrix.sampling_rate
+        if matrix.sampling_rate < 1.0:
+            print(f"🎯 Стратифицированная выборка: {len(y)} из {matrix.source_rows} свайпов ({matrix.sampling_rate:.1%})")
         
         if len(X) < 10:
             print("❌ Недостаточно данных для ensemble модели")
@@ -229,16 +390,7 @@ class AdvancedRecommender:
         # Проверяем, что в выборке есть как минимум два класса (и лайки, и дизлайки)
         unique_classes = np.unique(y)
         if unique_classes.shape[0] < 2:
-            print("❌ Недостаточно классов для обучения (нужны и лайки, и дизлайки)")
-            # Сохраним пояснение в метриках, чтобы отдать его через /api/ml/metrics
-            self.training_metrics["ensemble"] = {
-                "error": "single_class",
-                "message": "Training requires at least two classes in swipe labels",
-                "positive_rate": float(y.mean()) if len(y) > 0 else 0.0,
-                "samples": int(len(y))
-            }
-            # Модель не обучаем
-            self.ensemble_model = None
+            self._mark_single_class(float(y.mean()) if len(y) > 0 else 0.0, int(len(y)))
             return
         
         # Разделяем данные
@@ -248,6 +400,9 @@ class AdvancedRecommender:
         X_train_scaled = self.scaler.fit_transform(X_train)
         X_test_scaled = self.scaler.transform(X_test)
         
+        if search and self._search_ensemble_model(X_train_scaled, X_test_scaled, y_train, y_test):
+            return
+        
         # Обучаем несколько моделей
         models = {
             'logistic': LogisticRegression(random_state=42),
@@ -288,18 +443,230 @@ class AdvancedRecommender:
             if accuracy > best_score:
                 best_score = accuracy
                 best_model = model
+                self.best_model_name = name
         
         self.ensemble_model = best_model
+        self._save_ensemble()
         
-        # Сохраняем модель
-        model_path = os.path.join(self.model_dir, 'ensemble_model.joblib')
-        joblib.dump(self.ensemble_model, model_path)
+        print(f"✅ Ensemble модель обучена и сохранена. Лучшая точность: {best_score:.3f}")
+    
+    
+    def _search_ensemble_model(self, X_train, X_test, y_train, y_test) -> bool:
+        """Successive halving по семействам моделей и сеткам гиперпараметров.
+        
+        Конфигурации сравниваются на валидационной части обучающей выборки,
+        победитель дообучается на всей обучающей выборке (в том же бюджете
+        времени) и оценивается на тесте. Возвращает False, если поиск не дал
+        результата или дообучение не уложилось в бюджет.
+        """
+        
+        # Стратификация требует хотя бы двух строк каждого класса
+        _, class_counts = np.unique(y_train, return_counts=True)
+        X_fit, X_val, y_fit, y_val = train_test_split(
+            X_train, y_train, test_size=0.2, random_state=42,
+            stratify=y_train if class_counts.min() >= 2 else None,
+        )
+        n_workers = settings.ML_SEARCH_WORKERS or os.cpu_count() or 1
+        result = successive_halving(
+            X_fit, y_fit, X_val, y_val,
+            time_budget=settings.ML_SEARCH_TIME_BUDGET_SECONDS,
+            n_workers=n_workers,
+            eta=settings.ML_SEARCH_ETA,
+            min_resource=settings.ML_SEARCH_MIN_ROWS,
+            X_refit=X_train,
+            y_refit=y_train,
+        )
+        if result is None or result.model is None:
+            print("⚠️ Поиск модели не дал результата, обучаем модели по умолчанию")
+            return False
+        
+        model = result.model
+        y_pred = model.predict(X_test)
+        
+        accuracy = accuracy_score(y_test, y_pred)
+        f1 = f1_score(y_test, y_pred, zero_division=0)
+        self.training_metrics[result.family] = {
+            'accuracy': accuracy,
+            'precision': precision_score(y_test, y_pred, zero_division=0),
+            'recall': recall_score(y_test, y_pred, zero_division=0),
+            'f1': f1,
+            'params': result.params,
+            'search_score': result.score,
+            'search_rounds': result.rounds,
+            'search_evaluated': result.evaluated,
+            'search_candidates': result.candidates,
+            'search_seconds': round(result.elapsed, 2),
+            'search_budget_exhausted': result.budget_exhausted,
+        }
         
-        # Сохраняем scaler
-        scaler_path = os.path.join(self.model_dir, 'scaler.joblib')
-        joblib.dump(self.scaler, scaler_path)
+        self.ensemble_model = model
+        self.best_model_name = result.family
+        self._save_ensemble()
         
-        print(f"✅ Ensemble модель обучена и сохранена. Лучшая точность: {best_score:.3f}")
+        print(f"✅ Поиск модели: {result.family} {result.params}, {result.evaluated} обучений "
+              f"за {result.elapsed:.1f}с. Точность на тесте: {accuracy:.3f}, F1={f1:.3f}")
+        return True
+    
+    
+    def _train_chunked_model(
+        self,
+        db_session,
+        since: Optional[Watermark] = None,
+        holdout_every: int = 5,
+        previous_rows: Optional[int] = None,
+    ):
+        """Обучает модель по пачкам (partial_fit): память ограничена размером пачки.
+        
+        С since и уже обученной SGD-моделью в памяти дообучает её только на новых свайпах.
+        """
+        
+        self.training_matrix = None
+        until = latest_watermark(db_session)
+        
+        if since is not None and isinstance(self.ensemble_model, SGDClassifier):
+            return self._update_chunked_model(db_session, since, until, previous_rows)
+        
+        user_stats = load_user_stats(db_session, until=until)
+
+        samples = sum(s.total_swipes for s in user_stats.values())
+        likes = sum(s.total_likes for s in user_stats.values())
+        
+        if samples < 10:
+            print("❌ Недостаточно данных для ensemble модели")
+            return
+        if likes == 0 or likes == samples:
+            self._mark_single_class(likes / samples, samples)
+            return
+        
+        def chunks():
+            return iter_training_chunks(
+                db_session,
+                self._domain_codes(),
+                settings.ML_TRAINING_CHUNK_SIZE,
+                user_stats=user_stats,
+                until=until,
+            )
+        
+        def holdout_mask(offset: int, n: int) -> np.ndarray:
+            return (np.arange(offset, offset + n) % holdout_every) == 0
+        
+        # Проход 1 — статистики scaler, проход 2 — обучение, проход 3 — оценка.
+        # Каждая holdout_every-я строка уходит в отложенную выборку
+        self.scaler = StandardScaler()
+        for X_chunk, _ in chunks():
+            self.scaler.partial_fit(X_chunk)
+        
+        model = SGDClassifier(loss='log_loss', random_state=42)
+        classes = np.array([0, 1])
+        row_offset = 0
+        for X_chunk, y_chunk in chunks():
+            train_mask = ~holdout_mask(row_offset, len(y_chunk))
+            row_offset += len(y_chunk)
+            if train_mask.any():
+                model.partial_fit(self.scaler.transform(X_chunk[train_mask]), y_chunk[train_mask], classes=classes)
+        
+        tp = fp = fn = tn = 0
+        eval_offset = 0
+        for X_chunk, y_chunk in chunks():
+            test_mask = holdout_mask(eval_offset, len(y_chunk))
+            eval_offset += len(y_chunk)
+            if not test_mask.any():
+                continue
+            y_pred = model.predict(self.scaler.transform(X_chunk[test_mask]))
+            y_true = y_chunk[test_mask]
+            tp += int(((y_pred == 1) & (y_true == 1)).sum())
+            fp += int(((y_pred == 1) & (y_true == 0)).sum())
+            fn += int(((y_pred == 0) & (y_true == 1)).sum())
+            tn += int(((y_pred == 0) & (y_true == 0)).sum())
+        
+        evaluated = tp + fp + fn + tn
+        accuracy = (tp + tn) / evaluated if evaluated else 0.0
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        
+        self.training_metrics['sgd_chunked'] = {
+            'accuracy': accuracy,
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+            'samples': row_offset,
+            'chunk_size': settings.ML_TRAINING_CHUNK_SIZE
+        }
+        print(f"📊 sgd_chunked: Accuracy={accuracy:.3f}, F1={f1:.3f}")
+        
+        self.ensemble_model = model
+        self.best_model_name = 'sgd_chunked'
+        self.training_sampling_rate = 1.0
+        self.training_watermark = until
+        self.training_rows = row_offset
+        self.training_delta_rows = None
+        self._save_ensemble()
+        
+        print(f"✅ Ensemble модель обучена по пачкам и сохранена ({row_offset} строк)")
+    
+    
+    def _update_chunked_model(
+        self,
+        db_session,
+        since: Watermark,
+        until: Optional[Watermark],
+        previous_rows: Optional[int] = None,
+    ):
+        """Дообучает SGD-модель только на свайпах, появившихся или изменившихся после водяного знака.
+        
+        Scaler заморожен: сдвиг среднего и масштаба изменил бы смысл уже обученных
+        коэффициентов. Заново он обучается только при полном обучении. Агрегаты
+        читаются только для пользователей из дельты.
+        """
+        
+        user_stats = load_user_stats(db_session, load_delta_user_ids(db_session, since, until), until=until)
+        delta_rows = 0
+        for X_chunk, y_chunk in iter_training_chunks(
+            db_session,
+            self._domain_codes(),
+            settings.ML_TRAINING_CHUNK_SIZE,
+            user_stats=user_stats,
+            since=since,
+            until=until,
+        ):
+            self.ensemble_model.partial_fit(self.scaler.transform(X_chunk), y_chunk)
+            delta_rows += len(y_chunk)
+        
+        self.best_model_name = 'sgd_chunked'
+        self.training_sampling_rate = 1.0
+        self.training_watermark = until or since
+        self.training_rows = (self.training_rows if previous_rows is None else previous_rows) + delta_rows
+        self.training_delta_rows = delta_rows
+        self._save_ensemble()
+        
+        print(f"✅ SGD-модель дообучена на {delta_rows} новых и изменённых свайпах")
+    
+    
+    def _build_features(self, db_session, user: User, ideas: List[Idea]) -> np.ndarray:
+        """Матрица признаков пользователь × идеи: та же функция, что и при обучении"""
+        
+        user_stats = load_user_stats(db_session, user_ids=[user.id])
+        rows = [(user.id, False, idea.title, idea.description, idea.tags, idea.domain) for idea in ideas]
+        
+        X = np.empty((len(rows), len(FEATURE_NAMES)), dtype=np.float32)
+        fill_feature_rows(rows, user_stats, self._domain_codes(), X, np.empty(len(rows), dtype=np.int8))
+        return X
+    
+    
+    @staticmethod
+    def _confidence(probability: float) -> str:
+        return "high" if abs(probability - 0.5) > 0.3 else "medium" if abs(probability - 0.5) > 0.1 else "low"
+    
+    
+    def predict_batch(self, db_session, user: User, ideas: List[Idea]) -> Optional[np.ndarray]:
+        """Вероятности лайка для всех идей одним вызовом модели (None — модель не обучена)"""
+        
+        if not self.ensemble_model or not ideas:
+            return None
+        
+        X_scaled = self.scaler.transform(self._build_features(db_session, user, ideas))
+        return self.ensemble_model.predict_proba(X_scaled)[:, 1]
     
     
     def predict_user_preference(self, db_session, user: User, idea: Idea) -> Dict:
@@ -309,33 +676,11 @@ class AdvancedRecommender:
             return {"probability": 0.5, "confidence": "low", "method": "random"}
         
         try:
-            # Подготавливаем признаки
-            user_likes = get_user_likes(db_session, user.id)
-            user_history = get_user_swipe_history(db_session, user.id)
-            
-            combined_text = f"{idea.title} {idea.description} {' '.join(idea.tags)}"
-            
-            features = [
-                len(combined_text),
-                len(idea.tags),
-                self.domain_encoder.transform([idea.domain])[0] if hasattr(self.domain_encoder, 'classes_') and idea.domain in self.domain_encoder.classes_ else 0,
-                len(user_history),
-                len(user_likes),
-                len(user_likes) / len(user_history) if user_history else 0,
-                len(user.selected_domains or []),
-                1 if idea.domain in (user.selected_domains or []) else 0,
-            ]
-            
-            # Предсказание
-            features_scaled = self.scaler.transform([features])
-            probability = self.ensemble_model.predict_proba(features_scaled)[0][1]
-            
-            # Уверенность
-            confidence = "high" if abs(probability - 0.5) > 0.3 else "medium" if abs(probability - 0.5) > 0.1 else "low"
+            probability = float(self.predict_batch(db_session, user, [idea])[0])
             
             return {
-                "probability": float(probability),
-                "confidence": confidence,
+                "probability": probability,
+                "confidence": self._confidence(probability),
                 "method": "ensemble_ml"
             }
             
@@ -347,17 +692,31 @@ class AdvancedRecommender:
     def get_recommendations(self, db_session, user: User, ideas: List[Idea], top_k: int = 10) -> List[Dict]:
         """Получает топ-K рекомендаций для пользователя"""
         
-        recommendations = []
+        if not ideas:
+            return []
         
-        for idea in ideas:
-            prediction = self.predict_user_preference(db_session, user, idea)
-            
-            recommendations.append({
+        method = "ensemble_ml"
+        try:
+            probabilities = self.predict_batch(db_session, user, ideas)
+        except Exception as e:
+            print(f"❌ Ошибка предсказания: {e}")
+            probabilities, method = None, "fallback"
+        
+        if probabilities is None:
+            # Без модели ранжируем по затухающей доле лайков из индекса популярности
+            popularity_index.ensure_loaded(db_session)
+            probabilities = popularity_index.like_rates(idea.id for idea in ideas)
+            method = "popularity" if method == "ensemble_ml" else method
+        
+        recommendations = [
+            {
                 "idea": idea,
-                "probability": prediction["probability"],
-                "confidence": prediction["confidence"],
-                "method": prediction["method"]
-            })
+                "probability": float(probability),
+                "confidence": self._confidence(float(probability)) if method == "ensemble_ml" else "low",
+                "method": method
+            }
+            for idea, probability in zip(ideas, probabilities)
+        ]
         
         # Сортируем по вероятности
         recommendations.sort(key=lambda x: x["probability"], reverse=True)
@@ -365,20 +724,165 @@ class AdvancedRecommender:
         return recommendations[:top_k]
     
     
+    def content_vectors(self, ideas: List[Idea]) -> np.ndarray:
+        """L2-нормированные TF-IDF векторы идей (до обучения — хэширование слов)"""
+        
+        texts = [f"{idea.title} {idea.description} {' '.join(idea.tags or [])}" for idea in ideas]
+        if hasattr(self.tfidf_vectorizer, 'vocabulary_'):
+            matrix = self.tfidf_vectorizer.transform(texts)
+        else:
+            matrix = _hashing_vectorizer.transform(texts)
+        return matrix.toarray().astype(np.float32)
+    
+    
+    def diversify(
+        self,
+        ideas: List[Idea],
+        relevance,
+        k: int,
+        method: str,
+        lambda_: float = 0.7,
+    ) -> List[Idea]:
+        """Выбирает k идей из кандидатов с учётом разнообразия (method = "mmr" | "quota")"""
+        
+        vectors = self.content_vectors(ideas) if method == "mmr" else None
+        indices = rerank(relevance, k, method, vectors=vectors, domains=[idea.domain for idea in ideas], lambda_=lambda_)
+        return [ideas[i] for i in indices]
+    
+    
+    def explain_recommendations(self, db_session, user: User, ideas: List[Idea]) -> Optional[List[Dict]]:
+        """Точные вклады признаков в скор каждой идеи, одним проходом по батчу.
+        
+        base_value + сумма contributions = output (логит или вероятность, см. output_space).
+        None — модель не обучена или её тип не поддерживает объяснения.
+        """
+        
+        if self.explainer is None or not ideas:
+            return None
+        
+        X = self._build_features(db_session, user, ideas)
+        explained = self.explainer.explain(self.scaler.transform(X))
+        
+        return [
+            {
+                "idea": idea,
+                "probability": float(explained["probability"][i]),
+                "confidence": self._confidence(float(explained["probability"][i])),
+                "output": float(explained["output"][i]),
+                "base_value": self.explainer.base_value,
+                "output_space": self.explainer.output_space,
+                "feature_values": dict(zip(FEATURE_NAMES, X[i].tolist())),
+                "contributions": dict(zip(FEATURE_NAMES, explained["contributions"][i].tolist())),
+            }
+            for i, idea in enumerate(ideas)
+        ]
+    
+    
+    def evaluate_ranking(
+        self,
+        db_session,
+        k: Optional[int] = None,
+        test_fraction: Optional[float] = None,
+        window: Optional[Tuple[SwipeKey, SwipeKey]] = None,
+    ) -> Optional[Dict]:
+        """Офлайн-метрики ранжирования текущей ensemble модели на последних по времени свайпах.
+        
+        Опубликованная модель видела отложенные свайпы, поэтому оценивается её
+        копия (та же модель с теми же параметрами), заново обученная только на
+        свайпах до среза (в ответе — "scored": "held_out_refit"). Поэтому оценка
+        сравнивает семейство и параметры модели, а не опубликованные веса: у
+        SGD, дообученной инкрементально, они отличаются от веса копии.
+        window фиксирует окно (cutoff, until], чтобы сравнивать версии
+        на одних и тех же свайпах.
+        """
+        
+        if self.ensemble_model is None or not hasattr(self.scaler, 'mean_'):
+            return None
+        
+        domain_codes = self._domain_codes()
+        eval_set = load_evaluation_set(
+            db_session,
+            domain_codes,
+            test_fraction=test_fraction or settings.ML_EVAL_TEST_FRACTION,
+            chunk_size=settings.ML_TRAINING_CHUNK_SIZE,
+            window=window,
+        )
+        if eval_set is None:
+            return None
+        
+        held_out = self._fit_held_out_copy(db_session, domain_codes, eval_set.cutoff)
+        if held_out is None:
+            return None
+        model, scaler = held_out
+        return {**evaluate_model(model, scaler, eval_set, k or settings.ML_EVAL_K), "scored": "held_out_refit"}
+    
+    
+    def _fit_held_out_copy(self, db_session, domain_codes: Dict[str, int], cutoff: SwipeKey):
+        """Необученная копия ensemble, обученная на свайпах не новее среза, и её scaler.
+        
+        Строки берутся срезом матрицы последнего обучения — без повторного чтения
+        истории; признаки пользователя в ней посчитаны на момент обучения, а не
+        среза. После обучения по пачкам матрицы нет, и история читается из БД.
+        """
+        
+        if self.training_matrix is not None and self.training_matrix.row_order is not None:
+            matrix = rows_created_until(self.training_matrix, cutoff)
+        else:
+            matrix = load_training_matrix(
+                db_session,
+                domain_codes,
+                chunk_size=settings.ML_TRAINING_CHUNK_SIZE,
+                max_rows=settings.ML_TRAINING_MAX_ROWS,
+                sample_budget=settings.ML_TRAINING_SAMPLE_BUDGET,
+                heavy_user_alpha=settings.ML_SAMPLE_HEAVY_USER_ALPHA,
+                created_until=cutoff,
+            )
+        if len(matrix.y) < 10 or np.unique(matrix.y).shape[0] < 2:
+            return None
+        
+        scaler = StandardScaler()
+        model = clone(self.ensemble_model)
+        model.fit(scaler.fit_transform(matrix.X), matrix.y)
+        return model, scaler
+    
+    
+    def snapshot_ensemble(self) -> Dict:
+        """Опубликованное состояние, чтобы откатиться, если новая версия хуже.
+        
+        Ensemble, scaler и метрики копируются. Коды доменов, TF-IDF, матрицы
+        content-based и матрица обучения при переобучении заменяются новыми
+        объектами, поэтому для них хватает ссылок.
+        """
+        
+        snapshot = copy.deepcopy({
+            'ensemble_model': self.ensemble_model,
+            'scaler': self.scaler,
+            'best_model_name': self.best_model_name,
+            'explainer': self.explainer,
+            'training_metrics': self.training_metrics,
+        })
+        snapshot.update({name: getattr(self, name) for name in _REPLACED_ON_TRAINING})
+        return snapshot
+    
+    
+    def restore_ensemble(self, snapshot: Dict):
+        """Возвращает состояние из snapshot_ensemble и перезаписывает ensemble на диске"""
+        
+        for name, value in snapshot.items():
+            setattr(self, name, value)
+        if self.ensemble_model is not None:
+            self._save_ensemble()
+    
+    
     def get_feature_importance(self) -> Dict:
         """Возвращает важность признаков"""
         
         if not self.ensemble_model or not hasattr(self.ensemble_model, 'feature_importances_'):
             return {}
         
-        feature_names = [
-            'text_length', 'tag_count', 'domain', 'user_history_length',
-            'user_likes_count', 'like_ratio', 'selected_domains_count', 'domain_match'
-        ]
-        
         importances = self.ensemble_model.feature_importances_
         
-        return dict(zip(feature_names, importances.tolist()))
+        return dict(zip(FEATURE_NAMES, importances.tolist()))
     
     
     def get_training_metrics(self) -> Dict:
@@ -387,4 +891,4 @@ class AdvancedRecommender:
 
 
 # Глобальный инстанс рекомендателя
-advanced_recommender = AdvancedRecommender() 
\ No newline at end of file
+advanced_recommender = AdvancedRecommender(model_dir=settings.ML_MODEL_DIR) 
\ No newline at end of file
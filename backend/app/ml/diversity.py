@@ -0,0 +1,93 @@
+"""
+Переранжирование кандидатов на разнообразие
+MMR (Maximal Marginal Relevance) по контентным векторам идей или квоты по доменам.
+Обе стратегии векторные: для 300 кандидатов → 10 выдача занимает доли миллисекунды
+"""
+
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+def mmr_rerank(relevance: np.ndarray, vectors: np.ndarray, k: int, lambda_: float = 0.7) -> np.ndarray:
+    """Жадный MMR: argmax(lambda * rel - (1 - lambda) * max_sim_to_selected).
+
+    vectors — L2-нормированные строки, сходство — скалярное произведение.
+    Возвращает индексы выбранных кандидатов по порядку выдачи.
+    """
+
+    n = len(relevance)
+    k = min(k, n)
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # Релевантность в [0, 1], чтобы lambda одинаково работала для любых скоров
+    span = relevance.max() - relevance.min()
+    rel = (relevance - relevance.min()) / span if span > 0 else np.zeros(n)
+
+    # Полная матрица сходства не нужна: на шаге считается одна строка (n × d вместо n × n × d)
+    max_similarity = np.zeros(n)
+    available = np.ones(n, dtype=bool)
+    selected = np.empty(k, dtype=np.int64)
+
+    for step in range(k):
+        score = lambda_ * rel - (1 - lambda_) * max_similarity
+        score[~available] = -np.inf
+        best = int(np.argmax(score))
+        selected[step] = best
+        available[best] = False
+        np.maximum(max_similarity, vectors @ vectors[best], out=max_similarity)
+
+    return selected
+
+
+def domain_quota_rerank(
+    relevance: np.ndarray,
+    domains: Sequence[str],
+    k: int,
+    quota: Optional[int] = None,
+) -> np.ndarray:
+    """Не больше quota идей на домен (по умолчанию — поровну между доменами кандидатов).
+
+    Внутри квоты порядок по релевантности; если квоты не набирают k идей,
+    остаток добирается лучшими из отброшенных.
+    """
+
+    n = len(relevance)
+    k = min(k, n)
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    _, domain_codes = np.unique(np.asarray(domains, dtype=str), return_inverse=True)
+    if quota is None:
+        quota = -(-k // (domain_codes.max() + 1))
+
+    # Ранг идеи внутри своего домена по убыванию релевантности
+    order = np.lexsort((-relevance, domain_codes))
+    sorted_domains = domain_codes[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_domains)) + 1))
+    group_start = np.repeat(starts, np.diff(np.concatenate((starts, [n]))))
+    domain_rank = np.empty(n, dtype=np.int64)
+    domain_rank[order] = np.arange(n) - group_start
+
+    by_relevance = np.argsort(-relevance, kind='stable')
+    within = by_relevance[domain_rank[by_relevance] < quota]
+    overflow = by_relevance[domain_rank[by_relevance] >= quota]
+    return np.concatenate((within, overflow))[:k]
+
+
+def rerank(
+    relevance: Sequence[float],
+    k: int,
+    method: str,
+    vectors: Optional[np.ndarray] = None,
+    domains: Optional[Sequence[str]] = None,
+    lambda_: float = 0.7,
+) -> List[int]:
+    """Индексы k кандидатов после переранжирования: method = "mmr" | "quota" """
+
+    relevance = np.asarray(relevance, dtype=np.float64)
+    if method == "mmr":
+        return mmr_rerank(relevance, vectors, k, lambda_).tolist()
+    if method == "quota":
+        return domain_quota_rerank(relevance, domains, k).tolist()
+    raise ValueError(f"Unknown diversity method: {method}")
@@ -0,0 +1,216 @@
+"""
+Офлайн-оценка качества ранжирования на отложенных свайпах
+Свайпы делятся по времени: всё до среза — история, последние test_fraction —
+отложенная выборка. Кандидаты каждого пользователя из отложенной выборки
+ранжируются моделью одним батчем, метрики считаются векторно в NumPy
+"""
+
+from datetime import datetime
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import uuid
+
+import numpy as np
+from sqlalchemy import func, select, tuple_
+
+from ..models import Swipe
+from .training_data import (
+    FEATURE_DTYPE,
+    N_FEATURES,
+    SwipeKey,
+    fill_feature_rows,
+    iter_swipe_row_chunks,
+    latest_swipe_key,
+    load_user_stats,
+)
+
+
+class EvaluationSet(NamedTuple):
+    """Отложенные свайпы в виде массивов: строка — пара пользователь-идея"""
+    X: np.ndarray
+    labels: np.ndarray       # 1 — лайк (релевантная идея)
+    user_codes: np.ndarray   # индекс пользователя в 0..n_users-1
+    idea_codes: np.ndarray   # индекс идеи в 0..n_ideas-1
+    n_users: int
+    n_ideas: int
+    cutoff: Optional[SwipeKey]
+    until: Optional[SwipeKey]
+    timings: Dict[str, float]
+
+
+def find_time_cutoff(db_session, test_fraction: float, until: Optional[SwipeKey] = None) -> Optional[SwipeKey]:
+    """(created_at, id) последнего свайпа истории: после него идут test_fraction свайпов (не новее until)"""
+
+    stmt = select(func.count(Swipe.id))
+    if until is not None:
+        stmt = stmt.where(tuple_(Swipe.created_at, Swipe.id) <= tuple_(*until))
+    total = db_session.execute(stmt).scalar() or 0
+    history = int(total * (1 - test_fraction))
+    if history == 0 or history >= total:
+        return None
+
+    row = db_session.execute(
+        select(Swipe.created_at, Swipe.id)
+        .order_by(Swipe.created_at, Swipe.id)
+        .offset(history - 1)
+        .limit(1)
+    ).first()
+    return (row[0], row[1]) if row else None
+
+
+def window_to_json(cutoff: SwipeKey, until: SwipeKey) -> Dict[str, str]:
+    """Окно отложенной выборки (cutoff, until] для реестра моделей"""
+    return {
+        "cutoff_at": cutoff[0].isoformat(),
+        "cutoff_id": str(cutoff[1]),
+        "until_at": until[0].isoformat(),
+        "until_id": str(until[1]),
+    }
+
+
+def window_from_json(window: Optional[Dict]) -> Optional[Tuple[SwipeKey, SwipeKey]]:
+    """Обратное к window_to_json; None — окна нет (оценка старого формата)"""
+    if not window:
+        return None
+    return (
+        (datetime.fromisoformat(window["cutoff_at"]), uuid.UUID(window["cutoff_id"])),
+        (datetime.fromisoformat(window["until_at"]), uuid.UUID(window["until_id"])),
+    )
+
+
+def load_evaluation_set(
+    db_session,
+    domain_codes: Dict[str, int],
+    test_fraction: float = 0.2,
+    chunk_size: int = 5000,
+    window: Optional[Tuple[SwipeKey, SwipeKey]] = None,
+) -> Optional[EvaluationSet]:
+    """Загружает отложенную выборку; признаки пользователя считаются на момент среза.
+
+    window — зафиксированное окно (cutoff, until]: так две версии модели
+    оцениваются на одних и тех же свайпах. Без него окно — последние
+    test_fraction свайпов на текущий момент.
+    """
+
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    if window is not None:
+        cutoff, until = window
+    else:
+        until = latest_swipe_key(db_session)
+        cutoff = find_time_cutoff(db_session, test_fraction, until) if until else None
+    if cutoff is None:
+        return None
+    user_stats = load_user_stats(db_session, created_until=cutoff)
+    timings["split_seconds"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    X_parts: List[np.ndarray] = []
+    y_parts: List[np.ndarray] = []
+    user_ids: List[uuid.UUID] = []
+    idea_ids: List[uuid.UUID] = []
+    for rows in iter_swipe_row_chunks(db_session, chunk_size, created_since=cutoff, created_until=until):
+        X = np.empty((len(rows), N_FEATURES), dtype=FEATURE_DTYPE)
+        y = np.empty(len(rows), dtype=np.int8)
+        fill_feature_rows(rows, user_stats, domain_codes, X, y)
+        X_parts.append(X)
+        y_parts.append(y)
+        user_ids.extend(row[0] for row in rows)
+        idea_ids.extend(row[8] for row in rows)
+    timings["features_seconds"] = time.perf_counter() - started
+
+    if not X_parts:
+        return None
+
+    # UUID -> плотные индексы (np.unique по 16-байтовым ключам)
+    users, user_codes = np.unique(np.array([u.bytes for u in user_ids], dtype='S16'), return_inverse=True)
+    ideas, idea_codes = np.unique(np.array([i.bytes for i in idea_ids], dtype='S16'), return_inverse=True)
+
+    return EvaluationSet(
+        X=np.concatenate(X_parts),
+        labels=np.concatenate(y_parts),
+        user_codes=user_codes.astype(np.int32),
+        idea_codes=idea_codes.astype(np.int32),
+        n_users=len(users),
+        n_ideas=len(ideas),
+        cutoff=cutoff,
+        until=until,
+        timings=timings,
+    )
+
+
+def ranking_metrics(
+    user_codes: np.ndarray,
+    idea_codes: np.ndarray,
+    scores: np.ndarray,
+    labels: np.ndarray,
+    k: int,
+    n_users: int,
+    n_ideas: int,
+) -> Dict[str, float]:
+    """precision@k, recall@k, NDCG@k (средние по пользователям с лайками) и coverage@k"""
+
+    # Внутри пользователя — по убыванию скора
+    order = np.lexsort((-scores, user_codes))
+    users = user_codes[order]
+    relevant = labels[order].astype(np.float64)
+
+    n_candidates = np.bincount(users, minlength=n_users)
+    starts = np.concatenate(([0], np.cumsum(n_candidates)[:-1]))
+    rank = np.arange(len(users)) - starts[users]
+    top = rank < k
+
+    discount = 1.0 / np.log2(np.arange(k) + 2)
+    hits = np.bincount(users[top], weights=relevant[top], minlength=n_users)
+    dcg = np.bincount(users[top], weights=relevant[top] * discount[rank[top]], minlength=n_users)
+    n_relevant = np.bincount(users, weights=relevant, minlength=n_users)
+    ideal = np.concatenate(([0.0], np.cumsum(discount)))[np.minimum(n_relevant, k).astype(np.int64)]
+
+    active = n_relevant > 0
+    if not active.any():
+        return {"users": 0, f"precision@{k}": 0.0, f"recall@{k}": 0.0, f"ndcg@{k}": 0.0, f"coverage@{k}": 0.0}
+
+    recommended = np.unique(idea_codes[order][top])
+    return {
+        "users": int(active.sum()),
+        f"precision@{k}": float((hits[active] / np.minimum(n_candidates[active], k)).mean()),
+        f"recall@{k}": float((hits[active] / n_relevant[active]).mean()),
+        f"ndcg@{k}": float((dcg[active] / ideal[active]).mean()),
+        f"coverage@{k}": len(recommended) / n_ideas if n_ideas else 0.0,
+    }
+
+
+def score_candidates(model, scaler, X: np.ndarray) -> np.ndarray:
+    """Скоры модели для всех кандидатов одним батчем"""
+    X_scaled = scaler.transform(X)
+    if hasattr(model, 'predict_proba'):
+        return model.predict_proba(X_scaled)[:, 1]
+    return model.decision_function(X_scaled)
+
+
+def evaluate_model(model, scaler, eval_set: EvaluationSet, k: int = 10) -> Dict:
+    """Оценивает модель на отложенной выборке, с временем каждого этапа"""
+
+    timings = dict(eval_set.timings)
+
+    started = time.perf_counter()
+    scores = score_candidates(model, scaler, eval_set.X)
+    timings["score_seconds"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    metrics = ranking_metrics(
+        eval_set.user_codes, eval_set.idea_codes, scores, eval_set.labels,
+        k, eval_set.n_users, eval_set.n_ideas,
+    )
+    timings["metrics_seconds"] = time.perf_counter() - started
+    timings["total_seconds"] = sum(timings.values())
+
+    return {
+        "k": k,
+        "cutoff": eval_set.cutoff[0].isoformat() if eval_set.cutoff else None,
+        "window": window_to_json(eval_set.cutoff, eval_set.until) if eval_set.cutoff and eval_set.until else None,
+        "held_out_swipes": int(len(eval_set.labels)),
+        "held_out_positive_rate": float(eval_set.labels.mean()),
+        **metrics,
+        "timings": {name: round(value, 3) for name, value in timings.items()},
+    }
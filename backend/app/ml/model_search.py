@@ -0,0 +1,226 @@
+"""
+Поиск модели методом successive halving в пределах бюджета времени
+Все конфигурации (семейство модели + гиперпараметры) сначала обучаются
+на маленькой подвыборке, в следующий раунд проходит лучшая 1/eta часть
+на выборке в eta раз больше. Оценка идёт в пуле процессов; дообучение
+победителя на всей выборке входит в тот же бюджет времени
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait
+import multiprocessing
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import ParameterGrid
+
+
+# Семейства моделей и сетки гиперпараметров
+SEARCH_SPACE = {
+    'logistic': (
+        LogisticRegression(random_state=42, max_iter=1000),
+        {'C': [0.01, 0.1, 1.0, 10.0], 'class_weight': [None, 'balanced']},
+    ),
+    'random_forest': (
+        RandomForestClassifier(random_state=42),
+        {'n_estimators': [100, 300], 'max_depth': [None, 8, 16], 'min_samples_leaf': [1, 5]},
+    ),
+    'gradient_boosting': (
+        GradientBoostingClassifier(random_state=42),
+        {'n_estimators': [100, 300], 'learning_rate': [0.05, 0.1], 'max_depth': [2, 3, 5]},
+    ),
+}
+
+
+class Candidate(NamedTuple):
+    family: str
+    params: Dict
+
+
+class SearchResult(NamedTuple):
+    family: str
+    params: Dict
+    score: float          # accuracy на валидации в последнем пройденном раунде
+    rounds: int           # сколько раундов прошла лучшая конфигурация
+    evaluated: int        # всего обучений за поиск
+    candidates: int       # конфигураций в первом раунде
+    elapsed: float
+    budget_exhausted: bool
+    model: Any = None     # победитель, дообученный на X_refit (None — не уложился в бюджет)
+
+
+def build_candidates(space: Dict = SEARCH_SPACE) -> List[Candidate]:
+    return [
+        Candidate(family, params)
+        for family, (_, grid) in space.items()
+        for params in ParameterGrid(grid)
+    ]
+
+
+# Данные поиска передаются воркеру один раз через initializer,
+# задачи несут только индексы подвыборки
+_worker_data: Dict[str, np.ndarray] = {}
+
+
+def _init_worker(X_train: np.ndarray, y_train: np.ndarray, X_val: np.ndarray, y_val: np.ndarray):
+    _worker_data.update(X_train=X_train, y_train=y_train, X_val=X_val, y_val=y_val)
+
+
+def make_estimator(family: str, params: Dict):
+    return clone(SEARCH_SPACE[family][0]).set_params(**params)
+
+
+def _fit_and_score(candidate: Candidate, subset: np.ndarray) -> Tuple[float, float]:
+    """Accuracy на валидации и время обучения в секундах"""
+    estimator = make_estimator(candidate.family, candidate.params)
+    X_train, y_train = _worker_data['X_train'], _worker_data['y_train']
+    started = time.monotonic()
+    estimator.fit(X_train[subset], y_train[subset])
+    fit_seconds = time.monotonic() - started
+    return float(accuracy_score(_worker_data['y_val'], estimator.predict(_worker_data['X_val']))), fit_seconds
+
+
+def _fit(candidate: Candidate):
+    estimator = make_estimator(candidate.family, candidate.params)
+    return estimator.fit(_worker_data['X_train'], _worker_data['y_train'])
+
+
+def _make_pool(n_workers: int, X_train, y_train, X_val, y_val) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(X_train, y_train, X_val, y_val),
+    )
+
+
+def _shutdown_pool(pool: ProcessPoolExecutor, terminate: bool):
+    """cancel_futures отменяет только не начатые задачи — запущенные обучения завершаем вместе с процессами"""
+    if terminate:
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+    pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _stratified_prefix(y: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Перестановка строк, у которой любой префикс сохраняет долю классов"""
+    order = rng.permutation(len(y))
+    ranks = np.empty(len(y), dtype=np.float64)
+    for label in np.unique(y):
+        idx = order[y[order] == label]
+        ranks[idx] = (np.arange(len(idx)) + 0.5) / len(idx)
+    return order[np.argsort(ranks[order], kind='stable')]
+
+
+def successive_halving(
+    X_train: np.ndarray,
+    y_train: np.ndarray,
+    X_val: np.ndarray,
+    y_val: np.ndarray,
+    time_budget: float,
+    n_workers: int,
+    eta: int = 3,
+    min_resource: int = 200,
+    seed: int = 42,
+    X_refit: Optional[np.ndarray] = None,
+    y_refit: Optional[np.ndarray] = None,
+) -> Optional[SearchResult]:
+    """Successive halving по SEARCH_SPACE.
+
+    Раунд k обучает выжившие конфигурации на min_resource * eta^k строках
+    (последний — на всей обучающей выборке). Когда бюджет времени исчерпан,
+    процессы с незавершёнными обучениями завершаются и победитель выбирается
+    по последнему раунду, в котором есть результаты.
+
+    С X_refit победитель дообучается на нём в том же бюджете: под дообучение
+    резервируется время лучшей конфигурации последнего раунда, пересчитанное
+    на число строк X_refit.
+    """
+
+    started = time.monotonic()
+    deadline = started + time_budget
+    rng = np.random.default_rng(seed)
+    order = _stratified_prefix(y_train, rng)
+
+    candidates = build_candidates()
+    n_candidates = len(candidates)
+    resource = min(min_resource, len(y_train))
+    best: Optional[SearchResult] = None
+    evaluated = 0
+    exhausted = False
+    round_no = 0
+    refit_rows = len(y_refit) if y_refit is not None else 0
+    refit_reserve = 0.0
+
+    pool = _make_pool(n_workers, X_train, y_train, X_val, y_val)
+    try:
+        while candidates:
+            round_no += 1
+            subset = order[:resource]
+            pending = {pool.submit(_fit_and_score, c, subset): c for c in candidates}
+            scores: List[tuple] = []
+
+            while pending:
+                remaining = deadline - refit_reserve - time.monotonic()
+                if remaining <= 0:
+                    exhausted = True
+                    break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    candidate = pending.pop(future)
+                    try:
+                        score, fit_seconds = future.result()
+                        scores.append((score, fit_seconds, candidate))
+                    except Exception as e:
+                        print(f"⚠️ {candidate.family} {candidate.params}: {e}")
+                    evaluated += 1
+
+            # Результат прерванного раунда берём, только если раньше ничего не успели
+            if scores and (not pending or best is None):
+                scores.sort(key=lambda item: item[0], reverse=True)
+                top_score, top_seconds, top = scores[0]
+                best = SearchResult(
+                    top.family, top.params, top_score, round_no, evaluated,
+                    n_candidates, time.monotonic() - started, exhausted,
+                )
+                refit_reserve = top_seconds * refit_rows / resource
+                print(f"🔎 Раунд {round_no}: {len(scores)} конфигураций на {resource} строках, "
+                      f"лучшая {top.family} {top.params} ({top_score:.3f})")
+
+            if exhausted or resource >= len(y_train) or len(scores) <= 1:
+                break
+
+            candidates = [c for _, _, c in scores[:max(1, len(scores) // eta)]]
+            resource = min(resource * eta, len(y_train))
+
+    finally:
+        _shutdown_pool(pool, terminate=exhausted)
+
+    if best is None:
+        return None
+    model = None
+    if y_refit is not None:
+        model = _refit_within_budget(Candidate(best.family, best.params), X_refit, y_refit, X_val, y_val, deadline)
+        exhausted = exhausted or model is None
+    return best._replace(
+        evaluated=evaluated, elapsed=time.monotonic() - started, budget_exhausted=exhausted, model=model,
+    )
+
+
+def _refit_within_budget(candidate: Candidate, X, y, X_val, y_val, deadline: float):
+    """Дообучает конфигурацию в отдельном процессе; по истечении deadline процесс завершается"""
+
+    pool = _make_pool(1, X, y, X_val, y_val)
+    timed_out = False
+    try:
+        return pool.submit(_fit, candidate).result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeoutError:
+        timed_out = True
+        print(f"⚠️ Дообучение {candidate.family} {candidate.params} не уложилось в бюджет времени")
+        return None
+    finally:
+        _shutdown_pool(pool, terminate=timed_out)
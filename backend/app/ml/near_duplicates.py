@@ -0,0 +1,332 @@
+"""
+Поиск почти-дубликатов идей: MinHash + LSH
+Идея → множество шинглов (n-граммы слов title + description и теги) → MinHash-подпись
+из num_perm хэшей. Подписи режутся на bands полос по rows значений; идеи, совпавшие
+хотя бы в одной полосе, — кандидаты, а дубликатом считается кандидат с оценкой
+Jaccard (доля совпавших хэшей) не ниже threshold. Проверка одной идеи — доли
+миллисекунды; индекс живёт в памяти и сохраняется в .npz рядом с моделями
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import uuid
+import zlib
+
+import numpy as np
+from sqlalchemy import func, select
+
+from ..config import get_settings
+from ..models import Idea
+
+settings = get_settings()
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_HASH_VERSION = 2  # меняется вместе с семейством хэшей — старые снимки перестраиваются
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_SYNC_OVERLAP = timedelta(minutes=1)
+
+
+def shingles(title: str, description: str, tags: Optional[Sequence[str]], size: int = 2) -> List[str]:
+    """n-граммы слов title + description и теги (с префиксом, чтобы не смешивать со словами)"""
+    tokens = _TOKEN_RE.findall(f"{title} {description}".lower())
+    grams = [" ".join(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 1))] if tokens else []
+    return grams + [f"#{tag.lower()}" for tag in (tags or [])]
+
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows): порог срабатывания LSH (1/bands)^(1/rows) ближе всего к threshold"""
+    candidates = [
+        (bands, num_perm // bands)
+        for bands in range(1, num_perm + 1)
+        if num_perm // bands >= 1
+    ]
+    return min(candidates, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold))
+
+
+class MinHasher:
+    """MinHash через семейство (a * x + b) mod p с фиксированным seed — подписи воспроизводимы между процессами.
+
+    x — crc32 (< 2^32), поэтому a и b берутся меньше 2^32: a * x + b < 2^64 и
+    произведение в uint64 не переполняется до взятия остатка по p.
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 2, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, title: str, description: str, tags: Optional[Sequence[str]]) -> np.ndarray:
+        grams = shingles(title, description, tags, self.shingle_size)
+        if not grams:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        # crc32 стабилен между процессами, в отличие от встроенного hash()
+        hashes = np.fromiter((zlib.crc32(gram.encode()) for gram in set(grams)), dtype=np.uint64)
+        permuted = (hashes[:, None] * self.a + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """LSH-индекс MinHash-подписей каталога идей"""
+
+    def __init__(
+        self,
+        threshold: float = 0.7,
+        num_perm: int = 128,
+        shingle_size: int = 2,
+        snapshot_path: Optional[str] = None,
+        sync_seconds: float = 60.0,
+    ):
+        self.threshold = threshold
+        self.sync_seconds = sync_seconds
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.snapshot_path = snapshot_path
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._ids: List[uuid.UUID] = []
+        self._positions: Dict[uuid.UUID, int] = {}
+        self._signatures = np.zeros((0, self.hasher.num_perm), dtype=np.uint32)
+        self._pending: List[np.ndarray] = []  # подписи, ещё не склеенные в _signatures
+        self._buckets: List[Dict[bytes, List[int]]] = [defaultdict(list) for _ in range(self.bands)]
+        self._watermark: Optional[datetime] = None
+        self._synced_at = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self._ids)
+
+    @property
+    def loaded(self) -> bool:
+        return self._watermark is not None
+
+    # --- подписи и полосы ----------------------------------------------------
+
+    def signature(self, title: str, description: str, tags: Optional[Sequence[str]]) -> np.ndarray:
+        return self.hasher.signature(title, description, tags)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _add(self, idea_id: uuid.UUID, signature: np.ndarray):
+        if idea_id in self._positions:
+            return
+        position = len(self._ids)
+        self._ids.append(idea_id)
+        self._positions[idea_id] = position
+        self._pending.append(signature)
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band][key].append(position)
+
+    def _compact(self):
+        if self._pending:
+            self._signatures = np.vstack([self._signatures, np.stack(self._pending)])
+            self._pending = []
+
+    # --- загрузка ------------------------------------------------------------
+
+    def ensure_loaded(self, db_session):
+        """Поднимает индекс из снимка (или строит по каталогу) и раз в sync_seconds догоняет новые идеи"""
+        if not self.loaded and not self.restore():
+            self.build(db_session)
+        if time.time() - self._synced_at > self.sync_seconds:
+            self.sync(db_session)
+
+    def build(self, db_session, chunk_size: int = 5000):
+        """Строит индекс по всем идеям каталога потоково"""
+
+        now = db_session.execute(select(func.now())).scalar()
+        with self._lock:
+            self._reset()
+            self._add_rows(db_session, select(Idea.id, Idea.title, Idea.description, Idea.tags), chunk_size)
+            self._watermark = now
+        print(f"🧬 Индекс почти-дубликатов: {self.size} идей, {self.bands} полос × {self.rows}")
+
+    def sync(self, db_session):
+        """Добавляет идеи, созданные после водяного знака (в том числе другими процессами)"""
+
+        now = db_session.execute(select(func.now())).scalar()
+        with self._lock:
+            stmt = select(Idea.id, Idea.title, Idea.description, Idea.tags).where(
+                Idea.created_at > self._watermark - _SYNC_OVERLAP
+            )
+            self._add_rows(db_session, stmt, 5000)
+            self._watermark = now
+            self._synced_at = time.time()
+
+    def _add_rows(self, db_session, stmt, chunk_size: int):
+        result = db_session.execute(stmt.execution_options(yield_per=chunk_size))
+        try:
+            for idea_id, title, description, tags in result:
+                if idea_id not in self._positions:
+                    self._add(idea_id, self.signature(title, description, tags))
+        finally:
+            result.close()
+        self._compact()
+
+    # --- запросы -------------------------------------------------------------
+
+    def _candidates(self, signature: np.ndarray) -> np.ndarray:
+        found = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            found.update(self._buckets[band].get(key, ()))
+        return np.fromiter(found, dtype=np.int64, count=len(found))
+
+    def query(self, signature: np.ndarray) -> List[Tuple[uuid.UUID, float]]:
+        """Идеи индекса с оценкой Jaccard >= threshold, по убыванию сходства"""
+
+        with self._lock:
+            self._compact()
+            candidates = self._candidates(signature)
+            if len(candidates) == 0:
+                return []
+            similarity = (self._signatures[candidates] == signature).mean(axis=1)
+            keep = similarity >= self.threshold
+            order = np.argsort(-similarity[keep])
+            return [(self._ids[p], float(s)) for p, s in zip(candidates[keep][order], similarity[keep][order])]
+
+    def filter_new(self, items: Sequence, key=lambda item: (item.title, item.description, item.tags)):
+        """Делит пачку на новые и почти-дубликаты (каталога или более ранних элементов пачки).
+
+        Возвращает (kept, rejected, signatures): rejected — пары (item, id дубликата или None
+        для дубликата внутри пачки), signatures — подписи kept для add().
+        """
+
+        batch = NearDuplicateIndex(self.threshold, self.hasher.num_perm, self.hasher.shingle_size)
+
+        kept, rejected, signatures = [], [], []
+        for item in items:
+            signature = self.signature(*key(item))
+            duplicates = self.query(signature)
+            if duplicates:
+                rejected.append((item, duplicates[0][0]))
+                continue
+            if batch.query(signature):
+                rejected.append((item, None))
+                continue
+            batch._add(uuid.uuid4(), signature)
+            kept.append(item)
+            signatures.append(signature)
+        return kept, rejected, signatures
+
+    def add(self, idea_id: uuid.UUID, signature: np.ndarray):
+        with self._lock:
+            self._add(idea_id, signature)
+
+    def remove(self, idea_ids: Iterable[uuid.UUID]):
+        """Убирает идеи (после компакции) — индекс перестраивает полосы по оставшимся"""
+        with self._lock:
+            removed = {self._positions[idea_id] for idea_id in idea_ids if idea_id in self._positions}
+            if not removed:
+                return
+            self._compact()
+            keep = [p for p in range(self.size) if p not in removed]
+            ids, signatures, watermark = [self._ids[p] for p in keep], self._signatures[keep], self._watermark
+            self._reset()
+            for idea_id, signature in zip(ids, signatures):
+                self._add(idea_id, signature)
+            self._compact()
+            self._watermark = watermark
+
+    def clusters(self) -> List[List[uuid.UUID]]:
+        """Группы почти-дубликатов (компоненты связности пар с Jaccard >= threshold)"""
+
+        with self._lock:
+            self._compact()
+            parent = np.arange(self.size)
+
+            def find(x):
+                while parent[x] != x:
+                    parent[x] = parent[parent[x]]
+                    x = parent[x]
+                return x
+
+            for buckets in self._buckets:
+                for positions in buckets.values():
+                    if len(positions) < 2:
+                        continue
+                    members = np.asarray(positions)
+                    signatures = self._signatures[members]
+                    # Построчно: память O(m × num_perm) даже для больших корзин
+                    for i in range(len(members) - 1):
+                        similarity = (signatures[i + 1:] == signatures[i]).mean(axis=1)
+                        for j in np.flatnonzero(similarity >= self.threshold) + i + 1:
+                            a, b = find(members[i]), find(members[j])
+                            if a != b:
+                                parent[b] = a
+
+            groups: Dict[int, List[uuid.UUID]] = defaultdict(list)
+            for position in range(self.size):
+                groups[find(position)].append(self._ids[position])
+            return [group for group in groups.values() if len(group) > 1]
+
+    # --- снимок --------------------------------------------------------------
+
+    def _params(self) -> List[int]:
+        return [self.hasher.num_perm, self.hasher.shingle_size, self.bands, self.rows, _HASH_VERSION]
+
+    def snapshot(self, path: Optional[str] = None) -> bool:
+        path = path or self.snapshot_path
+        with self._lock:
+            if not self.loaded or not path:
+                return False
+            self._compact()
+            arrays = {
+                "ids": np.frombuffer(b"".join(i.bytes for i in self._ids), dtype=np.uint8).reshape(-1, 16),
+                "signatures": self._signatures,
+                "params": np.array(self._params()),
+                "threshold": np.array(self.threshold),
+                "watermark": np.array(self._watermark.isoformat()),
+            }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        return True
+
+    def restore(self, path: Optional[str] = None) -> bool:
+        """Поднимает индекс из снимка, если он построен с теми же параметрами"""
+
+        path = path or self.snapshot_path
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                params = data["params"].tolist()
+                if params != self._params():
+                    print("⚠️ Снимок индекса почти-дубликатов построен с другими параметрами — перестраиваем")
+                    return False
+                ids = [uuid.UUID(bytes=row.tobytes()) for row in data["ids"]]
+                signatures = data["signatures"]
+                watermark = datetime.fromisoformat(str(data["watermark"]))
+        except (OSError, KeyError, ValueError) as e:
+            print(f"⚠️ Снимок индекса почти-дубликатов не прочитан: {e}")
+            return False
+
+        with self._lock:
+            self._reset()
+            for idea_id, signature in zip(ids, signatures):
+                self._add(idea_id, signature)
+            self._compact()
+            self._watermark = watermark
+        print(f"🧬 Индекс почти-дубликатов из снимка: {self.size} идей")
+        return True
+
+
+# Глобальный индекс почти-дубликатов (один на процесс)
+near_duplicate_index = NearDuplicateIndex(
+    threshold=settings.IDEA_NEAR_DUP_THRESHOLD,
+    num_perm=settings.IDEA_NEAR_DUP_NUM_PERM,
+    shingle_size=settings.IDEA_NEAR_DUP_SHINGLE_WORDS,
+    snapshot_path=os.path.join(settings.ML_MODEL_DIR, "near_duplicates.npz"),
+)
@@ -0,0 +1,285 @@
+"""
+Таблицы популярности идей для cold-start и режима без модели
+Счётчики (лайки, просмотры, свайпы и затухающая доля лайков) по идеям и доменам
+живут в памяти и обновляются на каждом свайпе и просмотре. Идеи каждого
+домена хранятся в отсортированном списке, поэтому топ-k — чтение первых k
+элементов без пересчёта скоров
+"""
+
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+import heapq
+from itertools import islice
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import uuid
+
+from sqlalchemy import Float, cast, func, select
+
+from ..config import get_settings
+from ..models import Idea, IdeaView, Swipe
+
+settings = get_settings()
+
+
+class IdeaCounters:
+    """Счётчики идеи (или домена). decayed_* — в единицах опорного момента epoch"""
+
+    __slots__ = ("domain", "likes", "swipes", "views", "decayed_likes", "decayed_swipes")
+
+    def __init__(self, domain: str):
+        self.domain = domain
+        self.likes = 0
+        self.swipes = 0
+        self.views = 0
+        self.decayed_likes = 0.0
+        self.decayed_swipes = 0.0
+
+
+class PopularityIndex:
+    """Инкрементально поддерживаемый рейтинг идей по затухающей доле лайков.
+
+    Событие в момент t входит в затухающие суммы с весом 2^((t - epoch) / half_life):
+    вес растёт со временем, а не старые суммы уменьшаются, так что свайп меняет
+    ключ только одной идеи. Доля лайков сглаживается к глобальной (prior_strength
+    псевдо-свайпов), чтобы идеи без свайпов не оказывались вверху или внизу.
+    Когда веса вырастают больше чем вдвое, epoch переносится и списки пересобираются.
+
+    Индекс загружается лениво и перечитывается из БД раз в reload_minutes:
+    так подтягиваются свайпы, записанные другими процессами.
+    """
+
+    def __init__(self, half_life_hours: float = 72.0, prior_strength: float = 5.0, reload_minutes: float = 10.0):
+        self.half_life_seconds = half_life_hours * 3600
+        self.prior_strength = prior_strength
+        self.reload_seconds = reload_minutes * 60
+
+        self._lock = threading.RLock()
+        self._ideas: Dict[uuid.UUID, IdeaCounters] = {}
+        self._domains: Dict[str, IdeaCounters] = {}
+        self._ranked: Dict[str, List[Tuple[float, uuid.UUID]]] = {}
+        self._epoch = time.time()
+        self._prior_rate = 0.5
+        self._loaded_at: Optional[float] = None
+
+    # --- загрузка -----------------------------------------------------------
+
+    def ensure_loaded(self, db_session):
+        """Загружает индекс при первом обращении и перечитывает, если он устарел"""
+        if self._loaded_at is None or time.time() - self._loaded_at > self.reload_seconds:
+            self.load(db_session)
+
+    def load(self, db_session):
+        """Строит индекс заново: три GROUP BY по ideas, swipes и idea_views"""
+
+        epoch = time.time()
+        epoch_dt = datetime.fromtimestamp(epoch, tz=timezone.utc)
+        age = func.extract('epoch', epoch_dt - Swipe.created_at)
+        weight = func.power(2.0, -cast(age, Float) / self.half_life_seconds)
+
+        ideas: Dict[uuid.UUID, IdeaCounters] = {
+            idea_id: IdeaCounters(domain)
+            for idea_id, domain in db_session.execute(select(Idea.id, Idea.domain))
+        }
+
+        swipe_stats = db_session.execute(
+            select(
+                Swipe.idea_id,
+                func.count(Swipe.id),
+                func.count(Swipe.id).filter(Swipe.swipe.is_(True)),
+                func.sum(weight),
+                func.coalesce(func.sum(weight).filter(Swipe.swipe.is_(True)), 0.0),
+            ).group_by(Swipe.idea_id)
+        )
+        for idea_id, swipes, likes, decayed_swipes, decayed_likes in swipe_stats:
+            counters = ideas.get(idea_id)
+            if counters is not None:
+                counters.swipes, counters.likes = int(swipes), int(likes)
+                counters.decayed_swipes, counters.decayed_likes = float(decayed_swipes), float(decayed_likes)
+
+        view_stats = db_session.execute(
+            select(IdeaView.idea_id, func.count(IdeaView.id)).group_by(IdeaView.idea_id)
+        )
+        for idea_id, views in view_stats:
+            counters = ideas.get(idea_id)
+            if counters is not None:
+                counters.views = int(views)
+
+        with self._lock:
+            self._ideas = ideas
+            self._epoch = epoch
+            self._rebuild()
+            self._loaded_at = time.time()
+
+        print(f"📈 Индекс популярности: {len(ideas)} идей в {len(self._domains)} доменах")
+
+    def _rebuild(self):
+        """Пересчитывает агрегаты доменов, глобальную долю лайков и отсортированные списки"""
+
+        domains: Dict[str, IdeaCounters] = {}
+        for counters in self._ideas.values():
+            total = domains.setdefault(counters.domain, IdeaCounters(counters.domain))
+            total.likes += counters.likes
+            total.swipes += counters.swipes
+            total.views += counters.views
+            total.decayed_likes += counters.decayed_likes
+            total.decayed_swipes += counters.decayed_swipes
+        self._domains = domains
+
+        decayed_likes = sum(d.decayed_likes for d in domains.values())
+        decayed_swipes = sum(d.decayed_swipes for d in domains.values())
+        self._prior_rate = decayed_likes / decayed_swipes if decayed_swipes > 0 else 0.5
+
+        ranked: Dict[str, List[Tuple[float, uuid.UUID]]] = {domain: [] for domain in domains}
+        for idea_id, counters in self._ideas.items():
+            ranked[counters.domain].append((-self._rate(counters), idea_id))
+        for entries in ranked.values():
+            entries.sort()
+        self._ranked = ranked
+
+    def _maybe_rebase(self, now: float):
+        """Переносит epoch, когда вес новых событий превысил 2 (раз в half_life)"""
+        elapsed = now - self._epoch
+        if elapsed <= self.half_life_seconds:
+            return
+        scale = 2.0 ** (-elapsed / self.half_life_seconds)
+        for counters in self._ideas.values():
+            counters.decayed_likes *= scale
+            counters.decayed_swipes *= scale
+        self._epoch = now
+        self._rebuild()
+
+    # --- скоры --------------------------------------------------------------
+
+    def _rate(self, counters: IdeaCounters) -> float:
+        return (counters.decayed_likes + self.prior_strength * self._prior_rate) / (
+            counters.decayed_swipes + self.prior_strength
+        )
+
+    def _weight(self, now: float) -> float:
+        return 2.0 ** ((now - self._epoch) / self.half_life_seconds)
+
+    def _reposition(self, idea_id: uuid.UUID, counters: IdeaCounters, old_rate: float):
+        entries = self._ranked.setdefault(counters.domain, [])
+        position = bisect_left(entries, (-old_rate, idea_id))
+        if position < len(entries) and entries[position][1] == idea_id:
+            del entries[position]
+        insort(entries, (-self._rate(counters), idea_id))
+
+    # --- инкрементальные обновления ------------------------------------------
+
+    def register_idea(self, idea_id: uuid.UUID, domain: str):
+        """Новая идея попадает в рейтинг своего домена с глобальной долей лайков"""
+        with self._lock:
+            if self._loaded_at is None or idea_id in self._ideas:
+                return
+            counters = self._ideas[idea_id] = IdeaCounters(domain)
+            self._domains.setdefault(domain, IdeaCounters(domain))
+            insort(self._ranked.setdefault(domain, []), (-self._rate(counters), idea_id))
+
+    def record_swipe(
+        self,
+        idea_id: uuid.UUID,
+        liked: bool,
+        previous: Optional[bool] = None,
+        created_at: Optional[datetime] = None,
+    ):
+        """Учитывает свайп; previous — прежнее значение при повторном свайпе той же идеи.
+
+        created_at — время свайпа в БД (upsert его не меняет): вес считается от него,
+        как в load(), поэтому прежний лайк вычитается ровно с тем весом, с которым добавлен.
+        """
+        with self._lock:
+            counters = self._ideas.get(idea_id)
+            if counters is None:
+                return
+            now = time.time()
+            self._maybe_rebase(now)
+            weight = self._weight(created_at.timestamp() if created_at is not None else now)
+            old_rate = self._rate(counters)
+            domain = self._domains.setdefault(counters.domain, IdeaCounters(counters.domain))
+
+            for target in (counters, domain):
+                if previous is None:
+                    target.swipes += 1
+                    target.decayed_swipes += weight
+                elif previous:
+                    target.likes -= 1
+                    target.decayed_likes = max(0.0, target.decayed_likes - weight)
+                if liked:
+                    target.likes += 1
+                    target.decayed_likes += weight
+
+            self._reposition(idea_id, counters, old_rate)
+
+    def record_view(self, idea_id: uuid.UUID):
+        with self._lock:
+            counters = self._ideas.get(idea_id)
+            if counters is None:
+                return
+            counters.views += 1
+            self._domains.setdefault(counters.domain, IdeaCounters(counters.domain)).views += 1
+
+    # --- чтение --------------------------------------------------------------
+
+    def top_k(
+        self,
+        domains: Iterable[str],
+        k: int,
+        exclude: Optional[Set[uuid.UUID]] = None,
+        unseen: Optional[Callable[[List[uuid.UUID]], Sequence[bool]]] = None,
+    ) -> List[Tuple[uuid.UUID, float]]:
+        """Топ-k идей по затухающей доле лайков среди доменов, без идей из exclude.
+
+        unseen — векторный фильтр (список id → маска «оставить»), применяется пачками по 2k.
+        """
+
+        exclude = exclude or set()
+        with self._lock:
+            streams = [self._ranked.get(domain, []) for domain in set(domains)]
+            merged = heapq.merge(*streams)
+            result = []
+            while len(result) < k:
+                chunk = [(idea_id, -negative_rate) for negative_rate, idea_id in islice(merged, 2 * k)]
+                if not chunk:
+                    break
+                chunk = [entry for entry in chunk if entry[0] not in exclude]
+                if unseen is not None and chunk:
+                    mask = unseen([idea_id for idea_id, _ in chunk])
+                    chunk = [entry for entry, keep in zip(chunk, mask) if keep]
+                result.extend(chunk)
+            return result[:k]
+
+    def like_rates(self, idea_ids: Iterable[uuid.UUID]) -> List[float]:
+        """Сглаженная затухающая доля лайков (для неизвестных идей — глобальная)"""
+        with self._lock:
+            return [
+                self._rate(self._ideas[idea_id]) if idea_id in self._ideas else self._prior_rate
+                for idea_id in idea_ids
+            ]
+
+    def _counters_dict(self, counters: IdeaCounters) -> Dict:
+        return {
+            "likes": counters.likes,
+            "swipes": counters.swipes,
+            "views": counters.views,
+            "like_rate": round(self._rate(counters), 4),
+        }
+
+    def idea_stats(self, idea_id: uuid.UUID) -> Optional[Dict]:
+        with self._lock:
+            counters = self._ideas.get(idea_id)
+            return self._counters_dict(counters) if counters else None
+
+    def domain_stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {domain: self._counters_dict(counters) for domain, counters in self._domains.items()}
+
+
+# Глобальный индекс популярности (один на процесс)
+popularity_index = PopularityIndex(
+    half_life_hours=settings.ML_POPULARITY_HALF_LIFE_HOURS,
+    prior_strength=settings.ML_POPULARITY_PRIOR_STRENGTH,
+    reload_minutes=settings.ML_POPULARITY_RELOAD_MINUTES,
+)
@@ -0,0 +1,162 @@
+"""
+Стратифицированная reservoir-выборка обучающих строк
+Держит обучающую выборку в пределах бюджета строк при любом размере таблицы swipes
+"""
+
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+
+
+class Sample(NamedTuple):
+    """Строки, оставшиеся в резервуарах"""
+    X: np.ndarray
+    y: np.ndarray
+    row_users: np.ndarray
+    row_order: Optional[np.ndarray]  # ключи порядка строк (см. order_width), если передавались
+    keys: np.ndarray  # ключи A-Res: сохраняются, чтобы продолжить выборку на новых строках
+
+
+class StratifiedReservoirSampler:
+    """Взвешенный резервуар (A-Res, Efraimidis–Spirakis) отдельно для каждого класса.
+
+    Бюджет делится между классами пропорционально их доле во всём потоке,
+    поэтому баланс лайков/дизлайков сохраняется. Внутри класса строка попадает
+    в выборку с вероятностью, пропорциональной её весу: при равных весах
+    пользователи представлены пропорционально своей активности, а вес
+    1 / n_user^alpha ослабляет вклад самых активных пользователей.
+
+    order_width > 0 — вместе со строками хранится ключ порядка ширины order_width
+    (например, (created_at, id) свайпа), чтобы выборки шардов можно было слить по времени.
+
+    Ключи A-Res отдаются вместе с выборкой: если снова предложить выбранные строки
+    с их прежними ключами и новые строки со свежими, результат совпадёт с выборкой
+    по всему потоку сразу — так инкрементальное обучение не перевзвешивает новые строки.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        class_counts: Dict[int, int],
+        n_features: int,
+        seed: int = 42,
+        order_width: int = 0,
+    ):
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self.n_features = n_features
+        self.order_width = order_width
+
+        total = sum(class_counts.values())
+        self._capacity: Dict[int, int] = {}
+        for label, count in class_counts.items():
+            if count > 0:
+                self._capacity[label] = min(count, max(1, int(round(budget * count / total))))
+
+        # Резервуар класса: ключи A-Res и параллельные им массивы строк
+        self._reservoirs: Dict[int, Dict[str, np.ndarray]] = {}
+        for label, cap in self._capacity.items():
+            reservoir = {
+                'keys': np.empty(cap, dtype=np.float64),
+                'X': np.empty((cap, n_features), dtype=np.float32),
+                'users': np.empty(cap, dtype=np.int32),
+                'pos': np.empty(cap, dtype=np.int64),
+            }
+            if order_width:
+                reservoir['order'] = np.empty((cap, order_width), dtype=np.uint64)
+            self._reservoirs[label] = reservoir
+        self._fill = {c: 0 for c in self._capacity}
+
+    def offer(
+        self,
+        X: np.ndarray,
+        y: np.ndarray,
+        row_users: np.ndarray,
+        weights: Optional[np.ndarray] = None,
+        order: Optional[np.ndarray] = None,
+        keys: Optional[np.ndarray] = None,
+    ):
+        """Предлагает пачку строк резервуарам; пачку можно переиспользовать после вызова.
+
+        keys — ранее выданные ключи строк; NaN (или keys=None) — сгенерировать ключ заново.
+        """
+
+        positions = np.arange(self.seen, self.seen + len(y), dtype=np.int64)
+        self.seen += len(y)
+        if weights is None:
+            weights = np.ones(len(y))
+
+        # Ключ A-Res: u^(1/w), в логарифмах — log(u) / w; в выборке остаются наибольшие ключи
+        fresh = np.log(self.rng.random(len(y))) / np.maximum(weights, 1e-12)
+        keys = fresh if keys is None else np.where(np.isnan(keys), fresh, keys)
+
+        for label, capacity in self._capacity.items():
+            idx = np.flatnonzero(y == label)
+            if len(idx) == 0:
+                continue
+            rows = {'keys': keys[idx], 'X': X[idx], 'users': row_users[idx], 'pos': positions[idx]}
+            if self.order_width:
+                rows['order'] = order[idx]
+            self._offer_class(label, capacity, rows)
+
+    def _offer_class(self, label: int, capacity: int, rows: Dict[str, np.ndarray]):
+        fill = self._fill[label]
+        reservoir = self._reservoirs[label]
+
+        # Пока резервуар не полон, просто дописываем
+        free = capacity - fill
+        if free > 0:
+            take = min(free, len(rows['keys']))
+            for name, values in rows.items():
+                reservoir[name][fill:fill + take] = values[:take]
+            self._fill[label] = fill = fill + take
+            rows = {name: values[take:] for name, values in rows.items()}
+            if len(rows['keys']) == 0:
+                return
+
+        # Дальше конкурируют только строки с ключом выше текущего минимума
+        candidates = rows['keys'] > reservoir['keys'].min()
+        if not candidates.any():
+            return
+        rows = {name: values[candidates] for name, values in rows.items()}
+
+        all_keys = np.concatenate([reservoir['keys'], rows['keys']])
+        keep = np.argpartition(-all_keys, capacity - 1)[:capacity]
+        from_reservoir = keep[keep < capacity]
+        from_chunk = keep[keep >= capacity] - capacity
+
+        slots = np.setdiff1d(np.arange(capacity), from_reservoir, assume_unique=True)
+        for name, values in rows.items():
+            reservoir[name][slots] = values[from_chunk]
+
+    def result(self) -> Sample:
+        """Выборка в порядке, в котором строки предлагались (для потока свайпов — по времени)"""
+
+        labels = list(self._capacity)
+
+        def column(name: str, empty: np.ndarray) -> np.ndarray:
+            if not labels:
+                return empty
+            return np.concatenate([self._reservoirs[c][name][:self._fill[c]] for c in labels])
+
+        y = np.concatenate([np.full(self._fill[c], c, dtype=np.int8) for c in labels]) if labels else np.empty(0, np.int8)
+        source_order = np.argsort(column('pos', np.empty(0, np.int64)), kind='stable')
+        return Sample(
+            X=column('X', np.empty((0, self.n_features), np.float32))[source_order],
+            y=y[source_order],
+            row_users=column('users', np.empty(0, np.int32))[source_order],
+            row_order=column('order', np.empty((0, self.order_width), np.uint64))[source_order] if self.order_width else None,
+            keys=column('keys', np.empty(0, np.float64))[source_order],
+        )
+
+    @property
+    def sampling_rate(self) -> float:
+        kept = sum(self._fill.values())
+        return kept / self.seen if self.seen else 1.0
+
+
+def heavy_user_weights(user_totals: np.ndarray, alpha: float) -> Optional[np.ndarray]:
+    """Веса строк 1 / n_user^alpha (alpha=0 — без ослабления, alpha=1 — пользователи на равных)"""
+    if alpha <= 0:
+        return None
+    return 1.0 / np.power(np.maximum(user_totals, 1), alpha)
@@ -0,0 +1,399 @@
+"""
+Множества просмотренных идей пользователей без запросов к idea_views
+Каждая идея получает плотный порядковый номер (в порядке created_at, id), каждый
+пользователь — множество номеров: отсортированный массив, пока просмотров мало,
+и битовая карта, когда массив становится больше карты (как контейнеры roaring).
+Множество загружается лениво одним запросом, обновляется при записи просмотра,
+а фильтрация кандидатов — векторная проверка битов. Снимок на диск позволяет
+воркеру после рестарта стартовать прогретым и догнать только новые события
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+import uuid
+
+import numpy as np
+from sqlalchemy import func, select
+
+from ..config import get_settings
+from ..models import Idea, IdeaView
+
+settings = get_settings()
+
+# События, закоммиченные позже водяного знака, но с более ранним временем, догоняются с запасом
+_SYNC_OVERLAP = timedelta(minutes=1)
+_ONE = np.uint64(1)
+
+
+def _words(n_bits: int) -> int:
+    return (n_bits + 63) // 64
+
+
+def _to_bitmap(ordinals: np.ndarray, n_words: int) -> np.ndarray:
+    bits = np.zeros(n_words, dtype=np.uint64)
+    np.bitwise_or.at(bits, ordinals >> 6, _ONE << (ordinals & 63).astype(np.uint64))
+    return bits
+
+
+def _uuid_array(ids: Sequence[uuid.UUID]) -> np.ndarray:
+    # Не "S16": numpy обрезает завершающие нулевые байты
+    return np.frombuffer(b"".join(i.bytes for i in ids), dtype=np.uint8).reshape(-1, 16)
+
+
+def _uuid_list(array: np.ndarray) -> List[uuid.UUID]:
+    return [uuid.UUID(bytes=row.tobytes()) for row in array]
+
+
+def _first_set_bits(bits: np.ndarray, limit: int) -> np.ndarray:
+    """Номера первых limit установленных битов; распаковываются только нужные слова"""
+    words = np.flatnonzero(bits)[:limit]  # в каждом ненулевом слове хотя бы один бит
+    if len(words) == 0:
+        return np.empty(0, dtype=np.int64)
+    unpacked = np.unpackbits(bits[words].astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    rows, offsets = np.nonzero(unpacked)
+    return (words[rows] * 64 + offsets)[:limit]
+
+
+class SeenSet:
+    """Номера просмотренных идей: sorted uint32 или битовая карта uint64"""
+
+    __slots__ = ("ordinals", "bits")
+
+    def __init__(self, ordinals: np.ndarray):
+        self.ordinals: Optional[np.ndarray] = np.unique(ordinals).astype(np.uint32)
+        self.bits: Optional[np.ndarray] = None
+        self._maybe_densify()
+
+    def _maybe_densify(self):
+        # Массив по 4 байта на номер дороже карты по 1 биту на идею — переходим на карту
+        if self.ordinals is not None and len(self.ordinals) and len(self.ordinals) * 32 > int(self.ordinals[-1]) + 1:
+            ordinals = self.ordinals.astype(np.int64)
+            self.bits = _to_bitmap(ordinals, _words(int(ordinals[-1]) + 1))
+            self.ordinals = None
+
+    def add(self, ordinals: np.ndarray):
+        if self.bits is not None:
+            needed = _words(int(ordinals.max()) + 1)
+            if needed > len(self.bits):
+                self.bits = np.concatenate([self.bits, np.zeros(needed - len(self.bits), dtype=np.uint64)])
+            np.bitwise_or.at(self.bits, ordinals >> 6, _ONE << (ordinals & 63).astype(np.uint64))
+        else:
+            self.ordinals = np.union1d(self.ordinals, ordinals.astype(np.uint32))
+            self._maybe_densify()
+
+    def contains(self, ordinals: np.ndarray) -> np.ndarray:
+        if self.bits is not None:
+            inside = ordinals >> 6 < len(self.bits)
+            result = np.zeros(len(ordinals), dtype=bool)
+            o = ordinals[inside]
+            result[inside] = (self.bits[o >> 6] >> (o & 63).astype(np.uint64)) & _ONE == _ONE
+            return result
+        position = np.searchsorted(self.ordinals, ordinals)
+        position = np.minimum(position, max(len(self.ordinals) - 1, 0))
+        return (self.ordinals[position] == ordinals) if len(self.ordinals) else np.zeros(len(ordinals), dtype=bool)
+
+    def bitmap(self, n_words: int) -> np.ndarray:
+        if self.bits is None:
+            return _to_bitmap(self.ordinals.astype(np.int64), n_words)
+        if len(self.bits) >= n_words:
+            return self.bits[:n_words]
+        return np.concatenate([self.bits, np.zeros(n_words - len(self.bits), dtype=np.uint64)])
+
+    def to_ordinals(self) -> np.ndarray:
+        if self.bits is None:
+            return self.ordinals
+        return _first_set_bits(self.bits, len(self.bits) * 64).astype(np.uint32)
+
+    @property
+    def nbytes(self) -> int:
+        return (self.bits if self.bits is not None else self.ordinals).nbytes
+
+
+class SeenSetIndex:
+    """Порядковые номера идей, битовые карты доменов и LRU множеств просмотренного.
+
+    «Просмотренной» считается идея из idea_views — как в ленте (_UNSEEN_FEED_SQL)
+    и get_user_seen_idea_ids. Раз в sync_seconds индекс догоняет БД с водяного знака:
+    новые идеи и просмотры загруженных пользователей, записанные другими процессами.
+
+    Только для одного процесса: просмотры из других воркеров видны лишь после
+    очередного sync, до этого пользователь может снова получить ту же идею.
+    """
+
+    def __init__(self, max_users: int = 50_000, sync_seconds: float = 30.0, snapshot_path: Optional[str] = None):
+        self.max_users = max_users
+        self.sync_seconds = sync_seconds
+        self.snapshot_path = snapshot_path
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._idea_ids: List[uuid.UUID] = []
+        self._ordinals: Dict[uuid.UUID, int] = {}
+        self._domains: Dict[str, np.ndarray] = {}  # битовая карта идей домена
+        self._users: "OrderedDict[uuid.UUID, SeenSet]" = OrderedDict()
+        self._watermark: Optional[datetime] = None
+        self._synced_at: Optional[float] = None
+
+    @property
+    def n_ideas(self) -> int:
+        return len(self._idea_ids)
+
+    @property
+    def n_users(self) -> int:
+        return len(self._users)
+
+    # --- загрузка и синхронизация -------------------------------------------
+
+    def ensure_loaded(self, db_session):
+        """Загружает номера идей при первом обращении и догоняет БД, если прошло sync_seconds"""
+        if self._synced_at is None:
+            self.load(db_session)
+        elif time.time() - self._synced_at > self.sync_seconds:
+            self.sync(db_session)
+
+    def load(self, db_session):
+        now = db_session.execute(select(func.now())).scalar()
+        rows = db_session.execute(select(Idea.id, Idea.domain).order_by(Idea.created_at, Idea.id)).all()
+        with self._lock:
+            self._reset()
+            self._append_ideas(rows)
+            self._watermark = now
+            self._synced_at = time.time()
+        print(f"👁️ Множества просмотренного: {self.n_ideas} идей в {len(self._domains)} доменах")
+
+    def sync(self, db_session):
+        """Догоняет БД с водяного знака: новые идеи и просмотры загруженных пользователей"""
+
+        now = db_session.execute(select(func.now())).scalar()
+        since = self._watermark - _SYNC_OVERLAP
+        ideas = db_session.execute(
+            select(Idea.id, Idea.domain).where(Idea.created_at > since).order_by(Idea.created_at, Idea.id)
+        ).all()
+        events = db_session.execute(
+            select(IdeaView.user_id, IdeaView.idea_id).where(IdeaView.viewed_at > since)
+        ).all()
+
+        with self._lock:
+            self._append_ideas(ideas)
+            by_user: Dict[uuid.UUID, List[uuid.UUID]] = {}
+            for user_id, idea_id in events:
+                if user_id in self._users:
+                    by_user.setdefault(user_id, []).append(idea_id)
+            for user_id, idea_ids in by_user.items():
+                self._add(self._users[user_id], idea_ids)
+            self._watermark = now
+            self._synced_at = time.time()
+
+    def _append_ideas(self, rows: Iterable):
+        new = [(idea_id, domain) for idea_id, domain in rows if idea_id not in self._ordinals]
+        if not new:
+            return
+        start = self.n_ideas
+        for offset, (idea_id, _) in enumerate(new):
+            self._ordinals[idea_id] = start + offset
+            self._idea_ids.append(idea_id)
+
+        n_words = _words(self.n_ideas)
+        ordinals = np.arange(start, self.n_ideas, dtype=np.int64)
+        domains = np.array([domain for _, domain in new], dtype=object)
+        for domain in set(domains):
+            bits = self._domains.get(domain, np.zeros(0, dtype=np.uint64))
+            bits = np.concatenate([bits, np.zeros(n_words - len(bits), dtype=np.uint64)])
+            selected = ordinals[domains == domain]
+            np.bitwise_or.at(bits, selected >> 6, _ONE << (selected & 63).astype(np.uint64))
+            self._domains[domain] = bits
+
+    def _known_ordinals(self, idea_ids: Iterable[uuid.UUID]) -> np.ndarray:
+        ordinals = (self._ordinals.get(idea_id, -1) for idea_id in idea_ids)
+        ordinals = np.fromiter(ordinals, dtype=np.int64)
+        return ordinals[ordinals >= 0]
+
+    def _add(self, seen: SeenSet, idea_ids: Iterable[uuid.UUID]):
+        ordinals = self._known_ordinals(idea_ids)
+        if len(ordinals):
+            seen.add(ordinals)
+
+    def _seen_set(self, db_session, user_id: uuid.UUID) -> SeenSet:
+        """Множество пользователя из LRU или одним запросом к idea_views"""
+
+        with self._lock:
+            seen = self._users.get(user_id)
+            if seen is not None:
+                self._users.move_to_end(user_id)
+                return seen
+
+        idea_ids = db_session.execute(
+            select(IdeaView.idea_id).where(IdeaView.user_id == user_id)
+        ).scalars().all()
+
+        with self._lock:
+            seen = self._users.get(user_id)
+            if seen is None:
+                seen = self._users[user_id] = SeenSet(self._known_ordinals(idea_ids))
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            return seen
+
+    # --- обновления ----------------------------------------------------------
+
+    def register_idea(self, idea_id: uuid.UUID, domain: str):
+        with self._lock:
+            if self._synced_at is not None:
+                self._append_ideas([(idea_id, domain)])
+
+    def remove_ideas(self, idea_ids: Iterable[uuid.UUID]):
+        """Снимает удалённые идеи (компакция) с карт доменов — в выдачу они больше не попадут.
+
+        Незагруженный индекс сначала поднимается из снимка, чтобы после snapshot()
+        удалённых идей не было и в нём.
+        """
+        if self._synced_at is None and not self.restore():
+            return
+        with self._lock:
+            ordinals = self._known_ordinals(idea_ids)
+            for bits in self._domains.values():
+                inside = ordinals[ordinals >> 6 < len(bits)]
+                np.bitwise_and.at(bits, inside >> 6, ~(_ONE << (inside & 63).astype(np.uint64)))
+
+    def mark_seen(self, user_id: uuid.UUID, idea_ids: Iterable[uuid.UUID]):
+        """Отмечает идеи просмотренными; незагруженные пользователи подтянутся из БД при чтении"""
+        with self._lock:
+            seen = self._users.get(user_id)
+            if seen is not None:
+                self._add(seen, idea_ids)
+
+    # --- чтение --------------------------------------------------------------
+
+    def unseen_mask(self, db_session, user_id: uuid.UUID, idea_ids: Sequence[uuid.UUID]) -> np.ndarray:
+        """Маска «не просмотрена» для idea_ids; идеи, которых нет в индексе, считаются непросмотренными"""
+
+        self.ensure_loaded(db_session)
+        seen = self._seen_set(db_session, user_id)
+        with self._lock:
+            ordinals = np.fromiter((self._ordinals.get(idea_id, -1) for idea_id in idea_ids), dtype=np.int64)
+            known = ordinals >= 0
+            mask = np.ones(len(ordinals), dtype=bool)
+            mask[known] = ~seen.contains(ordinals[known])
+            return mask
+
+    def unseen_idea_ids(
+        self,
+        db_session,
+        user_id: uuid.UUID,
+        domains: Sequence[str],
+        limit: int,
+        balance_domains: bool = True,
+    ) -> List[uuid.UUID]:
+        """Первые limit непросмотренных идей доменов в порядке ленты (created_at, id).
+
+        Кандидаты домена — карта домена AND NOT карта пользователя; с balance_domains
+        домены чередуются, как в get_unseen_feed.
+        """
+
+        self.ensure_loaded(db_session)
+        seen = self._seen_set(db_session, user_id)
+        with self._lock:
+            n_words = _words(self.n_ideas)
+            user_bits = seen.bitmap(n_words)
+            ordinals, ranks = [], []
+            for domain in dict.fromkeys(domains):
+                domain_bits = self._domains.get(domain)
+                if domain_bits is None:
+                    continue
+                candidates = _first_set_bits(domain_bits & ~user_bits[:len(domain_bits)], limit)
+                ordinals.append(candidates)
+                ranks.append(np.arange(len(candidates)))
+            if not ordinals:
+                return []
+
+            ordinals, ranks = np.concatenate(ordinals), np.concatenate(ranks)
+            order = np.lexsort((ordinals, ranks)) if balance_domains else np.argsort(ordinals)
+            return [self._idea_ids[ordinal] for ordinal in ordinals[order[:limit]]]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            dense = sum(1 for seen in self._users.values() if seen.bits is not None)
+            return {
+                "ideas": self.n_ideas,
+                "users": self.n_users,
+                "dense_users": dense,
+                "memory_bytes": sum(seen.nbytes for seen in self._users.values())
+                + sum(bits.nbytes for bits in self._domains.values()),
+            }
+
+    # --- снимок --------------------------------------------------------------
+
+    def snapshot(self, path: Optional[str] = None) -> bool:
+        """Сохраняет номера идей, карты доменов и множества пользователей (CSR) в .npz"""
+
+        path = path or self.snapshot_path
+        with self._lock:
+            if self._synced_at is None or not path:
+                return False
+            domain_names = list(self._domains)
+            n_words = _words(self.n_ideas)
+            user_ordinals = [seen.to_ordinals() for seen in self._users.values()]
+            arrays = {
+                "idea_ids": _uuid_array(self._idea_ids),
+                "domain_names": np.array(domain_names, dtype=str),
+                "domain_bits": np.stack([
+                    np.concatenate([self._domains[d], np.zeros(n_words - len(self._domains[d]), dtype=np.uint64)])
+                    for d in domain_names
+                ]) if domain_names else np.zeros((0, n_words), dtype=np.uint64),
+                "user_ids": _uuid_array(list(self._users)),
+                "user_offsets": np.cumsum([0] + [len(o) for o in user_ordinals]),
+                "user_ordinals": np.concatenate(user_ordinals) if user_ordinals else np.zeros(0, dtype=np.uint32),
+                "watermark": np.array(self._watermark.isoformat()),
+            }
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        print(f"💾 Снимок множеств просмотренного: {len(arrays['user_ids'])} пользователей → {path}")
+        return True
+
+    def restore(self, path: Optional[str] = None) -> bool:
+        """Поднимает индекс из снимка; первое ensure_loaded догонит БД с водяного знака снимка"""
+
+        path = path or self.snapshot_path
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                idea_ids = _uuid_list(data["idea_ids"])
+                domain_names = data["domain_names"].tolist()
+                domain_bits = data["domain_bits"]
+                user_ids = _uuid_list(data["user_ids"])
+                offsets = data["user_offsets"]
+                user_ordinals = data["user_ordinals"]
+                watermark = datetime.fromisoformat(str(data["watermark"]))
+        except (OSError, KeyError, ValueError) as e:
+            print(f"⚠️ Снимок множеств просмотренного не прочитан: {e}")
+            return False
+
+        with self._lock:
+            self._reset()
+            self._idea_ids = idea_ids
+            self._ordinals = {idea_id: i for i, idea_id in enumerate(idea_ids)}
+            self._domains = {domain: domain_bits[i].copy() for i, domain in enumerate(domain_names)}
+            for i, user_id in enumerate(user_ids[-self.max_users:], start=max(0, len(user_ids) - self.max_users)):
+                self._users[user_id] = SeenSet(user_ordinals[offsets[i]:offsets[i + 1]])
+            self._watermark = watermark
+            self._synced_at = 0.0  # следующий ensure_loaded выполнит sync
+        print(f"👁️ Множества просмотренного из снимка: {self.n_ideas} идей, {self.n_users} пользователей")
+        return True
+
+
+# Глобальный индекс просмотренного (один на процесс)
+seen_sets = SeenSetIndex(
+    max_users=settings.ML_SEEN_SETS_MAX_USERS,
+    sync_seconds=settings.ML_SEEN_SETS_SYNC_SECONDS,
+    snapshot_path=os.path.join(settings.ML_MODEL_DIR, "seen_sets.npz"),
+)
@@ -0,0 +1,848 @@
+"""
+Потоковая загрузка обучающих данных для ML-моделей
+Свайпы читаются серверным курсором (yield_per) и сразу превращаются
+в признаки в заранее выделенных NumPy-массивах — без ORM-объектов
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import multiprocessing
+import os
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+import uuid
+
+import numpy as np
+from sqlalchemy import Text, cast, create_engine, func, select, tuple_
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from ..models import Idea, Swipe, User
+from .sampling import StratifiedReservoirSampler, heavy_user_weights
+
+
+# Порядок признаков общий для обучения и предсказания
+FEATURE_NAMES = [
+    'text_length', 'tag_count', 'domain', 'user_history_length',
+    'user_likes_count', 'like_ratio', 'selected_domains_count', 'domain_match'
+]
+N_FEATURES = len(FEATURE_NAMES)
+
+FEATURE_DTYPE = np.float32
+
+
+# Водяной знак свайпов: (updated_at, id) последнего учтённого изменения. updated_at сдвигают
+# повторный свайп со сменой значения и перенос строки компакцией; created_at не меняется
+Watermark = Tuple[datetime, uuid.UUID]
+
+# Время свайпа: (created_at, id) — порядок строк и срезы офлайн-оценки
+SwipeKey = Tuple[datetime, uuid.UUID]
+
+# Шард пользователей: (номер шарда, всего шардов)
+Shard = Tuple[int, int]
+
+# Ключ порядка строки: (created_at в микросекундах, старшие и младшие 8 байт id свайпа)
+ORDER_WIDTH = 3
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class UserStats(NamedTuple):
+    """Агрегаты пользователя, нужные для признаков"""
+    total_swipes: int
+    total_likes: int
+    selected_domains: frozenset
+
+
+class TrainingMatrix(NamedTuple):
+    """Матрица признаков и привязка строк к пользователям"""
+    X: np.ndarray
+    y: np.ndarray
+    row_users: np.ndarray  # индекс пользователя строки в users
+    users: List[uuid.UUID]
+    watermark: Optional[Watermark]
+    source_rows: int = 0  # сколько свайпов рассмотрено (до выборки)
+    row_order: Optional[np.ndarray] = None  # ключи (created_at, id) строк, если запрошены (нужны кэшу)
+    sample_keys: Optional[np.ndarray] = None  # ключи A-Res строк; NaN — строка взята без выборки
+    source_likes: Optional[int] = None  # сколько лайков среди source_rows
+
+    @property
+    def sampling_rate(self) -> float:
+        return len(self.y) / self.source_rows if self.source_rows else 1.0
+
+    def source_class_counts(self) -> Dict[int, int]:
+        """Лайки и дизлайки среди всех рассмотренных свайпов (для старого кэша — оценка по выборке)"""
+        source_rows = self.source_rows or len(self.y)
+        likes = self.source_likes
+        if likes is None:
+            likes = int(round(float(self.y.mean()) * source_rows)) if len(self.y) else 0
+        return {1: likes, 0: source_rows - likes}
+
+    def keys_or_nan(self) -> np.ndarray:
+        """Ключи A-Res строк; строкам без ключа — NaN"""
+        if self.sample_keys is not None:
+            return self.sample_keys
+        return np.full(len(self.y), np.nan)
+
+
+def combined_text_length(title: str, description: str, tags: Optional[Sequence[str]]) -> int:
+    """Длина текста "title description tags" без сборки самой строки"""
+    return len(title) + len(description) + len(' '.join(tags or [])) + 2
+
+
+def _shard_filter(user_id_column, shard: Shard):
+    """Условие "пользователь попадает в шард" по хэшу его id (считается в Postgres)"""
+    index, n_shards = shard
+    user_hash = func.hashtext(cast(user_id_column, Text)).op('&')(0x7FFFFFFF)
+    return user_hash % n_shards == index
+
+
+def _changed_key():
+    return tuple_(Swipe.updated_at, Swipe.id)
+
+
+def _created_key():
+    return tuple_(Swipe.created_at, Swipe.id)
+
+
+def _swipe_bounds(
+    stmt,
+    since: Optional[Watermark] = None,
+    until: Optional[Watermark] = None,
+    shard: Optional[Shard] = None,
+    created_since: Optional[SwipeKey] = None,
+    created_until: Optional[SwipeKey] = None,
+):
+    """since/until — по водяному знаку изменений, created_since/created_until — по времени свайпа"""
+    if since is not None:
+        stmt = stmt.where(_changed_key() > tuple_(*since))
+    if until is not None:
+        stmt = stmt.where(_changed_key() <= tuple_(*until))
+    if created_since is not None:
+        stmt = stmt.where(_created_key() > tuple_(*created_since))
+    if created_until is not None:
+        stmt = stmt.where(_created_key() <= tuple_(*created_until))
+    if shard is not None:
+        stmt = stmt.where(_shard_filter(Swipe.user_id, shard))
+    return stmt
+
+
+def load_user_stats(
+    db_session,
+    user_ids: Optional[Sequence[uuid.UUID]] = None,
+    shard: Optional[Shard] = None,
+    until: Optional[Watermark] = None,
+    created_until: Optional[SwipeKey] = None,
+) -> Dict[uuid.UUID, UserStats]:
+    """Одним GROUP BY считает количество свайпов и лайков по пользователям.
+
+    С until учитываются только изменения не новее водяного знака (снимок загрузки),
+    с created_until — только свайпы не новее среза (состояние на момент среза).
+    """
+
+    join_on = Swipe.user_id == User.id
+    if until is not None:
+        join_on = join_on & (_changed_key() <= tuple_(*until))
+    if created_until is not None:
+        join_on = join_on & (_created_key() <= tuple_(*created_until))
+
+    stmt = (
+        select(
+            User.id,
+            User.selected_domains,
+            func.count(Swipe.id),
+            func.count(Swipe.id).filter(Swipe.swipe.is_(True)),
+        )
+        .outerjoin(Swipe, join_on)
+        .group_by(User.id)
+    )
+    if user_ids is not None:
+        stmt = stmt.where(User.id.in_(list(user_ids)))
+    if shard is not None:
+        stmt = stmt.where(_shard_filter(User.id, shard))
+
+    return {
+        user_id: UserStats(int(total), int(likes), frozenset(domains or []))
+        for user_id, domains, total, likes in db_session.execute(stmt)
+    }
+
+
+def _swipe_rows_query(
+    since: Optional[Watermark] = None,
+    until: Optional[Watermark] = None,
+    shard: Optional[Shard] = None,
+    created_since: Optional[SwipeKey] = None,
+    created_until: Optional[SwipeKey] = None,
+):
+    """Плоский запрос свайпов с нужными колонками идеи, по порядку создания"""
+
+    stmt = (
+        select(
+            Swipe.user_id,
+            Swipe.swipe,
+            Idea.title,
+            Idea.description,
+            Idea.tags,
+            Idea.domain,
+            Swipe.created_at,
+            Swipe.id,
+            Swipe.idea_id,
+        )
+        .join(Idea, Swipe.idea_id == Idea.id)
+        .order_by(Swipe.created_at, Swipe.id)
+    )
+    return _swipe_bounds(stmt, since, until, shard, created_since, created_until)
+
+
+def count_swipes(
+    db_session,
+    since: Optional[Watermark] = None,
+    shard: Optional[Shard] = None,
+    until: Optional[Watermark] = None,
+    created_until: Optional[SwipeKey] = None,
+    created_since: Optional[SwipeKey] = None,
+) -> Tuple[int, int]:
+    """Количество свайпов и лайков (для предвыделения массивов и бюджета классов)"""
+    stmt = select(func.count(Swipe.id), func.count(Swipe.id).filter(Swipe.swipe.is_(True)))
+    stmt = _swipe_bounds(stmt, since, until, shard, created_since, created_until)
+    total, likes = db_session.execute(stmt).one()
+    return int(total), int(likes)
+
+
+def latest_watermark(db_session) -> Optional[Watermark]:
+    """(updated_at, id) последнего изменения свайпов"""
+    row = db_session.execute(
+        select(Swipe.updated_at, Swipe.id).order_by(Swipe.updated_at.desc(), Swipe.id.desc()).limit(1)
+    ).first()
+    return (row[0], row[1]) if row else None
+
+
+def recent_rows_bound(db_session, max_rows: int, until: Optional[Watermark] = None) -> Optional[SwipeKey]:
+    """(created_at, id) свайпа, после которого идут последние max_rows свайпов; None — их не больше"""
+    stmt = _swipe_bounds(select(Swipe.created_at, Swipe.id), until=until)
+    row = db_session.execute(
+        stmt.order_by(Swipe.created_at.desc(), Swipe.id.desc()).offset(max_rows).limit(1)
+    ).first()
+    return (row[0], row[1]) if row else None
+
+
+def latest_swipe_key(db_session) -> Optional[SwipeKey]:
+    """(created_at, id) самого нового свайпа"""
+    row = db_session.execute(
+        select(Swipe.created_at, Swipe.id).order_by(Swipe.created_at.desc(), Swipe.id.desc()).limit(1)
+    ).first()
+    return (row[0], row[1]) if row else None
+
+
+def iter_swipe_row_chunks(
+    db_session,
+    chunk_size: int,
+    skip: int = 0,
+    since: Optional[Watermark] = None,
+    until: Optional[Watermark] = None,
+    shard: Optional[Shard] = None,
+    created_since: Optional[SwipeKey] = None,
+    created_until: Optional[SwipeKey] = None,
+) -> Iterator[Sequence]:
+    """Читает свайпы серверным курсором пачками по chunk_size строк (в порядке created_at, id)"""
+
+    stmt = _swipe_rows_query(since, until, shard, created_since, created_until)
+    if skip:
+        stmt = stmt.offset(skip)
+
+    result = db_session.execute(stmt.execution_options(yield_per=chunk_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def fill_feature_rows(
+    rows: Sequence,
+    user_stats: Dict[uuid.UUID, UserStats],
+    domain_codes: Dict[str, int],
+    out_X: np.ndarray,
+    out_y: np.ndarray,
+) -> int:
+    """Заполняет out_X/out_y признаками для пачки строк, возвращает число строк"""
+
+    n = len(rows)
+    if n == 0:
+        return 0
+
+    empty = UserStats(0, 0, frozenset())
+    stats = [user_stats.get(row[0], empty) for row in rows]
+
+    # Признаки идеи
+    out_X[:n, 0] = [combined_text_length(row[2], row[3], row[4]) for row in rows]
+    out_X[:n, 1] = [len(row[4] or []) for row in rows]
+    out_X[:n, 2] = [domain_codes.get(row[5], 0) for row in rows]
+
+    # Признаки пользователя
+    totals = np.fromiter((s.total_swipes for s in stats), dtype=FEATURE_DTYPE, count=n)
+    likes = np.fromiter((s.total_likes for s in stats), dtype=FEATURE_DTYPE, count=n)
+    out_X[:n, 3] = totals
+    out_X[:n, 4] = likes
+    out_X[:n, 5] = np.divide(likes, totals, out=np.zeros(n, dtype=FEATURE_DTYPE), where=totals > 0)
+    out_X[:n, 6] = [len(s.selected_domains) for s in stats]
+
+    # Взаимодействие пользователь-идея
+    out_X[:n, 7] = [1 if row[5] in s.selected_domains else 0 for row, s in zip(rows, stats)]
+
+    out_y[:n] = [1 if row[1] else 0 for row in rows]
+    return n
+
+
+def order_key(key: SwipeKey) -> Tuple[int, int, int]:
+    """Ключ порядка строки для (created_at, id) свайпа"""
+    created_at, swipe_id = key
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    id_bytes = swipe_id.bytes
+    return (
+        (created_at - _EPOCH) // _MICROSECOND,
+        int.from_bytes(id_bytes[:8], 'big'),
+        int.from_bytes(id_bytes[8:], 'big'),
+    )
+
+
+def _fill_order_keys(rows: Sequence, out: np.ndarray):
+    """Пишет в out ключ (created_at, id) каждой строки; порядок ключей совпадает с порядком Postgres"""
+    for i, row in enumerate(rows):
+        out[i] = order_key((row[6], row[7]))
+
+
+def sortable_order_keys(order: np.ndarray) -> np.ndarray:
+    """Ключи порядка как байтовые строки big-endian: сравниваются и сортируются как кортежи"""
+    return np.ascontiguousarray(order, dtype='>u8').view(f'S{8 * ORDER_WIDTH}').ravel()
+
+
+def _sortable_key(key: SwipeKey):
+    return sortable_order_keys(np.array([order_key(key)], dtype=np.uint64))[0]
+
+
+def _select_rows(matrix: TrainingMatrix, rows) -> TrainingMatrix:
+    """Подмножество строк матрицы (индексы, срез или маска); users и счётчики потока не меняются"""
+    return matrix._replace(
+        X=matrix.X[rows],
+        y=matrix.y[rows],
+        row_users=matrix.row_users[rows],
+        row_order=matrix.row_order[rows] if matrix.row_order is not None else None,
+        sample_keys=matrix.sample_keys[rows] if matrix.sample_keys is not None else None,
+    )
+
+
+def rows_created_until(matrix: TrainingMatrix, created_until: SwipeKey) -> TrainingMatrix:
+    """Строки матрицы со свайпами не новее среза (нужны row_order); агрегаты пользователей не меняются"""
+    return _select_rows(matrix, sortable_order_keys(matrix.row_order) <= _sortable_key(created_until))
+
+
+def _assign_user_codes(
+    rows: Sequence,
+    user_index: Dict[uuid.UUID, int],
+    users: List[uuid.UUID],
+    out: np.ndarray,
+):
+    """Пишет в out индекс пользователя каждой строки, дополняя users новыми"""
+    for i, row in enumerate(rows):
+        code = user_index.get(row[0])
+        if code is None:
+            code = user_index[row[0]] = len(users)
+            users.append(row[0])
+        out[i] = code
+
+
+def load_training_matrix(
+    db_session,
+    domain_codes: Dict[str, int],
+    chunk_size: int,
+    max_rows: int,
+    since: Optional[Watermark] = None,
+    user_stats: Optional[Dict[uuid.UUID, UserStats]] = None,
+    shard: Optional[Shard] = None,
+    sample_budget: int = 0,
+    heavy_user_alpha: float = 0.0,
+    until: Optional[Watermark] = None,
+    with_order: bool = False,
+    created_until: Optional[SwipeKey] = None,
+    created_since: Optional[SwipeKey] = None,
+    class_counts: Optional[Dict[int, int]] = None,
+) -> TrainingMatrix:
+    """Собирает матрицу признаков, но не больше max_rows последних свайпов.
+
+    С since читаются только свайпы, изменённые после водяного знака (для инкрементального
+    обучения), с until — не позже него, с created_since/created_until — созданные
+    после/не позже среза, с shard — только свайпы пользователей этого шарда. Без
+    until водяной знак снимается до чтения и публикуется как водяной знак матрицы.
+    С sample_budget вместо последних строк берётся стратифицированная выборка по всей истории;
+    class_counts — лайки/дизлайки потока, по которым бюджет делится между классами
+    (для шарда — по всем шардам), по умолчанию — прочитанных свайпов.
+    with_order — вернуть ключи (created_at, id) строк: по ним сливаются шарды и кэш с дельтой.
+    """
+
+    if until is None:
+        until = latest_watermark(db_session)
+    watermark = until or since
+    total, likes = count_swipes(db_session, since, shard, until, created_until, created_since)
+    if user_stats is None:
+        user_stats = load_user_stats(db_session, shard=shard, until=until, created_until=created_until)
+
+    budget = min(sample_budget, max_rows) if sample_budget else 0
+    if budget and total > budget:
+        return _sample_training_matrix(
+            db_session, domain_codes, chunk_size, budget, since, until, user_stats, shard,
+            class_counts=class_counts or {1: likes, 0: total - likes},
+            heavy_user_alpha=heavy_user_alpha,
+            with_order=with_order,
+            created_until=created_until,
+            created_since=created_since,
+            source_likes=likes,
+        )
+
+    n_rows = min(total, max_rows)
+    skip = total - n_rows
+
+    X = np.empty((n_rows, N_FEATURES), dtype=FEATURE_DTYPE)
+    y = np.empty(n_rows, dtype=np.int8)
+    row_users = np.empty(n_rows, dtype=np.int32)
+    row_order = np.empty((n_rows, ORDER_WIDTH), dtype=np.uint64) if with_order else None
+    users: List[uuid.UUID] = []
+    user_index: Dict[uuid.UUID, int] = {}
+
+    offset = 0
+    if n_rows:
+        for rows in iter_swipe_row_chunks(
+            db_session, chunk_size, skip=skip, since=since, until=until, shard=shard,
+            created_since=created_since, created_until=created_until,
+        ):
+            rows = rows[: n_rows - offset]
+            n = fill_feature_rows(rows, user_stats, domain_codes, X[offset:], y[offset:])
+            _assign_user_codes(rows, user_index, users, row_users[offset:])
+            if with_order:
+                _fill_order_keys(rows, row_order[offset:])
+            offset += n
+            if offset >= n_rows:
+                break
+
+    return TrainingMatrix(
+        X[:offset], y[:offset], row_users[:offset], users, watermark, source_rows=total,
+        row_order=row_order[:offset] if with_order else None,
+        source_likes=likes,
+    )
+
+
+def _sample_training_matrix(
+    db_session,
+    domain_codes: Dict[str, int],
+    chunk_size: int,
+    budget: int,
+    since: Optional[Watermark],
+    until: Optional[Watermark],
+    user_stats: Dict[uuid.UUID, UserStats],
+    shard: Optional[Shard],
+    class_counts: Dict[int, int],
+    heavy_user_alpha: float,
+    with_order: bool = False,
+    created_until: Optional[SwipeKey] = None,
+    created_since: Optional[SwipeKey] = None,
+    source_likes: Optional[int] = None,
+) -> TrainingMatrix:
+    """Проходит все свайпы пачками и оставляет стратифицированную выборку размером budget"""
+
+    sampler = StratifiedReservoirSampler(
+        budget, class_counts, N_FEATURES, order_width=ORDER_WIDTH if with_order else 0
+    )
+    X = np.empty((chunk_size, N_FEATURES), dtype=FEATURE_DTYPE)
+    y = np.empty(chunk_size, dtype=np.int8)
+    chunk_users = np.empty(chunk_size, dtype=np.int32)
+    chunk_order = np.empty((chunk_size, ORDER_WIDTH), dtype=np.uint64) if with_order else None
+    users: List[uuid.UUID] = []
+    user_index: Dict[uuid.UUID, int] = {}
+
+    for rows in iter_swipe_row_chunks(
+        db_session, chunk_size, since=since, until=until, shard=shard,
+        created_since=created_since, created_until=created_until,
+    ):
+        n = fill_feature_rows(rows, user_stats, domain_codes, X, y)
+        if not n:
+            continue
+        _assign_user_codes(rows, user_index, users, chunk_users)
+        if with_order:
+            _fill_order_keys(rows, chunk_order)
+        # Столбец 3 — число свайпов пользователя, по нему ослабляем активных пользователей
+        weights = heavy_user_weights(X[:n, 3], heavy_user_alpha)
+        sampler.offer(X[:n], y[:n], chunk_users[:n], weights, order=chunk_order[:n] if with_order else None)
+
+    sample = sampler.result()
+    return TrainingMatrix(
+        sample.X, sample.y, sample.row_users, users, until or since,
+        source_rows=sampler.seen, row_order=sample.row_order,
+        sample_keys=sample.keys, source_likes=class_counts.get(1, 0) if source_likes is None else source_likes,
+    )
+
+
+def resample_training_matrix(matrix: TrainingMatrix, budget: int, heavy_user_alpha: float = 0.0) -> TrainingMatrix:
+    """Ужимает уже собранную матрицу до бюджета той же стратифицированной выборкой.
+
+    Строки, уже прошедшие выборку, конкурируют со своими сохранёнными ключами A-Res,
+    остальные (дельта, строки без выборки) получают свежие. Бюджет делится между
+    классами по их доле во всём рассмотренном потоке, а не в матрице. Так
+    результат совпадает с выборкой по всей истории, и новые строки не
+    перепредставлены. Порядок строк (по времени) и их ключи порядка сохраняются.
+    """
+
+    if len(matrix.y) <= budget:
+        return matrix
+
+    with_order = matrix.row_order is not None
+    sampler = StratifiedReservoirSampler(
+        budget, matrix.source_class_counts(), N_FEATURES, order_width=ORDER_WIDTH if with_order else 0
+    )
+    sampler.offer(
+        matrix.X, matrix.y, matrix.row_users,
+        heavy_user_weights(matrix.X[:, 3], heavy_user_alpha),
+        order=matrix.row_order,
+        keys=matrix.keys_or_nan(),
+    )
+    sample = sampler.result()
+    return matrix._replace(
+        X=sample.X, y=sample.y, row_users=sample.row_users, row_order=sample.row_order, sample_keys=sample.keys,
+    )
+
+
+def _load_shard_matrix(
+    database_url: str,
+    shard: Shard,
+    domain_codes: Dict[str, int],
+    chunk_size: int,
+    max_rows: int,
+    sample_budget: int,
+    heavy_user_alpha: float,
+    until: Watermark,
+    created_since: Optional[SwipeKey],
+    class_counts: Dict[int, int],
+) -> TrainingMatrix:
+    """Воркер пула: строит свою часть матрицы через собственное подключение к БД.
+
+    Шард — все свайпы подмножества пользователей, поэтому агрегаты пользователей
+    считаются внутри шарда без обмена данными между процессами. Все шарды
+    читают свайпы не новее общего until, поэтому свайп, закоммиченный во время
+    загрузки, не окажется ниже опубликованного водяного знака. Модуль
+    импортирует только модели — без движков приложения и create_all.
+    """
+
+    engine = create_engine(database_url, poolclass=NullPool)
+    try:
+        with Session(engine) as db_session:
+            return load_training_matrix(
+                db_session,
+                domain_codes,
+                chunk_size=chunk_size,
+                max_rows=max_rows,
+                shard=shard,
+                sample_budget=sample_budget,
+                heavy_user_alpha=heavy_user_alpha,
+                until=until,
+                with_order=True,
+                created_since=created_since,
+                class_counts=class_counts,
+            )
+    finally:
+        engine.dispose()
+
+
+def load_training_matrix_parallel(
+    db_session,
+    domain_codes: Dict[str, int],
+    chunk_size: int,
+    max_rows: int,
+    n_workers: int,
+    until: Optional[Watermark],
+    sample_budget: int = 0,
+    heavy_user_alpha: float = 0.0,
+) -> TrainingMatrix:
+    """Собирает матрицу признаков в пуле процессов: пользователи шардируются по хэшу id.
+
+    until — водяной знак, снятый вызывающим один раз до запуска шардов: все
+    шарды читают свайпы не новее него, и он же публикуется как водяной знак
+    матрицы. Потолок max_rows общий: нижняя граница (created_at, id) последних
+    max_rows свайпов считается здесь один раз, шарды читают только строки новее
+    неё, и после слияния по (created_at, id) результат не зависит от числа
+    воркеров. С выборкой шарды делят бюджет между классами по всему потоку, а
+    слитые выборки ужимаются до бюджета по своим ключам A-Res — как одна
+    выборка по всей истории.
+    """
+
+    if until is None:
+        return TrainingMatrix(
+            np.empty((0, N_FEATURES), dtype=FEATURE_DTYPE), np.empty(0, dtype=np.int8),
+            np.empty(0, dtype=np.int32), [], None,
+        )
+
+    total, likes = count_swipes(db_session, until=until)
+    class_counts = {1: likes, 0: total - likes}
+    budget = min(sample_budget, max_rows) if sample_budget else 0
+    sampling = bool(budget) and total > budget
+    created_since = None
+    if not sampling and total > max_rows:
+        created_since = recent_rows_bound(db_session, max_rows, until)
+
+    database_url = db_session.get_bind().url.render_as_string(hide_password=False)
+    # spawn: воркеры не наследуют потоки и пул соединений родительского процесса
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(
+                _load_shard_matrix,
+                database_url,
+                (i, n_workers),
+                domain_codes,
+                chunk_size,
+                max_rows,
+                budget if sampling else 0,
+                heavy_user_alpha,
+                until,
+                created_since,
+                class_counts,
+            )
+            for i in range(n_workers)
+        ]
+        parts = [future.result() for future in futures]
+
+    users: List[uuid.UUID] = []
+    row_users = []
+    for part in parts:
+        row_users.append(part.row_users + len(users))
+        users.extend(part.users)
+
+    order = np.concatenate([part.row_order for part in parts])
+    by_time = np.lexsort((order[:, 2], order[:, 1], order[:, 0]))
+    sampled = any(part.sample_keys is not None for part in parts)
+    matrix = TrainingMatrix(
+        X=np.concatenate([part.X for part in parts])[by_time],
+        y=np.concatenate([part.y for part in parts])[by_time],
+        row_users=np.concatenate(row_users).astype(np.int32)[by_time],
+        users=users,
+        watermark=until,
+        source_rows=total,
+        row_order=order[by_time],
+        sample_keys=np.concatenate([part.keys_or_nan() for part in parts])[by_time] if sampled else None,
+        source_likes=likes,
+    )
+    if sampling:
+        return resample_training_matrix(matrix, budget, heavy_user_alpha)
+    # Свайп, созданный на границе во время чтения, мог добавить строку — потолок после слияния
+    return _select_rows(matrix, slice(-max_rows, None)) if len(matrix.y) > max_rows else matrix
+
+
+TRAINING_CACHE_FILE = 'training_cache.npz'
+
+
+def training_cache_path(model_dir: str) -> str:
+    return os.path.join(model_dir, TRAINING_CACHE_FILE)
+
+
+def drop_training_cache(model_dir: str):
+    """Удаляет кэш матрицы: следующее инкрементальное обучение загрузит свайпы заново"""
+    try:
+        os.remove(training_cache_path(model_dir))
+    except FileNotFoundError:
+        pass
+
+
+def save_training_cache(path: str, matrix: TrainingMatrix, domain_classes: Sequence[str]):
+    """Сохраняет матрицу признаков для следующего инкрементального обучения"""
+
+    watermark_at, watermark_id = matrix.watermark or (None, None)
+    np.savez(
+        path,
+        X=matrix.X,
+        y=matrix.y,
+        row_users=matrix.row_users,
+        users=np.array([str(u) for u in matrix.users], dtype=str),
+        domain_classes=np.array(list(domain_classes), dtype=str),
+        watermark_at=np.array(watermark_at.isoformat() if watermark_at else ""),
+        watermark_id=np.array(str(watermark_id) if watermark_id else ""),
+        source_rows=np.array(matrix.source_rows),
+        source_likes=np.array(-1 if matrix.source_likes is None else matrix.source_likes),
+        sample_keys=matrix.keys_or_nan(),
+        row_order=matrix.row_order if matrix.row_order is not None else np.empty((0, ORDER_WIDTH), dtype=np.uint64),
+    )
+
+
+def load_training_cache(path: str) -> Optional[Tuple[TrainingMatrix, List[str]]]:
+    """Загружает сохранённую матрицу признаков и список доменов, для которого она собрана"""
+
+    try:
+        data = np.load(path, allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+
+    with data:
+        watermark = None
+        if str(data['watermark_at']):
+            watermark = (
+                datetime.fromisoformat(str(data['watermark_at'])),
+                uuid.UUID(str(data['watermark_id'])),
+            )
+        # Кэш без ключей порядка (старый формат) нельзя слить с дельтой изменений
+        row_order = data['row_order'] if 'row_order' in data else None
+        if row_order is not None and len(row_order) != len(data['y']):
+            row_order = None
+        matrix = TrainingMatrix(
+            X=data['X'],
+            y=data['y'],
+            row_users=data['row_users'],
+            users=[uuid.UUID(u) for u in data['users']],
+            watermark=watermark,
+            source_rows=int(data['source_rows']) if 'source_rows' in data else len(data['y']),
+            row_order=row_order,
+            sample_keys=data['sample_keys'] if 'sample_keys' in data else None,
+            source_likes=int(data['source_likes']) if 'source_likes' in data and int(data['source_likes']) >= 0 else None,
+        )
+        return matrix, [str(d) for d in data['domain_classes']]
+
+
+def load_delta_user_ids(db_session, since: Watermark, until: Optional[Watermark] = None) -> List[uuid.UUID]:
+    """Пользователи, у которых свайпы появились или изменились после водяного знака"""
+    return db_session.execute(
+        _swipe_bounds(select(Swipe.user_id), since, until).distinct()
+    ).scalars().all()
+
+
+def merge_training_delta(
+    cached: TrainingMatrix,
+    delta: TrainingMatrix,
+    max_rows: int,
+    delta_user_stats: Dict[uuid.UUID, UserStats],
+) -> TrainingMatrix:
+    """Вносит дельту изменений в кэшированную матрицу и обновляет агрегаты изменившихся пользователей.
+
+    Строки сопоставляются по ключу (created_at, id): строка дельты, уже лежащая
+    в кэше (повторный свайп, перенос компакцией), заменяется на месте со своим
+    ключом A-Res; свайп, созданный после водяного знака кэша, дописывается, и
+    матрица остаётся упорядоченной по времени. Изменение строки, которой в кэше
+    нет (вытеснена выборкой или потолком max_rows), только поправляет число
+    лайков потока: updated_at сдвигается лишь при смене значения свайпа.
+    Признаки пользователя (история, лайки, доля лайков) пересчитываются на месте
+    только для пользователей из дельты. Обеим матрицам нужны row_order.
+    """
+
+    if len(delta.y) == 0:
+        return cached._replace(watermark=delta.watermark or cached.watermark)
+
+    users = list(cached.users)
+    user_index = {u: i for i, u in enumerate(users)}
+    remap = np.empty(len(delta.users), dtype=np.int32)
+    for i, user_id in enumerate(delta.users):
+        code = user_index.get(user_id)
+        if code is None:
+            code = user_index[user_id] = len(users)
+            users.append(user_id)
+        remap[i] = code
+    delta_users = remap[delta.row_users]
+
+    # Строки дельты, уже лежащие в кэше
+    cached_keys = sortable_order_keys(cached.row_order)
+    delta_keys = sortable_order_keys(delta.row_order)
+    replaced = np.zeros(len(delta.y), dtype=bool)
+    positions = np.zeros(len(delta.y), dtype=np.int64)
+    if len(cached_keys):
+        sorter = np.argsort(cached_keys, kind='stable')
+        found = np.minimum(np.searchsorted(cached_keys, delta_keys, sorter=sorter), len(cached_keys) - 1)
+        positions = sorter[found]
+        replaced = cached_keys[positions] == delta_keys
+
+    # Новые свайпы: при вставке updated_at = created_at, поэтому (created_at, id) новее водяного знака
+    inserted = ~replaced
+    if cached.watermark is not None:
+        inserted &= delta_keys > _sortable_key(cached.watermark)
+    stale = ~replaced & ~inserted
+
+    rows = positions[replaced]
+    cached_counts = cached.source_class_counts()
+    likes = cached_counts[1] + int(delta.y[inserted].sum())
+    likes += int(delta.y[replaced].sum()) - int(cached.y[rows].sum())
+    likes += 2 * int(delta.y[stale].sum()) - int(stale.sum())  # лайк стал дизлайком или наоборот
+    source_rows = cached.source_rows + int(inserted.sum())
+
+    X = np.concatenate([cached.X, delta.X[inserted]])
+    y = np.concatenate([cached.y, delta.y[inserted]])
+    row_users = np.concatenate([cached.row_users, delta_users[inserted]])
+    row_order = np.concatenate([cached.row_order, delta.row_order[inserted]])
+    X[rows] = delta.X[replaced]
+    y[rows] = delta.y[replaced]
+    sample_keys = None
+    if cached.sample_keys is not None:
+        sample_keys = np.concatenate([cached.sample_keys, delta.keys_or_nan()[inserted]])
+
+    # Порядок по времени (created_at свайпов разных транзакций может опережать водяной знак)
+    by_time = np.argsort(sortable_order_keys(row_order), kind='stable')
+    # Потолок памяти: оставляем только последние max_rows строк
+    by_time = by_time[-max_rows:]
+    X, y, row_users, row_order = X[by_time], y[by_time], row_users[by_time], row_order[by_time]
+    if sample_keys is not None:
+        sample_keys = sample_keys[by_time]
+
+    # Таблицы новых агрегатов по коду пользователя и один векторный проход по строкам
+    # вместо маски row_users == code на каждого пользователя дельты
+    updated = np.zeros(len(users), dtype=bool)
+    totals = np.zeros(len(users), dtype=FEATURE_DTYPE)
+    user_likes = np.zeros(len(users), dtype=FEATURE_DTYPE)
+    for code in np.unique(remap):
+        stats = delta_user_stats.get(users[code])
+        if stats is not None:
+            updated[code] = True
+            totals[code], user_likes[code] = stats.total_swipes, stats.total_likes
+
+    changed = np.flatnonzero(updated[row_users])
+    row_totals, row_likes = totals[row_users[changed]], user_likes[row_users[changed]]
+    X[changed, 3] = row_totals
+    X[changed, 4] = row_likes
+    X[changed, 5] = np.divide(row_likes, row_totals, out=np.zeros(len(changed), dtype=FEATURE_DTYPE), where=row_totals > 0)
+
+    return TrainingMatrix(
+        X, y, row_users, users, delta.watermark or cached.watermark,
+        source_rows=source_rows,
+        row_order=row_order,
+        sample_keys=sample_keys,
+        source_likes=min(max(likes, 0), source_rows),
+    )
+
+
+def iter_training_chunks(
+    db_session,
+    domain_codes: Dict[str, int],
+    chunk_size: int,
+    user_stats: Optional[Dict[uuid.UUID, UserStats]] = None,
+    since: Optional[Watermark] = None,
+    until: Optional[Watermark] = None,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Отдаёт признаки пачками; буфер переиспользуется между пачками"""
+
+    if user_stats is None:
+        user_stats = load_user_stats(db_session)
+
+    X = np.empty((chunk_size, N_FEATURES), dtype=FEATURE_DTYPE)
+    y = np.empty(chunk_size, dtype=np.int8)
+
+    for rows in iter_swipe_row_chunks(db_session, chunk_size, since=since, until=until):
+        n = fill_feature_rows(rows, user_stats, domain_codes, X, y)
+        if n:
+            yield X[:n], y[:n]
+
+
+def iter_idea_text_chunks(db_session, chunk_size: int, limit: Optional[int] = None) -> Iterator[List[Tuple]]:
+    """Читает (id, domain, title, description, tags) последних идей пачками"""
+
+    stmt = select(Idea.id, Idea.domain, Idea.title, Idea.description, Idea.tags).order_by(
+        Idea.created_at.desc(), Idea.id.desc()
+    )
+    if limit:
+        stmt = stmt.limit(limit)
+
+    result = db_session.execute(stmt.execution_options(yield_per=chunk_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
@@ -0,0 +1,344 @@
+"""
+Индекс k ближайших пользователей вместо плотной матрицы users × users
+Вектор предпочтений пользователя: доли лайков по доменам, доля лайков и
+центроид контента лайкнутых идей. Индекс строится блоками с ограниченной
+памятью. Свайп обновляет только суммы пользователя, а соседство
+пересчитывается фоновым потоком пачкой по всем изменившимся пользователям;
+соседи пользователя читаются за O(k)
+"""
+
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import uuid
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sqlalchemy import select
+
+from ..config import get_settings
+from ..models import Idea, Swipe
+from .training_data import UserStats
+
+settings = get_settings()
+
+
+class UserNeighborIndex:
+    """Top-k соседей каждого пользователя по косинусному сходству векторов предпочтений.
+
+    Храним суммы (лайки по доменам, сумма контентных векторов лайков, счётчики),
+    из них собирается нормированный вектор; соседи — массивы (n_users × k).
+    Массивы растут удвоением ёмкости: строки после n_users — резерв.
+    """
+
+    def __init__(self, k: int = 20, content_dim: int = 64, block_mb: int = 64, refresh_seconds: float = 1.0):
+        self.k = k
+        self.content_dim = content_dim
+        self.block_mb = block_mb
+        self.refresh_seconds = refresh_seconds
+        self._hasher = HashingVectorizer(n_features=content_dim, alternate_sign=False, norm='l2')
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._reset([], [])
+
+    def _reset(self, user_ids: Sequence[uuid.UUID], domains: Sequence[str]):
+        n = len(user_ids)
+        self.user_ids: List[uuid.UUID] = list(user_ids)
+        self.positions: Dict[uuid.UUID, int] = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self.domain_positions: Dict[str, int] = {domain: i for i, domain in enumerate(domains)}
+        self.domain_likes = np.zeros((n, len(domains)), dtype=np.float32)
+        self.content_sums = np.zeros((n, self.content_dim), dtype=np.float32)
+        self.likes = np.zeros(n, dtype=np.float32)
+        self.swipes = np.zeros(n, dtype=np.float32)
+        self.vectors = np.zeros((n, self.dim), dtype=np.float32)
+        self.neighbors = np.full((n, self.k), -1, dtype=np.int32)
+        self.similarities = np.full((n, self.k), -np.inf, dtype=np.float32)
+        self._dirty: Set[int] = set()  # пользователи, чьё соседство ждёт пересчёта
+        self._generation = getattr(self, '_generation', 0) + 1  # номера строк меняются при build
+
+    @property
+    def dim(self) -> int:
+        return len(getattr(self, 'domain_positions', {})) + 1 + self.content_dim
+
+    @property
+    def n_users(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def built(self) -> bool:
+        """Индекс построен: дальше его ведут record_swipe и фоновый пересчёт"""
+        return bool(self.domain_positions)
+
+    # --- векторы -------------------------------------------------------------
+
+    def _content_vectors(self, titles: Sequence[str], tags: Sequence[Optional[Sequence[str]]]) -> np.ndarray:
+        texts = [f"{title} {' '.join(idea_tags or [])}" for title, idea_tags in zip(titles, tags)]
+        return self._hasher.transform(texts).toarray().astype(np.float32)
+
+    def _compose(self, rows: np.ndarray) -> np.ndarray:
+        """Нормированные векторы предпочтений для строк rows"""
+        likes = np.maximum(self.likes[rows], 1)[:, None]
+        affinity = self.domain_likes[rows] / likes
+        ratio = np.divide(self.likes[rows], self.swipes[rows], out=np.zeros(len(rows), dtype=np.float32),
+                          where=self.swipes[rows] > 0)[:, None]
+        centroid = self.content_sums[rows]
+        centroid = centroid / np.maximum(np.linalg.norm(centroid, axis=1, keepdims=True), 1e-12)
+
+        vectors = np.hstack([affinity, ratio, centroid]).astype(np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    # --- построение ----------------------------------------------------------
+
+    def build(
+        self,
+        db_session,
+        user_ids: Sequence[uuid.UUID],
+        user_stats: Dict[uuid.UUID, UserStats],
+        domains: Sequence[str],
+        chunk_size: int = 5000,
+    ):
+        """Собирает векторы потоково по лайкам и считает соседей блоками"""
+
+        with self._lock:
+            self._reset(user_ids, domains)
+            for i, user_id in enumerate(self.user_ids):
+                stats = user_stats.get(user_id)
+                if stats:
+                    self.swipes[i], self.likes[i] = stats.total_swipes, stats.total_likes
+
+            stmt = (
+                select(Swipe.user_id, Idea.domain, Idea.title, Idea.tags)
+                .join(Idea, Swipe.idea_id == Idea.id)
+                .where(Swipe.swipe.is_(True))
+            )
+            result = db_session.execute(stmt.execution_options(yield_per=chunk_size))
+            try:
+                for rows in result.partitions():
+                    rows = [row for row in rows if row[0] in self.positions]
+                    if not rows:
+                        continue
+                    positions = np.fromiter((self.positions[row[0]] for row in rows), dtype=np.int64, count=len(rows))
+                    domain_codes = np.fromiter(
+                        (self.domain_positions.get(row[1], -1) for row in rows), dtype=np.int64, count=len(rows)
+                    )
+                    known = domain_codes >= 0
+                    np.add.at(self.domain_likes, (positions[known], domain_codes[known]), 1)
+                    np.add.at(self.content_sums, positions,
+                              self._content_vectors([row[2] for row in rows], [row[3] for row in rows]))
+            finally:
+                result.close()
+
+            all_rows = np.arange(self.n_users)
+            self.vectors = self._compose(all_rows)
+            self._build_neighbors()
+
+    def _build_neighbors(self):
+        """Top-k по блокам строк: в памяти одновременно не больше block × n_users сходств"""
+
+        n = self.n_users
+        if n < 2:
+            return
+        k = min(self.k, n - 1)
+        block = self._block_rows()
+        vectors = self.vectors[:n]
+
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            similarity = vectors[start:stop] @ vectors.T
+            similarity[np.arange(stop - start), np.arange(start, stop)] = -np.inf  # не сосед сам себе
+            top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            top_sims = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_sims, axis=1)
+            self.neighbors[start:stop, :k] = np.take_along_axis(top, order, axis=1)
+            self.similarities[start:stop, :k] = np.take_along_axis(top_sims, order, axis=1)
+
+    def _block_rows(self) -> int:
+        return max(1, (self.block_mb * 2 ** 20) // (4 * max(self.n_users, 1)))
+
+    # --- обновление ----------------------------------------------------------
+
+    def _ensure_user(self, user_id: uuid.UUID) -> int:
+        position = self.positions.get(user_id)
+        if position is not None:
+            return position
+
+        position = self.n_users
+        if position == len(self.likes):
+            self._grow(max(2 * position, 16))
+        self.user_ids.append(user_id)
+        self.positions[user_id] = position
+        return position
+
+    def _grow(self, capacity: int):
+        """Удваивает ёмкость массивов: новый пользователь — амортизированно O(1) копирований"""
+
+        def grown(array: np.ndarray, fill) -> np.ndarray:
+            result = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            result[:len(array)] = array
+            return result
+
+        self.domain_likes = grown(self.domain_likes, 0)
+        self.content_sums = grown(self.content_sums, 0)
+        self.likes = grown(self.likes, 0)
+        self.swipes = grown(self.swipes, 0)
+        self.vectors = grown(self.vectors, 0)
+        self.neighbors = grown(self.neighbors, -1)
+        self.similarities = grown(self.similarities, -np.inf)
+
+    def record_swipe(self, user_id: uuid.UUID, idea: Idea, liked: bool, previous: Optional[bool] = None):
+        """Обновляет суммы пользователя за O(dim); соседство пересчитает фоновый поток"""
+
+        with self._lock:
+            if not self.domain_positions:
+                return  # индекс ещё не построен
+            u = self._ensure_user(user_id)
+
+            delta = int(liked) - int(bool(previous))
+            if previous is None:
+                self.swipes[u] += 1
+            if delta:
+                self.likes[u] += delta
+                content = self._content_vectors([idea.title], [idea.tags])[0]
+                self.content_sums[u] += delta * content
+                domain = self.domain_positions.get(idea.domain)
+                if domain is not None:
+                    self.domain_likes[u, domain] += delta
+            self._dirty.add(u)
+
+        self._start()
+        self._wake.set()
+
+    def forget_swipes(self, swipes: Iterable[Tuple[uuid.UUID, Any, bool]]):
+        """Вычитает удалённые свайпы (user_id, идея, лайк) — например, дубликатов после компакции"""
+
+        with self._lock:
+            for user_id, idea, liked in swipes:
+                u = self.positions.get(user_id)
+                if u is None:
+                    continue
+                self.swipes[u] -= 1
+                if liked:
+                    self.likes[u] -= 1
+                    self.content_sums[u] -= self._content_vectors([idea.title], [idea.tags])[0]
+                    domain = self.domain_positions.get(idea.domain)
+                    if domain is not None:
+                        self.domain_likes[u, domain] -= 1
+                self._dirty.add(u)
+            if not self._dirty:
+                return
+
+        self._start()
+        self._wake.set()
+
+    def refresh(self):
+        """Пересчитывает соседство изменившихся пользователей пачками по block_mb.
+
+        Блокировка берётся на каждый блок, чтобы свайпы не ждали всю пачку.
+        """
+
+        with self._lock:
+            dirty, self._dirty = np.array(sorted(self._dirty), dtype=np.int64), set()
+            if len(dirty) == 0:
+                return
+            self.vectors[dirty] = self._compose(dirty)
+            generation, block = self._generation, self._block_rows()
+
+        for start in range(0, len(dirty), block):
+            with self._lock:
+                if self._generation != generation:
+                    return  # индекс перестроен — соседи уже посчитаны заново
+                self._refresh_users(dirty[start:start + block])
+
+    def _refresh_users(self, users: np.ndarray):
+        """Соседи пользователей users заново; у остальных — слияние с users за один проход"""
+
+        n = self.n_users
+        if n < 2:
+            return
+        k = min(self.k, n - 1)
+        vectors = self.vectors[:n]
+        similarity = vectors[users] @ vectors.T  # (len(users), n)
+        similarity[np.arange(len(users)), users] = -np.inf
+
+        # Соседи самих пользователей
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(similarity, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        self.neighbors[users] = -1
+        self.similarities[users] = -np.inf
+        self.neighbors[users, :k] = np.take_along_axis(top, order, axis=1)
+        self.similarities[users, :k] = np.take_along_axis(top_sims, order, axis=1)
+
+        # У остальных: обновляем сходство там, где users уже соседи, и вставляем туда, где стали ближе k-го
+        others = np.ones(n, dtype=bool)
+        others[users] = False
+        contains = np.isin(self.neighbors[:n], users).any(axis=1)
+        enters = (similarity > self.similarities[:n, -1]).any(axis=0)
+        rows = np.flatnonzero((contains | enters) & others)
+        if len(rows) == 0:
+            return
+
+        stale = np.isin(self.neighbors[rows], users)
+        merged_neighbors = np.hstack([
+            np.where(stale, -1, self.neighbors[rows]),
+            np.broadcast_to(users, (len(rows), len(users))),
+        ])
+        merged_sims = np.hstack([np.where(stale, -np.inf, self.similarities[rows]), similarity[:, rows].T])
+        order = np.argsort(-merged_sims, axis=1, kind='stable')[:, :self.k]
+        sims = np.take_along_axis(merged_sims, order, axis=1)
+        self.neighbors[rows] = np.where(np.isfinite(sims), np.take_along_axis(merged_neighbors, order, axis=1), -1)
+        self.similarities[rows] = sims
+
+    # --- фоновый пересчёт ----------------------------------------------------
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="user-index", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait()
+            # Свайпы за refresh_seconds собираются в одну пачку
+            self._stopping.wait(self.refresh_seconds)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ Ошибка пересчёта соседей: {e}")
+
+    def stop(self, timeout: float = 10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    # --- чтение --------------------------------------------------------------
+
+    def neighbors_of(self, user_id: uuid.UUID) -> List[Tuple[uuid.UUID, float]]:
+        """Соседи пользователя по убыванию сходства — чтение одной строки, O(k)"""
+        with self._lock:
+            position = self.positions.get(user_id)
+            if position is None:
+                return []
+            return [
+                (self.user_ids[neighbor], float(similarity))
+                for neighbor, similarity in zip(self.neighbors[position], self.similarities[position])
+                if neighbor >= 0 and similarity > 0
+            ]
+
+
+# Глобальный индекс соседей (строится при обучении user-based модели)
+user_neighbor_index = UserNeighborIndex(
+    k=settings.ML_USER_INDEX_K,
+    content_dim=settings.ML_USER_INDEX_CONTENT_DIM,
+    block_mb=settings.ML_USER_INDEX_BLOCK_MB,
+    refresh_seconds=settings.ML_USER_INDEX_REFRESH_SECONDS,
+)
@@ -1,10 +1,10 @@
 import uuid
 
-from sqlalchemy import Boolean, Column, ForeignKey, JSON, String, Text, TIMESTAMP, UniqueConstraint, func
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, JSON, String, Text, TIMESTAMP, UniqueConstraint, func
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 
-from .database import Base
+from .base import Base
 
 
 class User(Base):
@@ -23,6 +23,10 @@ class User(Base):
 
 class Idea(Base):
     __tablename__ = "ideas"
+    __table_args__ = (
+        # Лента непросмотренных идей: keyset (created_at, id) внутри домена
+        Index("ix_ideas_domain_created_at_id", "domain", "created_at", "id"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     title = Column(String, unique=True, nullable=False)
@@ -40,6 +44,9 @@ class Swipe(Base):
     __tablename__ = "swipes"
     __table_args__ = (
         UniqueConstraint("user_id", "idea_id", name="unique_swipe_user_idea"),
+        Index("ix_swipes_created_at_id", "created_at", "id"),
+        Index("ix_swipes_updated_at_id", "updated_at", "id"),
+        Index("ix_swipes_idea_id", "idea_id"),
     )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -47,6 +54,8 @@ class Swipe(Base):
     idea_id = Column(UUID(as_uuid=True), ForeignKey("ideas.id", ondelete="CASCADE"), nullable=False)
     swipe = Column(Boolean, nullable=False)  # True = like, False = dislike
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    # Сдвигается при смене значения свайпа и переносе компакцией: водяной знак обучения
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
 
     user = relationship("User", back_populates="swipes")
     idea = relationship("Idea", back_populates="swipes")
@@ -55,7 +64,10 @@ class Swipe(Base):
 class IdeaView(Base):
     __tablename__ = "idea_views"
     __table_args__ = (
+        # (user_id, idea_id) уникален — этот же индекс обслуживает anti-join ленты
         UniqueConstraint("user_id", "idea_id", name="unique_view_user_idea"),
+        Index("ix_idea_views_idea_id", "idea_id"),
+        Index("ix_idea_views_viewed_at", "viewed_at"),  # догон множеств просмотренного
     )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -77,4 +89,31 @@ class MLModelMeta(Base):
     precision = Column(String)
     recall = Column(String)
     f1 = Column(String)
-    roc_auc = Column(String) 
\ No newline at end of file
+    roc_auc = Column(String)
+
+    # Реестр версий: id = "v<version>", водяной знак — последний учтённый свайп
+    version = Column(Integer, index=True)
+    training_mode = Column(String)  # "full" | "incremental"
+    training_rows = Column(Integer)
+    swipe_watermark_at = Column(TIMESTAMP(timezone=True))
+    swipe_watermark_id = Column(UUID(as_uuid=True))
+    details = Column(JSON) 
+
+class UserDomainCounter(Base):
+    """Счётчики пользователя по доменам идей; обновляются в той же транзакции, что и записи"""
+    __tablename__ = "user_domain_counters"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    domain = Column(String, primary_key=True)
+    views = Column(Integer, nullable=False, server_default="0")
+    swipes = Column(Integer, nullable=False, server_default="0")
+    likes = Column(Integer, nullable=False, server_default="0")
+    seen = Column(Integer, nullable=False, server_default="0")  # просмотренные идеи (idea_views), как и в ленте
+
+
+class DomainCounter(Base):
+    """Число идей в домене"""
+    __tablename__ = "domain_counters"
+
+    domain = Column(String, primary_key=True)
+    ideas = Column(Integer, nullable=False, server_default="0")
@@ -0,0 +1,159 @@
+"""
+Хэширование паролей в отдельном пуле процессов
+bcrypt занимает сотни миллисекунд CPU. В потоке запроса пачка логинов выедает пул
+потоков, и остальные эндпоинты ждут. Здесь хэширование и проверка идут в
+ProcessPoolExecutor на PASSWORD_POOL_WORKERS процессов, так что пропускная
+способность логинов растёт с числом ядер.
+
+Допуск ограничен: не больше PASSWORD_POOL_MAX_PENDING операций в работе и в
+очереди. Сверх этого — PasswordHasherBusy, роутер отвечает 503 с Retry-After.
+
+Стоимость — BCRYPT_ROUNDS. Хэш с другой стоимостью (или устаревшей схемой)
+пересчитывается при успешном логине (verify_and_update).
+
+Модуль импортируется дочерними процессами (spawn), поэтому не тянет за собой
+модели и подключение к БД.
+"""
+
+import asyncio
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import multiprocessing
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from .config import get_settings
+
+settings = get_settings()
+
+_BCRYPT_MAX_BYTES = 72
+
+_contexts: Dict[int, CryptContext] = {}
+
+
+def _context(rounds: int) -> CryptContext:
+    # bcrypt основной, argon2 — для хэшей, созданных до перехода
+    if rounds not in _contexts:
+        _contexts[rounds] = CryptContext(schemes=["bcrypt", "argon2"], deprecated="auto", bcrypt__rounds=rounds)
+    return _contexts[rounds]
+
+
+def _prepare(password: str) -> str:
+    # Пароли длиннее 72 байт bcrypt обрезает: сначала SHA-256, затем bcrypt
+    if len(password.encode('utf-8')) > _BCRYPT_MAX_BYTES:
+        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    return password
+
+
+def hash_password(password: str, rounds: int) -> str:
+    return _context(rounds).hash(_prepare(password))
+
+
+def verify_and_update(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    """(пароль верен, новый хэш или None, если текущий соответствует настройкам)"""
+    return _context(rounds).verify_and_update(_prepare(password), hashed_password)
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь хэширования заполнена (PASSWORD_POOL_MAX_PENDING)"""
+
+
+class PasswordHasher:
+    """Пул процессов для bcrypt с ограниченным допуском; без пула — в вызывающем потоке"""
+
+    def __init__(self, rounds: int = 12, enabled: bool = True, workers: int = 0, max_pending: int = 64):
+        self.rounds = rounds
+        self.enabled = enabled
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            print(f"🔐 Пул хэширования паролей: {self.workers} процессов, bcrypt rounds={self.rounds}")
+        return self._executor
+
+    def _release(self, future: Future):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise PasswordHasherBusy(f"Password hashing queue is full ({self.max_pending})")
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                # Процесс пула умер — пересоздаём пул один раз
+                print("⚠️ Пул хэширования паролей сломан, пересоздаём")
+                self._executor = None
+                future = self._get_executor().submit(fn, *args)
+            self._pending += 1
+        future.add_done_callback(self._release)
+        return future
+
+    # --- синхронный интерфейс (блокирует вызывающий поток) --------------------
+
+    def hash(self, password: str) -> str:
+        if not self.enabled:
+            return hash_password(password, self.rounds)
+        return self._submit(hash_password, password, self.rounds).result()
+
+    def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        if not self.enabled:
+            return verify_and_update(password, hashed_password, self.rounds)
+        return self._submit(verify_and_update, password, hashed_password, self.rounds).result()
+
+    # --- async-интерфейс (не занимает ни поток, ни event loop) ---------------
+
+    async def hash_async(self, password: str) -> str:
+        if not self.enabled:
+            return await asyncio.to_thread(hash_password, password, self.rounds)
+        return await asyncio.wrap_future(self._submit(hash_password, password, self.rounds))
+
+    async def verify_and_update_async(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        if not self.enabled:
+            return await asyncio.to_thread(verify_and_update, password, hashed_password, self.rounds)
+        return await asyncio.wrap_future(
+            self._submit(verify_and_update, password, hashed_password, self.rounds)
+        )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(
+    rounds=settings.BCRYPT_ROUNDS,
+    enabled=settings.PASSWORD_POOL_ENABLED,
+    workers=settings.PASSWORD_POOL_WORKERS,
+    max_pending=settings.PASSWORD_POOL_MAX_PENDING,
+)
@@ -1,13 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 
+from ..auth_cache import user_cache
 from ..schemas.auth import UserRegister, UserRead, UserDomainSelection, Token
-from ..crud.auth import create_user, authenticate_user, get_user_by_email
-from ..database import get_db
-from ..dependencies import create_access_token, get_current_user
+from ..crud.aio.auth import create_user, authenticate_user, get_user_by_email
+from ..database import get_async_db, get_db
+from ..dependencies import create_access_token, get_current_user, get_current_user_for_update
 from ..models import User
+from ..passwords import PasswordHasherBusy
+from ..tasks.idea_pool import idea_pool
 
 router = APIRouter()
 
@@ -35,27 +39,41 @@ AVAILABLE_DOMAINS = [
 ]
 
 
+def _password_pool_busy(e: PasswordHasherBusy) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": "1"}
+    )
+
+
 @router.post("/register", response_model=UserRead, status_code=status.HTTP_201_CREATED)
-def register(user_data: UserRegister, db: Session = Depends(get_db)):
+async def register(user_data: UserRegister, db: AsyncSession = Depends(get_async_db)):
     """Регистрация нового пользователя"""
     
     # Проверяем, не существует ли пользователь
-    if get_user_by_email(db, user_data.email):
+    if await get_user_by_email(db, user_data.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User with this email already exists"
         )
     
-    # Создаем пользователя
-    user = create_user(db, user_data)
+    # Создаем пользователя (bcrypt — в пуле процессов)
+    try:
+        user = await create_user(db, user_data)
+    except PasswordHasherBusy as e:
+        raise _password_pool_busy(e)
     return user
 
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     """Логин пользователя"""
     
-    user = authenticate_user(db, form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except PasswordHasherBusy as e:
+        raise _password_pool_busy(e)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -73,7 +91,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 @router.post("/domains", response_model=UserRead)
 def set_user_domains(
     domain_data: UserDomainSelection,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_for_update),
     db: Session = Depends(get_db)
 ):
     """Устанавливает интересующие пользователя домены (первичный онбординг)"""
@@ -110,6 +128,8 @@ def set_user_domains(
     current_user.onboarding_completed = True
     db.commit()
     db.refresh(current_user)
+    user_cache.invalidate(current_user.email)
+    idea_pool.request_refill()  # новые (в т.ч. кастомные) домены наполнит воркер пула
     
     return UserRead.model_validate(current_user)
 
@@ -175,7 +195,7 @@ def get_user_profile_domains(current_user: User = Depends(get_current_user)):
 @router.post("/profile/domains/add", response_model=UserRead)
 def add_user_domain(
     domain_data: dict,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_for_update),
     db: Session = Depends(get_db)
 ):
     """Добавление нового домена к профилю пользователя"""
@@ -237,6 +257,8 @@ def add_user_domain(
     current_user.selected_domains = current_domains + [domain_name]
     db.commit()
     db.refresh(current_user)
+    user_cache.invalidate(current_user.email)
+    idea_pool.request_refill()  # новые (в т.ч. кастомные) домены наполнит воркер пула
     
     return UserRead.model_validate(current_user)
 
@@ -244,7 +266,7 @@ def add_user_domain(
 @router.post("/profile/domains/custom", response_model=UserRead)
 def add_custom_domain(
     domain_data: dict,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_for_update),
     db: Session = Depends(get_db)
 ):
     """Создание и добавление кастомного домена"""
@@ -290,6 +312,8 @@ def add_custom_domain(
     current_user.selected_domains = current_domains + [custom_name]
     db.commit()
     db.refresh(current_user)
+    user_cache.invalidate(current_user.email)
+    idea_pool.request_refill()  # новые (в т.ч. кастомные) домены наполнит воркер пула
     
     return UserRead.model_validate(current_user)
 
@@ -297,7 +321,7 @@ def add_custom_domain(
 @router.delete("/profile/domains/remove", response_model=UserRead)
 def remove_user_domain(
     domain_data: dict,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_for_update),
     db: Session = Depends(get_db)
 ):
     """Удаление домена из профиля пользователя"""
@@ -341,5 +365,6 @@ def remove_user_domain(
     current_user.selected_domains = [d for d in current_domains if d != domain_name]
     db.commit()
     db.refresh(current_user)
+    user_cache.invalidate(current_user.email)
     
     return UserRead.model_validate(current_user) 
\ No newline at end of file
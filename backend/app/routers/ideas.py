@@ -1,15 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, status, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from collections import Counter
+from typing import List, Literal, Optional
 import uuid
 
-from ..schemas.idea import IdeaRead, GameSession, IdeaViewCreate, FinalIdeaRequest, FinalIdeaResponse
-from ..crud.idea import get_ideas_for_user, mark_idea_as_viewed, get_user_unseen_ideas
-from ..database import get_db
-from ..dependencies import get_current_user
+from ..schemas.idea import IdeaRead, GameSession, IdeaFeedPage, IdeaViewCreate, FinalIdeaRequest, FinalIdeaResponse
+from ..crud.aio.idea import get_user_unseen_ideas, mark_ideas_as_viewed
+from ..crud.counters import get_user_stats
+from ..crud.idea import get_ideas_for_user, get_unseen_feed
+from ..database import get_async_db, get_db, run_with_sync_session
+from ..dependencies import get_current_user, get_current_user_async
 from ..models import User
-# асинхронная постановка задачи без блокировки
-from ..tasks.idea_generator import run_sync_generation
+from ..config import get_settings
+from ..ml.advanced_recommender import advanced_recommender
+from ..ml.popularity import popularity_index
+from ..tasks.idea_generator import run_async_generation
+from ..tasks.idea_pool import idea_pool
+from ..tasks.write_behind import DURABLE_WAIT_SECONDS, WriteBehindFlushError, WriteBehindQueueFull, write_behind
+
+settings = get_settings()
 
 router = APIRouter()
 
@@ -17,8 +28,7 @@ router = APIRouter()
 @router.post("/generate-pool")
 async def generate_idea_pool(
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async)
 ):
     """Запускает генерацию пула идей для пользователя (после выбора доменов)"""
     
@@ -34,13 +44,14 @@ async def generate_idea_pool(
             detail="User must complete onboarding first"
         )
     
-    # Планируем генерацию: используем синхронную версию
-    background_tasks.add_task(
-        run_sync_generation,
-        db_session=db,
-        domains=current_user.selected_domains,
-        ideas_per_domain=10,
-    )
+    # Домены пользователя пополняет воркер пула; без него — генерация в фоне
+    # со своей сессией (сессия запроса закроется после ответа)
+    if not idea_pool.request_refill():
+        background_tasks.add_task(
+            run_async_generation,
+            domains=current_user.selected_domains,
+            ideas_per_domain=10,
+        )
     
     return {
         "status": "started",
@@ -50,13 +61,27 @@ async def generate_idea_pool(
     }
 
 
+def _enqueue_views(user_id: uuid.UUID, idea_ids: List[uuid.UUID]):
+    """Ставит просмотры в write-behind; в durable ждёт commit пачки (блокирующе — вызывать в потоке)"""
+    ticket = write_behind.submit_views(user_id, idea_ids)
+    if ticket is not None:
+        ticket.wait(DURABLE_WAIT_SECONDS)
+
+
 @router.get("/game-session", response_model=GameSession)
-def get_game_session(
+async def get_game_session(
+    background_tasks: BackgroundTasks,
     limit: int = 10,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    diversify: Optional[Literal["mmr", "quota"]] = None,
+    diversity_lambda: float = Query(0.7, ge=0, le=1),
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получает сессию игры - пачку идей для свайпов"""
+    """Получает сессию игры - пачку идей для свайпов.
+    
+    diversify=mmr|quota выбирает идеи из расширенного пула кандидатов так,
+    чтобы в сессии не доминировал один домен или почти одинаковые идеи.
+    """
     
     if not current_user.onboarding_completed:
         raise HTTPException(
@@ -65,19 +90,17 @@ def get_game_session(
         )
     
     # Получаем непросмотренные идеи из доменов пользователя
-    ideas = get_user_unseen_ideas(db, current_user.id, current_user.selected_domains, limit)
+    candidates = limit * settings.ML_DIVERSITY_CANDIDATES_FACTOR if diversify else limit
+    ideas = await get_user_unseen_ideas(db, current_user.id, current_user.selected_domains, candidates)
     
-    # Если идей мало, автоматически генерируем новые
+    # Если идей мало, просим пополнить пул — сессия отдаёт то, что есть, генерацию не ждёт
     if len(ideas) < limit // 2:  # Если меньше половины от запрошенного
-        # Запускаем генерацию в фоне
-        run_sync_generation(
-            db_session=db,
-            domains=current_user.selected_domains,
-            ideas_per_domain=5,  # Генерируем по 5 идей на домен
-        )
-        
-        # Пытаемся получить больше идей после генерации
-        ideas = get_user_unseen_ideas(db, current_user.id, current_user.selected_domains, limit)
+        if not idea_pool.request_refill():
+            background_tasks.add_task(
+                run_async_generation,
+                domains=current_user.selected_domains,
+                ideas_per_domain=5,  # Генерируем по 5 идей на домен
+            )
     
     if not ideas:
         return GameSession(
@@ -86,14 +109,74 @@ def get_game_session(
             total_available=0
         )
     
-    # Отмечаем идеи как просмотренные
-    for idea in ideas:
-        mark_idea_as_viewed(db, current_user.id, idea.id)
+    if diversify:
+        # Релевантность — скор модели, без модели — затухающая доля лайков.
+        # Модель, индекс и переранжирование — CPU-работа: в пуле потоков со своей синхронной сессией
+        # Устаревшая или несовместимая модель не должна ронять сессию — как в get_recommendations
+        try:
+            relevance = await run_with_sync_session(advanced_recommender.predict_batch, current_user, ideas)
+        except Exception as e:
+            print(f"❌ Ошибка предсказания: {e}")
+            relevance = None
+        if relevance is None:
+            await run_with_sync_session(popularity_index.ensure_loaded)
+            relevance = popularity_index.like_rates(idea.id for idea in ideas)
+        ideas = await run_in_threadpool(
+            advanced_recommender.diversify, ideas, relevance, limit, diversify, diversity_lambda
+        )
+    
+    session_ideas = [IdeaRead.model_validate(idea) for idea in ideas]
+    composition = dict(Counter(idea.domain for idea in session_ideas))
+    
+    # Отмечаем идеи как просмотренные — одним INSERT на всю сессию (или через write-behind)
+    idea_ids = [idea.id for idea in session_ideas]
+    if write_behind.enabled:
+        try:
+            await run_in_threadpool(_enqueue_views, current_user.id, idea_ids)
+        except (WriteBehindQueueFull, WriteBehindFlushError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e),
+                headers={"Retry-After": "1"}
+            )
+    else:
+        await mark_ideas_as_viewed(db, current_user.id, idea_ids)
     
     return GameSession(
-        ideas=[IdeaRead.model_validate(idea) for idea in ideas],
+        ideas=session_ideas,
         session_id=str(uuid.uuid4()),
-        total_available=len(ideas)
+        total_available=len(session_ideas),
+        composition=composition
+    )
+
+
+@router.get("/feed", response_model=IdeaFeedPage)
+def get_unseen_feed_page(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    balance_domains: bool = True,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Лента непросмотренных идей постранично (без отметки о просмотре).
+    
+    next_cursor из ответа передаётся в cursor следующего запроса.
+    """
+    
+    try:
+        page = get_unseen_feed(
+            db, current_user.id, current_user.selected_domains or [], limit,
+            cursor=cursor, balance_domains=balance_domains
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    return IdeaFeedPage(
+        ideas=[IdeaRead.model_validate(idea) for idea in page.ideas],
+        next_cursor=page.next_cursor
     )
 
 
@@ -123,9 +206,7 @@ def get_user_idea_stats(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Статистика идей для пользователя"""
-    
-    from ..models import Idea, IdeaView, Swipe
+    """Статистика идей для пользователя (поддерживаемые счётчики, без COUNT по таблицам)"""
     
     if not current_user.selected_domains:
         return {
@@ -136,34 +217,16 @@ def get_user_idea_stats(
             "remaining": 0
         }
     
-    # Общее количество идей в доменах пользователя
-    total_available = db.query(Idea).filter(
-        Idea.domain.in_(current_user.selected_domains)
-    ).count()
-    
-    # Просмотренные
-    viewed = db.query(IdeaView).filter(
-        IdeaView.user_id == current_user.id
-    ).count()
-    
-    # Свайпнутые
-    swiped = db.query(Swipe).filter(
-        Swipe.user_id == current_user.id
-    ).count()
-    
-    # Лайкнутые
-    liked = db.query(Swipe).filter(
-        Swipe.user_id == current_user.id,
-        Swipe.swipe == True
-    ).count()
-    
+    stats = get_user_stats(db, current_user.id, current_user.selected_domains)
+    total_available = stats["ideas_in_domains"]
+    viewed = stats["views"]
     remaining = max(0, total_available - viewed)
     
     return {
         "total_available": total_available,
         "viewed": viewed,
-        "swiped": swiped,
-        "liked": liked,
+        "swiped": stats["swipes"],
+        "liked": stats["likes"],
         "remaining": remaining,
         "domains": current_user.selected_domains
     } 
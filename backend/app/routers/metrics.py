@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends
+
+from ..auth_cache import auth_cache_stats
+from ..dependencies import get_current_user
+from ..models import User
+from ..passwords import password_hasher
+from ..sql_metrics import sql_metrics
+from ..tasks.idea_pool import idea_pool
+
+router = APIRouter()
+
+
+@router.get("/sql")
+def get_sql_metrics(
+    reset: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """SQL по эндпоинтам: число операторов, время в БД, самый медленный оператор и повторы (N+1).
+    
+    reset=true обнуляет сводку после чтения.
+    """
+    
+    snapshot = sql_metrics.snapshot()
+    if reset:
+        sql_metrics.reset()
+    return snapshot
+
+
+@router.get("/auth-cache")
+def get_auth_cache_metrics(current_user: User = Depends(get_current_user)):
+    """Кэш аутентификации: размер, попадания и доля попаданий для токенов и профилей"""
+    return auth_cache_stats()
+
+
+@router.get("/passwords")
+def get_password_pool_metrics(current_user: User = Depends(get_current_user)):
+    """Пул хэширования паролей: процессы, операции в работе, выполненные и отклонённые (503)"""
+    return password_hasher.stats()
+
+
+@router.get("/idea-pool")
+def get_idea_pool_metrics(current_user: User = Depends(get_current_user)):
+    """Пул идей: глубина по доменам на последней проверке, пополняемые домены и счётчики воркера"""
+    return idea_pool.stats()
@@ -1,51 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 
 from ..database import get_db
 from ..dependencies import get_current_user
-from ..models import User, Idea
+from ..models import User
 from ..ml.advanced_recommender import advanced_recommender
+from ..tasks.ml_scheduler import compute_drift_signals
+from ..tasks.ml_training import (
+    NotEnoughTrainingDataError,
+    TrainingInProgressError,
+    get_training_runs,
+    is_training_running,
+    run_training,
+)
 
 router = APIRouter()
 
 
 @router.post("/train")
 def train_models(
+    mode: Literal["full", "incremental"] = "full",
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Запускает обучение ML моделей"""
+    """Запускает обучение ML моделей.
+    
+    mode=incremental дочитывает только свайпы новее водяного знака последней версии в реестре.
+    При ML_EVAL_GATE_ENABLED ответ может иметь status="rejected": NDCG@k новой версии
+    на окне прошлой упал сильнее ML_EVAL_MAX_NDCG_DROP, версия не опубликована.
+    """
     
     try:
-        # Получаем все данные для обучения
-        ideas = db.query(Idea).all()
-        users = db.query(User).filter(User.onboarding_completed == True).all()
-        
-        if len(ideas) < 5:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Need at least 5 ideas to train models"
-            )
-        
-        if len(users) < 2:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Need at least 2 users to train models"
-            )
-        
-        # Обучаем все модели
-        advanced_recommender.train_content_based_model(ideas)
-        advanced_recommender.train_user_based_model(db, users)
-        advanced_recommender.train_ensemble_model(db)
-        
-        return {
-            "status": "success",
-            "message": "ML models trained successfully",
-            "ideas_count": len(ideas),
-            "users_count": len(users),
-            "metrics": advanced_recommender.get_training_metrics()
-        }
-        
+        return run_training(db, mode=mode, trigger="manual")
+    
+    except TrainingInProgressError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except NotEnoughTrainingDataError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -53,6 +52,44 @@ def train_models(
         )
 
 
+@router.get("/training-runs")
+def get_training_runs_log(current_user: User = Depends(get_current_user)):
+    """Журнал последних запусков обучения (ручных, по расписанию и по дрейфу)"""
+    
+    return {
+        "running": is_training_running(),
+        "runs": get_training_runs()
+    }
+
+
+@router.get("/drift")
+def get_drift_signals(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Текущие сигналы дрейфа относительно последней версии модели"""
+    
+    return compute_drift_signals(db)
+
+
+@router.get("/evaluate")
+def evaluate_current_model(
+    k: int = Query(10, ge=1, le=100),
+    test_fraction: float = Query(0.2, gt=0, lt=1),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Офлайн-метрики ранжирования (precision/recall/NDCG/coverage@k) на последних по времени свайпах"""
+    
+    evaluation = advanced_recommender.evaluate_ranking(db, k=k, test_fraction=test_fraction)
+    if evaluation is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No trained ensemble model or not enough swipes for evaluation"
+        )
+    return evaluation
+
+
 @router.get("/metrics")
 def get_model_metrics(current_user: User = Depends(get_current_user)):
     """Получает метрики обученных моделей"""
@@ -267,7 +304,7 @@ def get_model_info(current_user: User = Depends(get_current_user)):
         "user_model_trained": True,
         "ensemble_model_trained": True,
         "ideas_processed": len(advanced_recommender.ideas_df) if advanced_recommender.ideas_df is not None else 1250,
-        "users_processed": len(advanced_recommender.users_df) if advanced_recommender.users_df is not None else 45,
+        "users_processed": advanced_recommender.user_index.n_users or 45,
         "training_metrics_available": True,
         "models_status": {
             "logistic": {
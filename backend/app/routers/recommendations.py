@@ -1,25 +1,81 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Literal, Optional
 import uuid
 
-from ..schemas.idea import IdeaWithProbability
-from ..database import get_db
-from ..dependencies import get_current_user
+from ..config import get_settings
+from ..schemas.idea import IdeaExplainRequest, IdeaWithProbability
+from ..database import get_async_db, get_db, run_with_sync_session
+from ..dependencies import get_current_user, get_current_user_async
 from ..models import User, Idea
-from ..crud.idea import get_user_unseen_ideas, get_idea_by_id
+from ..crud.aio import counters as aio_counters, idea as aio_idea, swipe as aio_swipe
+from ..crud.idea import get_idea_by_id, get_ideas_by_ids, get_unseen_mask
 from ..ml.advanced_recommender import advanced_recommender
+from ..ml.popularity import popularity_index
+
+settings = get_settings()
 
 router = APIRouter()
 
 
+def _to_idea_with_probability(idea: Idea, probability: float, confidence: str) -> IdeaWithProbability:
+    return IdeaWithProbability(
+        id=idea.id,
+        title=idea.title,
+        description=idea.description,
+        tags=idea.tags,
+        domain=idea.domain,
+        generated_for_domains=idea.generated_for_domains,
+        created_at=idea.created_at,
+        probability=probability,
+        confidence=confidence
+    )
+
+
+async def _popular_recommendations(
+    db: AsyncSession,
+    user: User,
+    limit: int,
+    diversify: Optional[str] = None,
+    diversity_lambda: float = 0.7,
+) -> List[IdeaWithProbability]:
+    """Топ непросмотренных идей доменов пользователя по затухающей доле лайков"""
+    
+    def top_unseen(sync_db: Session):
+        popularity_index.ensure_loaded(sync_db)
+        return popularity_index.top_k(
+            user.selected_domains,
+            limit * settings.ML_DIVERSITY_CANDIDATES_FACTOR if diversify else limit,
+            unseen=lambda idea_ids: get_unseen_mask(sync_db, user.id, idea_ids)
+        )
+    
+    top = await run_with_sync_session(top_unseen)
+    ideas = await aio_idea.get_ideas_by_ids(db, [idea_id for idea_id, _ in top])
+    rates = dict(top)
+    if diversify:
+        ideas = await run_in_threadpool(
+            advanced_recommender.diversify,
+            ideas, [rates[idea.id] for idea in ideas], limit, diversify, diversity_lambda
+        )
+    
+    return [_to_idea_with_probability(idea, rates[idea.id], "low") for idea in ideas]
+
+
 @router.get("/", response_model=List[IdeaWithProbability])
-def get_personalized_recommendations(
+async def get_personalized_recommendations(
     limit: int = 10,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    diversify: Optional[Literal["mmr", "quota"]] = None,
+    diversity_lambda: float = Query(0.7, ge=0, le=1),
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получает персонализированные рекомендации на основе ML"""
+    """Получает персонализированные рекомендации на основе ML.
+    
+    diversify=mmr|quota переранжирует расширенный список кандидатов на разнообразие
+    (MMR по контентным векторам или квоты по доменам).
+    """
     
     if not current_user.onboarding_completed:
         raise HTTPException(
@@ -33,39 +89,135 @@ def get_personalized_recommendations(
             detail="No domains selected"
         )
     
+    # Cold-start (нет свайпов) и режим без модели: топ-k из индекса популярности
+    if advanced_recommender.ensemble_model is None or not await aio_swipe.has_user_swiped(db, current_user.id):
+        return await _popular_recommendations(db, current_user, limit, diversify, diversity_lambda)
+    
     # Получаем непросмотренные идеи
-    unseen_ideas = get_user_unseen_ideas(
+    candidates_factor = settings.ML_DIVERSITY_CANDIDATES_FACTOR if diversify else 3
+    unseen_ideas = await aio_idea.get_user_unseen_ideas(
         db, 
         current_user.id, 
         current_user.selected_domains,
-        limit=limit * 3  # Берем больше для лучшей фильтрации
+        limit=limit * candidates_factor  # Берем больше для лучшей фильтрации
     )
     
     if not unseen_ideas:
         return []
     
-    # Получаем рекомендации от ML модели
-    recommendations = advanced_recommender.get_recommendations(
-        db, current_user, unseen_ideas, top_k=limit
+    # Рекомендации ML модели: признаки и predict_proba — в пуле потоков, не в цикле событий
+    recommendations = await run_with_sync_session(
+        advanced_recommender.get_recommendations,
+        current_user, unseen_ideas, len(unseen_ideas) if diversify else limit
     )
     
+    if diversify:
+        by_id = {rec["idea"].id: rec for rec in recommendations}
+        chosen = await run_in_threadpool(
+            advanced_recommender.diversify,
+            [rec["idea"] for rec in recommendations],
+            [rec["probability"] for rec in recommendations],
+            limit, diversify, diversity_lambda,
+        )
+        recommendations = [by_id[idea.id] for idea in chosen]
+    
     # Формируем ответ
-    result = []
-    for rec in recommendations:
-        idea = rec["idea"]
-        result.append(IdeaWithProbability(
-            id=idea.id,
-            title=idea.title,
-            description=idea.description,
-            tags=idea.tags,
-            domain=idea.domain,
-            generated_for_domains=idea.generated_for_domains,
-            created_at=idea.created_at,
-            probability=rec["probability"],
-            confidence=rec["confidence"]
-        ))
-    
-    return result
+    return [
+        _to_idea_with_probability(rec["idea"], rec["probability"], rec["confidence"])
+        for rec in recommendations
+    ]
+
+
+@router.get("/popular")
+async def get_popular_ideas(
+    domain: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Самые популярные идеи домена (или доменов пользователя) и счётчики по доменам"""
+    
+    await run_with_sync_session(popularity_index.ensure_loaded)
+    domains = [domain] if domain else (current_user.selected_domains or [])
+    top = popularity_index.top_k(domains, limit)
+    ideas = await aio_idea.get_ideas_by_ids(db, [idea_id for idea_id, _ in top])
+    
+    return {
+        "ideas": [
+            {
+                "id": str(idea.id),
+                "title": idea.title,
+                "domain": idea.domain,
+                **popularity_index.idea_stats(idea.id),
+            }
+            for idea in ideas
+        ],
+        "domains": popularity_index.domain_stats()
+    }
+
+
+def _explanation_payload(explanation: dict) -> dict:
+    """Объяснение идеи для ответа API: вклады признаков по убыванию модуля"""
+    
+    idea = explanation["idea"]
+    factors = [
+        {
+            "feature": name,
+            "value": explanation["feature_values"][name],
+            "contribution": contribution,
+            "impact": "positive" if contribution > 0 else "negative" if contribution < 0 else "neutral",
+        }
+        for name, contribution in sorted(
+            explanation["contributions"].items(), key=lambda item: abs(item[1]), reverse=True
+        )
+    ]
+    probability = explanation["probability"]
+    
+    return {
+        "idea_id": str(idea.id),
+        "idea_title": idea.title,
+        "probability": probability,
+        "confidence": explanation["confidence"],
+        "output": explanation["output"],
+        "base_value": explanation["base_value"],
+        "output_space": explanation["output_space"],
+        "explanation_factors": factors,
+        "recommendation_strength": "high" if probability > 0.7 else "medium" if probability > 0.4 else "low"
+    }
+
+
+def _explain_ideas(db: Session, current_user: User, ideas: List[Idea]) -> List[dict]:
+    explanations = advanced_recommender.explain_recommendations(db, current_user, ideas)
+    if explanations is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Ensemble model is not trained yet"
+        )
+    return [_explanation_payload(explanation) for explanation in explanations]
+
+
+@router.post("/explain")
+def explain_recommendations_batch(
+    request: IdeaExplainRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Объясняет скоры сразу для набора идей (например, всей игровой сессии).
+    
+    Вклады признаков точные: base_value + сумма вкладов = output модели.
+    """
+    
+    ideas = get_ideas_by_ids(db, request.idea_ids)
+    if not ideas:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ideas not found"
+        )
+    
+    return {
+        "explanations": _explain_ideas(db, current_user, ideas),
+        "feature_importance": advanced_recommender.get_feature_importance()
+    }
 
 
 @router.get("/explain/{idea_id}")
@@ -83,52 +235,36 @@ def explain_recommendation(
             detail="Idea not found"
         )
     
-    # Получаем предсказание
-    prediction = advanced_recommender.predict_user_preference(db, current_user, idea)
-    
-    # Получаем важность признаков
-    feature_importance = advanced_recommender.get_feature_importance()
-    
-    # Анализируем факторы
-    factors = []
-    
-    # Домен соответствие
-    if idea.domain in (current_user.selected_domains or []):
-        factors.append({
-            "factor": "Domain Match",
-            "impact": "positive",
-            "description": f"This idea is in '{idea.domain}', which you selected as an interest"
-        })
-    else:
-        factors.append({
-            "factor": "Domain Mismatch", 
-            "impact": "negative",
-            "description": f"This idea is in '{idea.domain}', which is not in your selected domains"
-        })
-    
-    # Количество тегов
-    if len(idea.tags) >= 3:
-        factors.append({
-            "factor": "Rich Tags",
-            "impact": "positive", 
-            "description": f"This idea has {len(idea.tags)} tags, providing good categorization"
-        })
-    
-    # Длина описания
-    if len(idea.description) > 100:
-        factors.append({
-            "factor": "Detailed Description",
-            "impact": "positive",
-            "description": "This idea has a comprehensive description"
-        })
+    explanation = _explain_ideas(db, current_user, [idea])[0]
+    explanation["feature_importance"] = advanced_recommender.get_feature_importance()
+    return explanation
+
+
+@router.get("/similar-users")
+def get_similar_users_likes(
+    limit: int = Query(10, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Идеи, которые лайкнули похожие на пользователя люди (k ближайших соседей)"""
+    
+    candidates = advanced_recommender.neighbor_recommendations(db, current_user, limit)
+    ideas = get_ideas_by_ids(db, [idea_id for idea_id, _ in candidates])
+    scores = dict(candidates)
     
     return {
-        "idea_id": str(idea_id),
-        "idea_title": idea.title,
-        "prediction": prediction,
-        "feature_importance": feature_importance,
-        "explanation_factors": factors,
-        "recommendation_strength": "high" if prediction["probability"] > 0.7 else "medium" if prediction["probability"] > 0.4 else "low"
+        "neighbors": len(advanced_recommender.user_index.neighbors_of(current_user.id)),
+        "ideas": [
+            {
+                "id": str(idea.id),
+                "title": idea.title,
+                "description": idea.description,
+                "tags": idea.tags,
+                "domain": idea.domain,
+                "score": scores[idea.id]
+            }
+            for idea in ideas
+        ]
     }
 
 
@@ -189,26 +325,21 @@ def get_similar_ideas(
 
 
 @router.get("/stats")
-def get_recommendation_stats(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def get_recommendation_stats(
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Статистика рекомендательной системы для пользователя"""
     
-    # Общее количество идей в доменах пользователя
-    total_ideas = db.query(Idea).filter(
-        Idea.domain.in_(current_user.selected_domains or [])
-    ).count()
-    
-    # Непросмотренные идеи
-    unseen_ideas_count = len(get_user_unseen_ideas(
-        db, current_user.id, current_user.selected_domains or [], limit=1000
-    ))
+    # Идеи в доменах пользователя и сколько из них он уже видел — из счётчиков
+    stats = await aio_counters.get_user_stats(db, current_user.id, current_user.selected_domains or [])
+    total_ideas = stats["ideas_in_domains"]
+    unseen_ideas_count = max(0, total_ideas - stats["seen_in_domains"])
     
     # Статус ML модели
     model_status = {
         "content_model": advanced_recommender.content_similarity_matrix is not None,
-        "user_model": advanced_recommender.user_similarity_matrix is not None,
+        "user_model": advanced_recommender.user_index.n_users > 0,
         "ensemble_model": advanced_recommender.ensemble_model is not None
     }
     
@@ -1,60 +1,141 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Response, status, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from ..schemas.swipe import SwipeCreate, SwipeRead, SwipeWithIdea
-from ..crud.swipe import create_swipe, get_user_swipes
-from ..crud.idea import get_idea_by_id, get_user_unseen_ideas
-from ..database import get_db
-from ..dependencies import get_current_user
+from ..schemas.swipe import SwipeBatchCreate, SwipeBatchResult, SwipeCreate, SwipeRead, SwipeWithIdea
+from ..crud.aio.counters import get_user_stats
+from ..crud.aio.idea import count_user_unseen_ideas, get_idea_by_id
+from ..crud.aio.swipe import upsert_swipes
+from ..crud.swipe import SwipeWrite, get_user_swipes
+from ..database import get_async_db, get_db
+from ..dependencies import get_current_user, get_current_user_async
 from ..models import User
-from ..tasks.idea_generator import run_sync_generation
+from ..tasks.idea_generator import run_async_generation
+from ..tasks.idea_pool import idea_pool
+from ..tasks.write_behind import DURABLE_WAIT_SECONDS, WriteBehindFlushError, WriteBehindQueueFull, write_behind
 
 router = APIRouter()
 
 
+async def _schedule_generation_if_low(background_tasks: BackgroundTasks, db: AsyncSession, user: User):
+    """Если непросмотренных идей осталось мало, генерируем новые в фоне.
+    
+    С запущенным пулом идей (tasks/idea_pool.py) глубину по доменам отслеживает
+    его воркер: свайп не делает ни запроса, ни генерации.
+    """
+    
+    if idea_pool.running:
+        return
+    
+    domains = user.selected_domains or []
+    if await count_user_unseen_ideas(db, user.id, domains, limit=5) < 5:
+        background_tasks.add_task(
+            run_async_generation,
+            domains=domains,
+            ideas_per_domain=3,  # Генерируем по 3 идеи на домен
+        )
+
+
+def _enqueue_swipes(user: User, swipes: List[SwipeCreate]) -> Optional[dict]:
+    """Ставит свайпы в write-behind; в durable ждёт commit пачки (блокирующе — вызывать в потоке)"""
+    ticket = write_behind.submit_swipes(user.id, [(swipe.idea_id, swipe.swipe) for swipe in swipes])
+    return None if ticket is None else ticket.wait(DURABLE_WAIT_SECONDS)
+
+
+async def _write_swipes(db: AsyncSession, user: User, swipes: List[SwipeCreate]) -> Optional[List[SwipeWrite]]:
+    """Пишет свайпы сразу или через write-behind. None — приняты в очередь (режим async)"""
+    
+    if not write_behind.enabled:
+        return await upsert_swipes(db, user.id, swipes)
+    
+    try:
+        # Ожидание места в очереди и commit пачки — в пуле потоков, не в event loop
+        result = await run_in_threadpool(_enqueue_swipes, user, swipes)
+    except (WriteBehindQueueFull, WriteBehindFlushError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
+    if result is None:
+        return None
+    
+    idea_ids = dict.fromkeys(swipe.idea_id for swipe in swipes)
+    return [result[(user.id, idea_id)] for idea_id in idea_ids if result.get((user.id, idea_id))]
+
+
+def _queued_swipe(user: User, swipe: SwipeCreate) -> SwipeRead:
+    return SwipeRead(id=None, user_id=user.id, idea_id=swipe.idea_id, swipe=swipe.swipe)
+
+
 @router.post("/", response_model=SwipeRead, status_code=status.HTTP_201_CREATED)
-def create_user_swipe(
+async def create_user_swipe(
     swipe_data: SwipeCreate,
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Создает свайп пользователя (лайк/дизлайк идеи)"""
+    """Создает свайп пользователя (лайк/дизлайк идеи) — один upsert-запрос.
     
-    # Проверяем, существует ли идея
-    idea = get_idea_by_id(db, swipe_data.idea_id)
-    if not idea:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Idea not found"
-        )
+    В режиме write-behind async отвечает 202 сразу после постановки в очередь.
+    """
+    
+    writes = await _write_swipes(db, current_user, [swipe_data])
+    if writes is None:
+        await _schedule_generation_if_low(background_tasks, db, current_user)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return _queued_swipe(current_user, swipe_data)
     
-    # Проверяем, что идея из доменов пользователя
-    if current_user.selected_domains and idea.domain not in current_user.selected_domains:
+    if not writes:
+        # Свайп не записан: разбираемся, почему (только на пути ошибки)
+        idea = await get_idea_by_id(db, swipe_data.idea_id)
+        if not idea:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Idea not found"
+            )
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You can only swipe ideas from your selected domains"
         )
     
-    # Создаем свайп
-    swipe = create_swipe(db, current_user.id, swipe_data)
+    await _schedule_generation_if_low(background_tasks, db, current_user)
+    return SwipeRead.model_validate(writes[0])
+
+
+@router.post("/batch", response_model=SwipeBatchResult)
+async def create_user_swipes_batch(
+    batch: SwipeBatchCreate,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Записывает накопленную колоду свайпов одним запросом и одной транзакцией.
     
-    # Проверяем, нужно ли генерировать новые идеи
-    remaining_ideas = get_user_unseen_ideas(
-        db, current_user.id, current_user.selected_domains or [], limit=10
-    )
+    Повторные свайпы одной идеи — побеждает последний. Идеи, которых нет или
+    которые не из доменов пользователя, возвращаются в rejected.
+    В режиме write-behind async — 202 и пустой rejected: проверка произойдёт при сбросе.
+    """
     
-    # Если осталось мало идей, генерируем новые в фоне
-    if len(remaining_ideas) < 5:
-        background_tasks.add_task(
-            run_sync_generation,
-            db_session=db,
-            domains=current_user.selected_domains or [],
-            ideas_per_domain=3,  # Генерируем по 3 идеи на домен
-        )
+    swipes = await _write_swipes(db, current_user, batch.swipes)
+    if swipes is None:
+        await _schedule_generation_if_low(background_tasks, db, current_user)
+        response.status_code = status.HTTP_202_ACCEPTED
+        latest = {swipe.idea_id: swipe for swipe in batch.swipes}
+        return SwipeBatchResult(swipes=[_queued_swipe(current_user, swipe) for swipe in latest.values()], rejected=[])
     
-    return SwipeRead.model_validate(swipe)
+    written = {swipe.idea_id for swipe in swipes}
+    rejected = [idea_id for idea_id in dict.fromkeys(s.idea_id for s in batch.swipes) if idea_id not in written]
+    
+    await _schedule_generation_if_low(background_tasks, db, current_user)
+    return SwipeBatchResult(
+        swipes=[SwipeRead.model_validate(swipe) for swipe in swipes],
+        rejected=rejected
+    )
 
 
 @router.get("/", response_model=List[SwipeWithIdea])
@@ -79,20 +160,15 @@ def get_my_swipes(
 
 
 @router.get("/stats")
-def get_swipe_stats(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def get_swipe_stats(
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Статистика свайпов пользователя"""
     
-    from ..models import Swipe
-    
-    total_swipes = db.query(Swipe).filter(Swipe.user_id == current_user.id).count()
-    
-    likes = db.query(Swipe).filter(
-        Swipe.user_id == current_user.id,
-        Swipe.swipe == True
-    ).count()
+    stats = await get_user_stats(db, current_user.id, current_user.selected_domains or [])
+    total_swipes = stats["swipes"]
+    likes = stats["likes"]
     
     dislikes = total_swipes - likes
     like_ratio = (likes / total_swipes * 100) if total_swipes > 0 else 0
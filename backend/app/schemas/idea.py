@@ -1,6 +1,6 @@
 from uuid import UUID
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
 from datetime import datetime
 
 
@@ -28,6 +28,16 @@ class IdeaWithProbability(IdeaRead):
     confidence: str  # "high", "medium", "low"
 
 
+class IdeaExplainRequest(BaseModel):
+    idea_ids: List[UUID] = Field(..., min_length=1, max_length=100)
+
+
+class IdeaFeedPage(BaseModel):
+    """Страница ленты непросмотренных идей; next_cursor=None — лента закончилась"""
+    ideas: List[IdeaRead]
+    next_cursor: Optional[str] = None
+
+
 class FinalIdeaRequest(BaseModel):
     top_ideas: List[IdeaRead]
     questionnaire: dict
@@ -51,4 +61,5 @@ class GameSession(BaseModel):
     """Сессия игры со свайпами - пачка идей для показа пользователю"""
     ideas: List[IdeaRead]
     session_id: str
-    total_available: int 
\ No newline at end of file
+    total_available: int
+    composition: Dict[str, int] = {}  # домен → число идей в сессии
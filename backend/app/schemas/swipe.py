@@ -1,5 +1,6 @@
 from uuid import UUID
-from pydantic import BaseModel
+from typing import List, Optional
+from pydantic import BaseModel, Field
 
 
 class SwipeCreate(BaseModel):
@@ -8,7 +9,7 @@ class SwipeCreate(BaseModel):
 
 
 class SwipeRead(BaseModel):
-    id: UUID
+    id: Optional[UUID] = None  # None — свайп принят в write-behind очередь и ещё не записан
     user_id: UUID
     idea_id: UUID
     swipe: bool
@@ -19,4 +20,14 @@ class SwipeRead(BaseModel):
 class SwipeWithIdea(SwipeRead):
     """Свайп с информацией об идее"""
     idea_title: str
-    idea_tags: list[str] 
\ No newline at end of file
+    idea_tags: list[str]
+
+
+class SwipeBatchCreate(BaseModel):
+    """Накопленная на клиенте колода свайпов — записывается одной транзакцией"""
+    swipes: List[SwipeCreate] = Field(..., min_length=1, max_length=200)
+
+
+class SwipeBatchResult(BaseModel):
+    swipes: List[SwipeRead]
+    rejected: List[UUID]  # идеи, которых нет или которые не из доменов пользователя
@@ -0,0 +1,206 @@
+"""
+Инструментирование SQL по HTTP-запросам
+События SQLAlchemy (before/after_cursor_execute) на синхронном и async-движке
+пишут в RequestQueries текущего запроса (contextvar): число операторов, время
+в БД и самый медленный оператор. Middleware отдаёт это в заголовке Server-Timing
+и копит сводку по эндпоинтам для GET /api/metrics/sql.
+
+Если один и тот же оператор (с точностью до параметров) выполняется за запрос
+больше SQL_N_PLUS_ONE_THRESHOLD раз — печатается предупреждение о вероятном N+1.
+"""
+
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import event
+
+from .config import get_settings
+
+settings = get_settings()
+
+_STATEMENT_PREVIEW = 300  # символов оператора в сводке и предупреждениях
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|\$\d+|%s")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def statement_shape(statement: str) -> str:
+    """Оператор без параметров: IN-списки разной длины дают одну и ту же форму"""
+    shape = _PLACEHOLDER.sub("?", statement)
+    shape = _PLACEHOLDER_LIST.sub("?", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+def _preview(statement: str) -> str:
+    return _SPACES.sub(" ", statement).strip()[:_STATEMENT_PREVIEW]
+
+
+@dataclass
+class RequestQueries:
+    """SQL одного HTTP-запроса"""
+    endpoint: str
+    count: int = 0
+    db_ms: float = 0.0
+    slowest_ms: float = 0.0
+    slowest_statement: str = ""
+    shapes: Counter = field(default_factory=Counter)
+
+    def record(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.db_ms += elapsed_ms
+        if elapsed_ms > self.slowest_ms:
+            self.slowest_ms, self.slowest_statement = elapsed_ms, statement
+
+        shape = statement_shape(statement)
+        self.shapes[shape] += 1
+        if self.shapes[shape] == settings.SQL_N_PLUS_ONE_THRESHOLD + 1:
+            print(f"⚠️ Вероятный N+1 в {self.endpoint}: оператор выполнен больше "
+                  f"{settings.SQL_N_PLUS_ONE_THRESHOLD} раз за запрос: {_preview(shape)}")
+
+    def repeated(self) -> Dict[str, int]:
+        """Формы операторов, превысившие порог N+1"""
+        return {shape: n for shape, n in self.shapes.items() if n > settings.SQL_N_PLUS_ONE_THRESHOLD}
+
+    def server_timing(self, total_ms: float) -> str:
+        return (
+            f'db;dur={self.db_ms:.2f};desc="{self.count} queries", '
+            f"db-slowest;dur={self.slowest_ms:.2f}, "
+            f"app;dur={total_ms:.2f}"
+        )
+
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("sql_request_queries", default=None)
+
+
+def current_queries() -> Optional[RequestQueries]:
+    return _current.get()
+
+
+# --- события движков -----------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("sql_metrics_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = _current.get()
+    starts = conn.info.get("sql_metrics_start")
+    if queries is None or not starts:
+        return
+    queries.record(statement, (time.perf_counter() - starts.pop()) * 1000)
+
+
+def _handle_error(exception_context):
+    # Оператор упал — after_cursor_execute не будет, снимаем его отметку времени
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("sql_metrics_start"):
+        conn.info["sql_metrics_start"].pop()
+
+
+def instrument_engine(engine):
+    """Подписывает движок (для async — async_engine.sync_engine) на события; повторно не подписывает"""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# --- сводка по эндпоинтам ------------------------------------------------------
+
+class SqlMetrics:
+    """Накопленная статистика SQL по эндпоинтам (метод + шаблон пути)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, Dict] = {}
+
+    def observe(self, queries: RequestQueries, total_ms: float):
+        repeated = queries.repeated()
+        with self._lock:
+            stats = self._endpoints.setdefault(queries.endpoint, {
+                "requests": 0,
+                "queries": 0,
+                "max_queries": 0,
+                "db_ms": 0.0,
+                "total_ms": 0.0,
+                "slowest_ms": 0.0,
+                "slowest_statement": "",
+                "n_plus_one_requests": 0,
+                "repeated_statements": {},
+            })
+            stats["requests"] += 1
+            stats["queries"] += queries.count
+            stats["max_queries"] = max(stats["max_queries"], queries.count)
+            stats["db_ms"] += queries.db_ms
+            stats["total_ms"] += total_ms
+            if queries.slowest_ms > stats["slowest_ms"]:
+                stats["slowest_ms"] = queries.slowest_ms
+                stats["slowest_statement"] = _preview(queries.slowest_statement)
+            if repeated:
+                stats["n_plus_one_requests"] += 1
+                for shape, n in repeated.items():
+                    key = _preview(shape)
+                    stats["repeated_statements"][key] = max(stats["repeated_statements"].get(key, 0), n)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    **stats,
+                    "avg_queries": round(stats["queries"] / stats["requests"], 2),
+                    "avg_db_ms": round(stats["db_ms"] / stats["requests"], 2),
+                    "avg_total_ms": round(stats["total_ms"] / stats["requests"], 2),
+                    "db_ms": round(stats["db_ms"], 2),
+                    "total_ms": round(stats["total_ms"], 2),
+                    "slowest_ms": round(stats["slowest_ms"], 2),
+                    "repeated_statements": dict(stats["repeated_statements"]),
+                }
+                for endpoint, stats in self._endpoints.items()
+            }
+        return {"n_plus_one_threshold": settings.SQL_N_PLUS_ONE_THRESHOLD, "endpoints": endpoints}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+sql_metrics = SqlMetrics()
+
+
+def _endpoint_name(request) -> str:
+    """Метод и шаблон пути (/api/ideas/{idea_id}); запросы мимо маршрутов — в одну строку"""
+    if request.scope.get("route") is None:
+        return f"{request.method} <unmatched>"
+    # route.path у вложенных роутеров без префикса — восстанавливаем шаблон по сегментам пути
+    names = {str(value): "{" + name + "}" for name, value in request.scope.get("path_params", {}).items()}
+    path = "/".join(names.get(segment, segment) for segment in request.url.path.split("/"))
+    return f"{request.method} {path}"
+
+
+async def track_sql(request, call_next):
+    """HTTP-middleware: SQL запроса — в Server-Timing и в сводку sql_metrics"""
+
+    queries = RequestQueries(endpoint=f"{request.method} {request.url.path}")
+    token = _current.set(queries)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+
+    total_ms = (time.perf_counter() - started) * 1000
+    # Шаблон пути известен только после маршрутизации
+    queries.endpoint = _endpoint_name(request)
+    response.headers["Server-Timing"] = queries.server_timing(total_ms)
+    sql_metrics.observe(queries, total_ms)
+    return response
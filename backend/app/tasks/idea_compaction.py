@@ -0,0 +1,145 @@
+"""
+Компакция каталога: слияние кластеров почти-дубликатов идей
+Кластеры — компоненты связности пар с оценкой Jaccard >= IDEA_NEAR_DUP_THRESHOLD
+(индекс MinHash LSH). В кластере остаётся идея с наибольшим числом свайпов (при
+равенстве — самая старая); свайпы и просмотры дубликатов переносятся на неё,
+если у пользователя ещё нет своего, после чего дубликаты удаляются. In-memory
+индексы (почти-дубликаты, просмотренное, соседи, популярность) и их снимки
+обновляются после commit
+"""
+
+from collections import defaultdict
+from typing import Dict, List
+import uuid
+
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+
+from ..config import get_settings
+from ..crud.counters import recount_counters
+from ..ml.near_duplicates import near_duplicate_index
+from ..ml.popularity import popularity_index
+from ..ml.seen_sets import seen_sets
+from ..ml.training_data import drop_training_cache
+from ..ml.user_index import user_neighbor_index
+from ..models import Idea, Swipe
+
+settings = get_settings()
+
+# Перенос строк дубликатов на оставляемую идею: по одной строке на (пользователь, идея),
+# и только если у пользователя нет своей строки для оставляемой идеи
+_REASSIGN_SQL = """
+    WITH mapping AS (
+        SELECT * FROM unnest(:dup_ids, :keep_ids) AS m(dup_id, keep_id)
+    ),
+    movable AS (
+        SELECT DISTINCT ON (t.user_id, m.keep_id) t.id, m.keep_id
+        FROM {table} t
+        JOIN mapping m ON m.dup_id = t.idea_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {table} k WHERE k.user_id = t.user_id AND k.idea_id = m.keep_id
+        )
+        ORDER BY t.user_id, m.keep_id, t.{ordered_by} DESC
+    )
+    UPDATE {table} t SET idea_id = movable.keep_id{touch}
+    FROM movable
+    WHERE t.id = movable.id
+    RETURNING t.user_id, t.idea_id
+"""
+
+_MAPPING_PARAMS = (
+    bindparam("dup_ids", type_=ARRAY(UUID(as_uuid=True))),
+    bindparam("keep_ids", type_=ARRAY(UUID(as_uuid=True))),
+)
+# Перенесённый свайп сдвигает updated_at — инкрементальное обучение и сигналы дрейфа его увидят
+_REASSIGN_SWIPES = text(
+    _REASSIGN_SQL.format(table="swipes", ordered_by="created_at", touch=", updated_at = now()")
+).bindparams(*_MAPPING_PARAMS)
+_REASSIGN_VIEWS = text(
+    _REASSIGN_SQL.format(table="idea_views", ordered_by="viewed_at", touch="")
+).bindparams(*_MAPPING_PARAMS)
+
+
+def find_duplicate_clusters(db_session, rebuild: bool = True) -> List[List[uuid.UUID]]:
+    """Кластеры почти-дубликатов каталога; каждый отсортирован — первой идёт оставляемая идея"""
+
+    if rebuild:
+        near_duplicate_index.build(db_session)
+    else:
+        near_duplicate_index.ensure_loaded(db_session)
+    clusters = near_duplicate_index.clusters()
+    if not clusters:
+        return []
+
+    idea_ids = [idea_id for cluster in clusters for idea_id in cluster]
+    swipes = dict(db_session.execute(
+        select(Swipe.idea_id, func.count(Swipe.id)).where(Swipe.idea_id.in_(idea_ids)).group_by(Swipe.idea_id)
+    ).all())
+    created = dict(db_session.execute(select(Idea.id, Idea.created_at).where(Idea.id.in_(idea_ids))).all())
+
+    ranked = []
+    for cluster in clusters:
+        existing = [idea_id for idea_id in cluster if idea_id in created]
+        if len(existing) > 1:
+            ranked.append(sorted(existing, key=lambda idea_id: (-swipes.get(idea_id, 0), created[idea_id])))
+    return ranked
+
+
+def compact_duplicate_ideas(db_session, apply: bool = False, rebuild: bool = True) -> Dict:
+    """Находит кластеры и (с apply) сливает их одной транзакцией"""
+
+    clusters = find_duplicate_clusters(db_session, rebuild=rebuild)
+    mapping = {dup_id: cluster[0] for cluster in clusters for dup_id in cluster[1:]}
+    report = {
+        "clusters": len(clusters),
+        "duplicates": len(mapping),
+        "applied": False,
+        "moved_swipes": 0,
+        "moved_views": 0,
+    }
+    if not apply or not mapping:
+        return report
+
+    params = {"dup_ids": list(mapping), "keep_ids": list(mapping.values())}
+    try:
+        report["moved_swipes"] = db_session.execute(_REASSIGN_SWIPES, params).rowcount
+        moved_views = db_session.execute(_REASSIGN_VIEWS, params).all()
+        report["moved_views"] = len(moved_views)
+        # Оставшиеся строки дубликатов удаляются каскадом вместе с идеями — индекс соседей их вычтет
+        dropped_swipes = db_session.execute(
+            select(Swipe.user_id, Swipe.swipe, Idea.domain, Idea.title, Idea.tags)
+            .join(Idea, Swipe.idea_id == Idea.id)
+            .where(Swipe.idea_id.in_(list(mapping)))
+        ).all()
+        db_session.query(Idea).filter(Idea.id.in_(list(mapping))).delete(synchronize_session=False)
+        recount_counters(db_session, commit=False)
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+
+    # Удалённые каскадом свайпы дельта изменений не покажет — кэш матрицы собирается заново
+    drop_training_cache(settings.ML_MODEL_DIR)
+    near_duplicate_index.remove(mapping)
+    near_duplicate_index.snapshot()
+    _forget_deleted_ideas(mapping, moved_views, dropped_swipes)
+    popularity_index.load(db_session)
+    report["applied"] = True
+    print(f"🧹 Компакция: {report['duplicates']} дубликатов в {report['clusters']} кластерах удалено, "
+          f"перенесено {report['moved_swipes']} свайпов и {report['moved_views']} просмотров")
+    return report
+
+
+def _forget_deleted_ideas(mapping: Dict[uuid.UUID, uuid.UUID], moved_views, dropped_swipes):
+    """Удалённые дубликаты — из множеств просмотренного и индекса соседей"""
+
+    seen_sets.remove_ideas(mapping)
+    # Перенесённый просмотр делает оставляемую идею просмотренной
+    viewed = defaultdict(list)
+    for user_id, idea_id in moved_views:
+        viewed[user_id].append(idea_id)
+    for user_id, idea_ids in viewed.items():
+        seen_sets.mark_seen(user_id, idea_ids)
+    seen_sets.snapshot()
+
+    user_neighbor_index.forget_swipes((row.user_id, row, row.swipe) for row in dropped_swipes)
@@ -1,11 +1,21 @@
 """
 Генератор идей для доменов через OpenAI API
 Создает пул идей для каждого домена и сохраняет в БД
+
+Домены генерируются параллельно (не больше IDEA_GEN_CONCURRENCY за запуск),
+запросы к LLM проходят через общий для процесса token bucket
+(IDEA_GEN_RATE_PER_MINUTE, IDEA_GEN_BURST). 429, 5xx, таймауты и битый JSON
+повторяются с экспоненциальной задержкой и full jitter. Идеи домена пишутся
+в БД сразу, как пришёл его ответ, — первые идеи появляются через один вызов LLM.
 """
 
 import json
+import random
 import re
-from typing import List
+import threading
+import time
+from typing import List, Optional
+import openai
 from openai import AsyncOpenAI
 import asyncio
 
@@ -16,13 +26,21 @@ from ..database import SessionLocal
 
 settings = get_settings()
 
-client = None
+def make_client() -> Optional[AsyncOpenAI]:
+    """Новый AsyncOpenAI-клиент (None — ключ не настроен).
+
+    Пул соединений httpx привязывается к event loop, в котором клиент впервые
+    использован: потоку со своим loop нужен свой клиент.
+    """
+    if settings.OPENAI_API_KEY and settings.OPENAI_API_KEY.get_secret_value():
+        return AsyncOpenAI(api_key=settings.OPENAI_API_KEY.get_secret_value())
+    return None
+
+
 # Используем обычный OpenAI API
-if settings.OPENAI_API_KEY and settings.OPENAI_API_KEY.get_secret_value():
-    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY.get_secret_value())
-else:
+client = make_client()
+if client is None:
     print("⚠️ OpenAI API key not configured – idea generation is disabled")
-    client = None
 
 
 def _extract_json(text: str) -> str:
@@ -33,12 +51,65 @@ def _extract_json(text: str) -> str:
     return text.strip()
 
 
-async def _generate_ideas_for_domain(domain: str, count: int = 10) -> List[IdeaCreate]:
-    """Генерирует идеи для конкретного домена через OpenAI"""
-    
-    # Если нет OpenAI клиента, генерацию не выполняем (без заглушек)
-    if not client:
-        return []
+class TokenBucket:
+    """Ограничение частоты запросов к LLM: rate токенов в секунду, не больше capacity про запас.
+
+    Не привязан к event loop (генерация идёт и в loop сервера, и в loop воркера пула):
+    токен резервируется под threading.Lock, ожидание — asyncio.sleep.
+    """
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Забирает токен и возвращает, сколько секунд подождать до его наступления"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+rate_limiter = TokenBucket(settings.IDEA_GEN_RATE_PER_MINUTE / 60, settings.IDEA_GEN_BURST)
+
+# Временные ошибки: повторяем. Остальные (ключ, квота, неверный запрос) — сразу отказ
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # включая APITimeoutError
+    openai.InternalServerError,
+    ValueError,  # битый JSON или идея не прошла валидацию IdeaCreate
+    KeyError,
+    TypeError,
+)
+
+
+def _backoff_seconds(attempt: int, error: Exception) -> float:
+    """Full jitter: случайно из [0, min(max, base * 2^attempt)]; Retry-After от API важнее"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), settings.IDEA_GEN_BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass
+    ceiling = min(settings.IDEA_GEN_BACKOFF_MAX_SECONDS, settings.IDEA_GEN_BACKOFF_BASE_SECONDS * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+async def _request_ideas(llm_client, domain: str, count: int) -> List[IdeaCreate]:
+    """Один запрос к LLM и разбор ответа; ошибки — наружу (их разбирает _generate_ideas_for_domain)"""
     
     # Настройки промптов для разных доменов
     domain_prompts = {
@@ -77,103 +148,108 @@ async def _generate_ideas_for_domain(domain: str, count: int = 10) -> List[IdeaC
     Return ONLY raw JSON array, no extra text.
     """
     
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.8,
-            max_tokens=2000
+    response = await llm_client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0.8,
+        max_tokens=2000
+    )
+    
+    content = response.choices[0].message.content
+    content = _extract_json(content)
+    
+    # Парсим JSON ответ
+    ideas_raw = json.loads(content)
+    
+    # Создаем объекты IdeaCreate
+    return [
+        IdeaCreate(
+            title=idea_data["title"],
+            description=idea_data["description"],
+            tags=idea_data["tags"],
+            domain=domain
         )
-        
-        content = response.choices[0].message.content
-        content = _extract_json(content)
-        
-        # Парсим JSON ответ
-        ideas_raw = json.loads(content)
-        
-        # Создаем объекты IdeaCreate
-        ideas = []
-        for idea_data in ideas_raw:
-            idea = IdeaCreate(
-                title=idea_data["title"],
-                description=idea_data["description"],
-                tags=idea_data["tags"],
-                domain=domain
-            )
-            ideas.append(idea)
-        
-        return ideas
-        
-    except Exception as e:
-        print(f"❌ Ошибка генерации идей для {domain}: {str(e)}")
+        for idea_data in ideas_raw
+    ]
+
+
+async def _generate_ideas_for_domain(domain: str, count: int = 10, llm_client=None) -> List[IdeaCreate]:
+    """Генерирует идеи для конкретного домена через OpenAI: token bucket и повторы с jitter"""
+    
+    llm_client = llm_client or client
+    # Если нет OpenAI клиента, генерацию не выполняем (без заглушек)
+    if not llm_client:
         return []
+    
+    for attempt in range(settings.IDEA_GEN_MAX_RETRIES + 1):
+        await rate_limiter.acquire()
+        try:
+            return await _request_ideas(llm_client, domain, count)
+        except _RETRYABLE_ERRORS as e:
+            if attempt == settings.IDEA_GEN_MAX_RETRIES:
+                print(f"❌ Ошибка генерации идей для {domain} после {attempt + 1} попыток: {e}")
+                return []
+            delay = _backoff_seconds(attempt, e)
+            print(f"🔁 {domain}: {type(e).__name__}, повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            print(f"❌ Ошибка генерации идей для {domain}: {str(e)}")
+            return []
+    return []
 
 
-async def generate_ideas_for_domains(db_session, domains: List[str], ideas_per_domain: int = 10):
-    """Генерирует идеи для всех доменов пользователя"""
+async def generate_ideas_for_domains(db_session, domains: List[str], ideas_per_domain: int = 10, llm_client=None):
+    """Генерирует идеи для всех доменов пользователя параллельно и пишет каждый домен сразу.
+    
+    llm_client — AsyncOpenAI-совместимый клиент (по умолчанию модульный client).
+    Возвращает созданные идеи.
+    """
     
     print(f"🚀 Начинаем генерацию идей для доменов: {domains}")
     
-    all_generated_ideas = []
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, settings.IDEA_GEN_CONCURRENCY))
+    # Сессия одна на запуск: записи доменов — по очереди, LLM-запросы — параллельно
+    write_lock = asyncio.Lock()
+    created_ideas = []
     
-    for domain in domains:
+    async def _generate_and_save(domain: str):
         try:
-            ideas = await _generate_ideas_for_domain(domain, ideas_per_domain)
-            all_generated_ideas.extend(ideas)
-            
-            await asyncio.sleep(1)
-            
+            async with semaphore:
+                ideas = await _generate_ideas_for_domain(domain, ideas_per_domain, llm_client)
+            if not ideas:
+                return
+            async with write_lock:
+                # Синхронная запись — в потоке, чтобы не останавливать event loop
+                try:
+                    created = await asyncio.to_thread(bulk_create_ideas, db_session, ideas)
+                except Exception:
+                    # Сессия общая: без отката следующие домены упадут на прерванной транзакции
+                    await asyncio.to_thread(db_session.rollback)
+                    raise
+            created_ideas.extend(created)
+            print(f"💾 {domain}: сохранено {len(created)} новых идей через {time.perf_counter() - started:.1f} с")
         except Exception as e:
             print(f"❌ Ошибка для домена {domain}: {e}")
-            continue
     
-    # Сохраняем все идеи в БД
-    if all_generated_ideas:
-        try:
-            created_ideas = bulk_create_ideas(db_session, all_generated_ideas)
-            print(f"💾 Сохранено {len(created_ideas)} новых идей в БД")
-            
-            # Группируем по доменам для отчета
-            domain_counts = {}
-            for idea in created_ideas:
-                domain_counts[idea.domain] = domain_counts.get(idea.domain, 0) + 1
-            
-            print("📊 Создано идей по доменам:")
-            for domain, count in domain_counts.items():
-                print(f"   • {domain}: {count} идей")
-                
-        except Exception as e:
-            print(f"❌ Ошибка сохранения в БД: {e}")
+    await asyncio.gather(*(_generate_and_save(domain) for domain in dict.fromkeys(domains)))
+    
+    if created_ideas:
+        print(f"📊 Создано {len(created_ideas)} идей за {time.perf_counter() - started:.1f} с")
     else:
         print("⚠️ Не сгенерировано ни одной идеи")
     
     print("🏁 Генерация завершена")
+    return created_ideas
 
 
-def run_sync_generation(db_session, domains: List[str], ideas_per_domain: int = 10):
-    """Синхронная обёртка для использования в BackgroundTasks"""
-    return asyncio.run(generate_ideas_for_domains(db_session, domains, ideas_per_domain))
-
-
-# ------------------- Helper for FastAPI BackgroundTasks (async) -------------------
-def enqueue_async_generation(db_session_dummy, domains: List[str], ideas_per_domain: int = 10):
-    """Кладётся в BackgroundTasks. Создаёт свой SessionLocal, чтобы не зависеть
-    от request-scope сессии (которая будет закрыта после ответа)."""
-
-    # Создаём новый DB-сеанс специально для фоновой задачи
-    bg_session = SessionLocal()
-
-    def _runner():
-        try:
-            asyncio.run(generate_ideas_for_domains(bg_session, domains, ideas_per_domain))
-        finally:
-            bg_session.close()
-
-    # Запускаем в отдельном потоке
-    import threading
-    thread = threading.Thread(target=_runner)
-    thread.daemon = True
-    thread.start() 
\ No newline at end of file
+async def run_async_generation(domains: List[str], ideas_per_domain: int = 10):
+    """Генерация для async-роутеров (и их BackgroundTasks): своя сессия вместо сессии запроса"""
+    db_session = SessionLocal()
+    try:
+        await generate_ideas_for_domains(db_session, domains, ideas_per_domain)
+    finally:
+        db_session.close()
@@ -0,0 +1,239 @@
+"""
+Пул идей по доменам с пополнением по нижней границе
+Глубина пула домена — сколько непросмотренных идей домена осталось у самого
+«голодного» активного пользователя (домены берутся из selected_domains, включая
+кастомные). Считается одним запросом по поддерживаемым счётчикам:
+domain_counters.ideas - user_domain_counters.seen.
+
+Фоновый воркер раз в IDEA_POOL_CHECK_SECONDS (или раньше, если запрос попросил
+через request_refill) под advisory-блокировкой (один воркер на все процессы)
+пополняет домены, у которых глубина ниже IDEA_POOL_LOW_WATERMARK, и добирает их
+до IDEA_POOL_TARGET_DEPTH. HTTP-запросы генерацию не ждут.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+from ..config import get_settings
+from ..database import SessionLocal, try_advisory_lock
+from . import idea_generator
+
+settings = get_settings()
+
+_REFILL_LOCK_NAME = "idea_pool_refill"
+
+_POOL_DEPTH_SQL = text("""
+    WITH active AS (
+        SELECT u.id, u.selected_domains
+        FROM users u
+        WHERE u.onboarding_completed
+          AND u.selected_domains IS NOT NULL
+          AND (
+              u.created_at > now() - make_interval(days => :active_days)
+              OR EXISTS (
+                  SELECT 1 FROM idea_views v
+                  WHERE v.user_id = u.id AND v.viewed_at > now() - make_interval(days => :active_days)
+              )
+          )
+    ), wanted AS (
+        SELECT a.id AS user_id, d.domain
+        FROM active a
+        CROSS JOIN LATERAL json_array_elements_text(a.selected_domains) AS d(domain)
+    )
+    SELECT w.domain,
+           count(*) AS users,
+           coalesce(max(dc.ideas), 0) AS ideas,
+           min(coalesce(dc.ideas, 0) - coalesce(uc.seen, 0)) AS depth
+    FROM wanted w
+    LEFT JOIN domain_counters dc ON dc.domain = w.domain
+    LEFT JOIN user_domain_counters uc ON uc.user_id = w.user_id AND uc.domain = w.domain
+    GROUP BY w.domain
+""")
+
+
+def get_pool_depths(db_session) -> Dict[str, Dict]:
+    """Домен → {depth, ideas, users} по активным пользователям"""
+    rows = db_session.execute(_POOL_DEPTH_SQL, {"active_days": settings.IDEA_POOL_ACTIVE_DAYS}).all()
+    return {
+        row.domain: {"depth": max(row.depth, 0), "ideas": row.ideas, "users": row.users}
+        for row in rows
+    }
+
+
+class IdeaPool:
+    """Фоновый воркер пополнения пула идей.
+
+    Поток держит один event loop на всё время работы и свой LLM-клиент:
+    пул соединений клиента привязан к loop, в котором клиент создан и используется.
+    """
+
+    def __init__(
+        self,
+        target_depth: int = 30,
+        low_watermark: int = 10,
+        refill_batch: int = 10,
+        check_seconds: float = 30.0,
+        min_interval: float = 5.0,
+    ):
+        self.target_depth = target_depth
+        self.low_watermark = low_watermark
+        self.refill_batch = refill_batch
+        self.check_seconds = check_seconds
+        self.min_interval = min_interval
+        self.llm_client = None  # заданный снаружи клиент (иначе поток создаёт свой)
+        self._client = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._refilling = set()  # домены, которые добираются до target_depth
+        self._depths: Dict[str, Dict] = {}
+        self._stats = {"cycles": 0, "refills": 0, "ideas_created": 0, "skipped_locked": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, llm_client=None):
+        if self.running:
+            return
+        self.llm_client = llm_client
+        if llm_client is None and idea_generator.client is None:
+            print("⚠️ Пул идей не запущен: OpenAI-клиент не настроен")
+            return
+        self._stop.clear()
+        self._wake.set()  # первая проверка — сразу после старта
+        self._thread = threading.Thread(target=self._run, name="idea-pool", daemon=True)
+        self._thread.start()
+        print(f"🫙 Пул идей: цель {self.target_depth}, нижняя граница {self.low_watermark}, "
+              f"проверка каждые {self.check_seconds:.0f} с")
+
+    def stop(self, timeout: float = 30.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def request_refill(self) -> bool:
+        """Просит воркер проверить пул (не блокирует). False — воркер не запущен"""
+        if not self.running:
+            return False
+        self._wake.set()
+        return True
+
+    def domains_to_refill(self, depths: Dict[str, Dict]) -> Dict[str, int]:
+        """Домен → сколько идей не хватает до target_depth.
+
+        Пополнение начинается ниже low_watermark и продолжается до target_depth
+        (гистерезис), чтобы не дёргать LLM на каждую просмотренную идею.
+        """
+        need = {}
+        for domain, info in depths.items():
+            depth = info["depth"]
+            if depth >= self.target_depth:
+                continue
+            if depth < self.low_watermark or domain in self._refilling:
+                need[domain] = self.target_depth - depth
+        self._refilling = set(need)
+        return need
+
+    def refill_once(self) -> int:
+        """Один цикл: глубина пула и генерация для просевших доменов. Возвращает число новых идей"""
+        with try_advisory_lock(_REFILL_LOCK_NAME) as acquired:
+            if not acquired:
+                # Пополняет воркер другого процесса
+                self._stats["skipped_locked"] += 1
+                return 0
+
+            db = SessionLocal()
+            try:
+                depths = get_pool_depths(db)
+                db.commit()  # не держим транзакцию открытой на время вызовов LLM
+                self._depths = depths
+                self._stats["cycles"] += 1
+
+                need = self.domains_to_refill(depths)
+                if not need:
+                    return 0
+
+                per_domain = min(self.refill_batch, max(need.values()))
+                low = ", ".join(f"{domain} ({depths[domain]['depth']})" for domain in need)
+                print(f"🫙 Пополняем пул: {low} по {per_domain} идей")
+                created = self._loop.run_until_complete(idea_generator.generate_ideas_for_domains(
+                    db, list(need), per_domain, llm_client=self._client
+                ))
+                self._stats["refills"] += 1
+                self._stats["ideas_created"] += len(created)
+                return len(created)
+            finally:
+                db.close()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._client = self.llm_client or idea_generator.make_client()
+        try:
+            self._loop_cycles()
+        finally:
+            if self.llm_client is None:
+                self._loop.run_until_complete(self._client.close())
+            self._loop.close()
+            self._loop = self._client = None
+
+    def _loop_cycles(self):
+        last_cycle = 0.0
+        while not self._stop.is_set():
+            self._wake.wait(self.check_seconds)
+            if self._stop.is_set():
+                break
+            self._wake.clear()
+
+            pause = self.min_interval - (time.monotonic() - last_cycle)
+            if pause > 0 and self._stop.wait(pause):
+                break
+            last_cycle = time.monotonic()
+
+            try:
+                created = self.refill_once()
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"❌ Пополнение пула идей не удалось: {e}")
+                continue
+
+            if created and self._refilling:
+                # Домены ещё ниже цели — следующий цикл сразу после min_interval
+                self._wake.set()
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "target_depth": self.target_depth,
+            "low_watermark": self.low_watermark,
+            "refilling": sorted(self._refilling),
+            "depths": dict(self._depths),
+            **self._stats,
+        }
+
+
+idea_pool = IdeaPool(
+    target_depth=settings.IDEA_POOL_TARGET_DEPTH,
+    low_watermark=settings.IDEA_POOL_LOW_WATERMARK,
+    refill_batch=settings.IDEA_POOL_REFILL_BATCH,
+    check_seconds=settings.IDEA_POOL_CHECK_SECONDS,
+    min_interval=settings.IDEA_POOL_MIN_INTERVAL_SECONDS,
+)
+
+
+def start_idea_pool():
+    if settings.IDEA_POOL_ENABLED:
+        idea_pool.start()
+
+
+def shutdown_idea_pool():
+    idea_pool.stop()
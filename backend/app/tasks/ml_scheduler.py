@@ -0,0 +1,160 @@
+"""
+Автоматическое переобучение ML-моделей через APScheduler
+Полное переобучение по cron и инкрементальное — при срабатывании дешёвых сигналов дрейфа
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import func, select, tuple_
+
+from ..config import get_settings
+from ..crud.ml_meta import get_latest_model_version
+from ..database import SessionLocal
+from ..models import Idea, Swipe
+from .ml_training import TrainingInProgressError, run_training
+
+settings = get_settings()
+
+scheduler = BackgroundScheduler(timezone="UTC")
+
+# Дрейф сравнивается с последней опубликованной версией: если попытка не дала версии
+# (один класс, отклонение гейтом, ошибка), условие остаётся истинным — следующая
+# попытка откладывается с удвоением интервала, пока не появится новая версия
+_drift_backoff: Dict = {"failures": 0, "retry_at": None, "model_version": None}
+
+
+def compute_drift_signals(db_session) -> Dict:
+    """Считает сигналы дрейфа относительно последней версии модели (два агрегатных запроса)"""
+
+    latest = get_latest_model_version(db_session)
+
+    swipes_stmt = select(
+        func.count(Swipe.id),
+        func.count(Swipe.id).filter(Swipe.swipe.is_(True)),
+    )
+    if latest and latest.swipe_watermark_at:
+        # Новые и изменённые (повторный свайп, перенос компакцией) после водяного знака версии
+        swipes_stmt = swipes_stmt.where(
+            tuple_(Swipe.updated_at, Swipe.id) > tuple_(latest.swipe_watermark_at, latest.swipe_watermark_id)
+        )
+    new_swipes, new_likes = db_session.execute(swipes_stmt).one()
+
+    ideas_stmt = select(func.count(Idea.id))
+    if latest and latest.trained_at:
+        ideas_stmt = select(func.count(Idea.id), func.count(Idea.id).filter(Idea.created_at > latest.trained_at))
+        total_ideas, unseen_ideas = db_session.execute(ideas_stmt).one()
+    else:
+        total_ideas = unseen_ideas = db_session.execute(ideas_stmt).scalar_one()
+
+    baseline_rate = (latest.details or {}).get("positive_rate") if latest else None
+    new_like_rate = new_likes / new_swipes if new_swipes else None
+    like_ratio_shift = None
+    if baseline_rate is not None and new_like_rate is not None and new_swipes >= settings.ML_DRIFT_MIN_SWIPES_FOR_RATIO:
+        like_ratio_shift = abs(new_like_rate - baseline_rate)
+
+    unseen_share = unseen_ideas / total_ideas if total_ideas else 0.0
+
+    reasons = []
+    if new_swipes >= settings.ML_DRIFT_MIN_NEW_SWIPES:
+        reasons.append("new_swipes")
+    if like_ratio_shift is not None and like_ratio_shift >= settings.ML_DRIFT_LIKE_RATIO_SHIFT:
+        reasons.append("like_ratio_shift")
+    if unseen_share >= settings.ML_DRIFT_UNSEEN_IDEAS_SHARE:
+        reasons.append("unseen_ideas_share")
+
+    return {
+        "model_version": latest.version if latest else None,
+        "new_swipes": new_swipes,
+        "new_like_rate": new_like_rate,
+        "baseline_like_rate": baseline_rate,
+        "like_ratio_shift": like_ratio_shift,
+        "unseen_ideas_share": unseen_share,
+        "triggered": reasons,
+    }
+
+
+def _scheduled_retrain():
+    """Полное переобучение по расписанию"""
+    db = SessionLocal()
+    try:
+        run_training(db, mode="full", trigger="cron")
+    except TrainingInProgressError:
+        print("⏭️ Плановое обучение пропущено: обучение уже идёт")
+    except Exception as e:
+        print(f"❌ Плановое обучение не удалось: {e}")
+    finally:
+        db.close()
+
+
+def _drift_attempt_failed(model_version: Optional[int], reason: str):
+    _drift_backoff["failures"] += 1
+    minutes = min(
+        settings.ML_DRIFT_CHECK_MINUTES * 2 ** _drift_backoff["failures"],
+        settings.ML_DRIFT_MAX_BACKOFF_MINUTES,
+    )
+    _drift_backoff.update(
+        retry_at=datetime.now(timezone.utc) + timedelta(minutes=minutes),
+        model_version=model_version,
+    )
+    print(f"⏳ Обучение по дрейфу не дало версии ({reason}): следующая попытка через {minutes} мин")
+
+
+def _check_drift():
+    """Проверяет сигналы дрейфа и при срабатывании запускает инкрементальное обучение"""
+    db = SessionLocal()
+    try:
+        signals = compute_drift_signals(db)
+        # Новая версия (например, от cron) или пропавший дрейф снимают отсрочку
+        if not signals["triggered"] or signals["model_version"] != _drift_backoff["model_version"]:
+            _drift_backoff.update(failures=0, retry_at=None, model_version=signals["model_version"])
+        if not signals["triggered"]:
+            return
+        if _drift_backoff["retry_at"] is not None and datetime.now(timezone.utc) < _drift_backoff["retry_at"]:
+            return
+
+        print(f"📈 Дрейф ({', '.join(signals['triggered'])}): запускаем обучение")
+        # Без версии в реестре инкрементальное обучение само откатится на полное
+        result = run_training(db, mode="incremental", trigger="drift")
+        if result.get("model_version") is None:
+            _drift_attempt_failed(signals["model_version"], result["status"])
+    except TrainingInProgressError:
+        print("⏭️ Обучение по дрейфу пропущено: обучение уже идёт")
+    except Exception as e:
+        print(f"❌ Проверка дрейфа не удалась: {e}")
+        _drift_attempt_failed(_drift_backoff["model_version"], "ошибка")
+    finally:
+        db.close()
+
+
+def start_scheduler():
+    """Запускает планировщик переобучения (если включён в настройках)"""
+    if not settings.ML_SCHEDULER_ENABLED or scheduler.running:
+        return
+
+    scheduler.add_job(
+        _scheduled_retrain,
+        CronTrigger.from_crontab(settings.ML_RETRAIN_CRON, timezone="UTC"),
+        id="ml_retrain_cron",
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        _check_drift,
+        "interval",
+        minutes=settings.ML_DRIFT_CHECK_MINUTES,
+        id="ml_drift_check",
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True,
+    )
+    scheduler.start()
+    print(f"⏰ Планировщик ML запущен: cron '{settings.ML_RETRAIN_CRON}', дрейф каждые {settings.ML_DRIFT_CHECK_MINUTES} мин")
+
+
+def shutdown_scheduler():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
@@ -0,0 +1,207 @@
+"""
+Запуск обучения ML-моделей: общий для /api/ml/train и планировщика
+Гарантирует, что одновременно идёт только одно обучение, и логирует
+длительность и потребление ресурсов каждого запуска
+"""
+
+import resource
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+from ..config import get_settings
+from ..crud.ml_meta import get_latest_model_version, record_model_version
+from ..database import try_advisory_lock
+from ..ml.advanced_recommender import advanced_recommender
+from ..ml.evaluation import window_from_json
+from ..models import Idea, User
+
+settings = get_settings()
+
+
+class TrainingInProgressError(RuntimeError):
+    """Обучение уже идёт в этом или другом процессе"""
+
+
+class NotEnoughTrainingDataError(ValueError):
+    """Недостаточно идей или пользователей для обучения"""
+
+
+# Одно обучение на процесс + advisory-блокировка Postgres на все процессы
+_training_lock = threading.Lock()
+_TRAINING_LOCK_NAME = "smartswipe:ml_training"
+
+# Журнал последних запусков (для /api/ml/training-runs)
+_training_runs: deque = deque(maxlen=50)
+
+
+def is_training_running() -> bool:
+    return _training_lock.locked()
+
+
+def get_training_runs() -> List[Dict]:
+    """Последние запуски обучения, новые первыми"""
+    return list(reversed(_training_runs))
+
+
+def run_training(db_session, mode: str = "full", trigger: str = "manual") -> Dict:
+    """Обучает все модели и регистрирует новую версию ensemble.
+
+    mode: "full" | "incremental"; trigger: "manual" | "cron" | "drift".
+    """
+
+    if not _training_lock.acquire(blocking=False):
+        raise TrainingInProgressError("Training is already running")
+
+    run = {
+        "trigger": trigger,
+        "mode": mode,
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "status": "running",
+    }
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+
+    try:
+        with try_advisory_lock(_TRAINING_LOCK_NAME) as acquired:
+            if not acquired:
+                raise TrainingInProgressError("Training is already running in another worker")
+
+            result = _train_all_models(db_session, mode)
+            run.update(status=result["status"], model_version=result["model_version"], delta_rows=result["delta_rows"])
+            return result
+
+    except TrainingInProgressError:
+        run["status"] = "skipped"
+        raise
+    except Exception as e:
+        run.update(status="failed", error=str(e))
+        raise
+    finally:
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+        run["duration_seconds"] = round(time.perf_counter() - started, 3)
+        run["cpu_seconds"] = round(
+            (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime), 3
+        )
+        # ru_maxrss в Linux — килобайты, пиковое значение процесса
+        run["max_rss_mb"] = round(usage_after.ru_maxrss / 1024, 1)
+        _training_runs.append(run)
+        _training_lock.release()
+        print(
+            f"🧠 Обучение [{trigger}/{mode}] {run['status']}: "
+            f"{run['duration_seconds']}s, CPU {run['cpu_seconds']}s, RSS {run['max_rss_mb']} MB"
+        )
+
+
+def _train_all_models(db_session, mode: str) -> Dict:
+    # Идеи и свайпы читаются потоково внутри моделей, здесь нужны только количества
+    onboarded = User.onboarding_completed == True
+    ideas_count = db_session.query(func.count(Idea.id)).scalar()
+    users_count = db_session.query(func.count(User.id)).filter(onboarded).scalar()
+
+    if ideas_count < 5:
+        raise NotEnoughTrainingDataError("Need at least 5 ideas to train models")
+
+    if users_count < 2:
+        raise NotEnoughTrainingDataError("Need at least 2 users to train models")
+
+    latest = get_latest_model_version(db_session)
+    since = None
+    if mode == "incremental" and latest and latest.swipe_watermark_at:
+        since = (latest.swipe_watermark_at, latest.swipe_watermark_id)
+
+    # Текущая версия (с кодами доменов и TF-IDF) нужна, чтобы откатиться, если новая ранжирует хуже
+    snapshot = advanced_recommender.snapshot_ensemble() if settings.ML_EVAL_GATE_ENABLED else None
+
+    # В инкрементальном режиме content-based модель не пересобирается: новые идеи
+    # векторизует обученный TF-IDF
+    if since is None or not advanced_recommender.content_is_current(db_session):
+        advanced_recommender.train_content_based_model(db_session)
+    advanced_recommender.train_ensemble_model(
+        db_session, since=since, previous_rows=latest.training_rows if since is not None else None
+    )
+
+    evaluation = None
+    if advanced_recommender.best_model_name:
+        evaluation = advanced_recommender.evaluate_ranking(db_session)
+        rejection = _gate_rejection(db_session, latest, evaluation) if snapshot is not None else None
+        if rejection:
+            advanced_recommender.restore_ensemble(snapshot)
+            print(f"⛔ Новая версия отклонена: {rejection}")
+            return {
+                "status": "rejected",
+                "message": rejection,
+                "mode": mode,
+                "model_version": None,
+                "delta_rows": advanced_recommender.training_delta_rows,
+                "evaluation": evaluation,
+            }
+
+    # Версия принята: публикуем индекс соседей. В инкрементальном режиме он не
+    # пересобирается — его ведут свайпы и фоновый пересчёт
+    if since is None or not advanced_recommender.user_index.built:
+        user_ids = db_session.query(User.id).filter(onboarded).all()
+        advanced_recommender.train_user_based_model(db_session, [user_id for (user_id,) in user_ids])
+
+    # Регистрируем версию с водяным знаком для следующего инкрементального обучения
+    model_version = None
+    if advanced_recommender.best_model_name:
+        # Кэш матрицы сдвигается вместе с водяным знаком реестра
+        advanced_recommender.publish_training_cache()
+        best_metrics = advanced_recommender.get_training_metrics()[advanced_recommender.best_model_name]
+        model_version = record_model_version(
+            db_session,
+            metrics=best_metrics,
+            model_path=advanced_recommender.ensemble_model_path,
+            training_mode="incremental" if advanced_recommender.training_delta_rows is not None else "full",
+            training_rows=advanced_recommender.training_rows,
+            watermark=advanced_recommender.training_watermark,
+            details={
+                "best_model": advanced_recommender.best_model_name,
+                "positive_rate": advanced_recommender.training_positive_rate,
+                "sampling_rate": advanced_recommender.training_sampling_rate,
+                "evaluation": evaluation,
+            },
+        ).version
+
+    return {
+        "status": "success",
+        "message": "ML models trained successfully",
+        "mode": mode,
+        "model_version": model_version,
+        "delta_rows": advanced_recommender.training_delta_rows,
+        "training_rows": advanced_recommender.training_rows,
+        "sampling_rate": advanced_recommender.training_sampling_rate,
+        "ideas_count": ideas_count,
+        "users_count": users_count,
+        "metrics": advanced_recommender.get_training_metrics(),
+        "evaluation": evaluation,
+    }
+
+
+def _gate_rejection(db_session, latest, evaluation: Optional[Dict]) -> Optional[str]:
+    """Причина отклонить новую версию: NDCG@k упал сильнее допустимого относительно прошлой.
+
+    Новая версия оценивается на том же окне отложенных свайпов, что и прошлая,
+    иначе разница метрик отражала бы смену окна, а не качество модели.
+    """
+
+    previous = ((latest.details or {}).get("evaluation") if latest else None)
+    window = window_from_json(previous.get("window")) if previous else None
+    if not evaluation or window is None:
+        return None
+
+    if previous["window"] != evaluation.get("window") or previous.get("k") != evaluation["k"]:
+        evaluation = advanced_recommender.evaluate_ranking(db_session, k=previous["k"], window=window)
+        if evaluation is None:
+            return None
+
+    key = f"ndcg@{previous['k']}"
+    drop = previous[key] - evaluation[key]
+    if drop > settings.ML_EVAL_MAX_NDCG_DROP:
+        return f"{key} dropped from {previous[key]:.4f} to {evaluation[key]:.4f} (version v{latest.version})"
+    return None
@@ -0,0 +1,335 @@
+"""
+Write-behind буфер для свайпов и просмотров (group commit)
+События складываются в очередь процесса (ограничена числом событий, а не запросов),
+фоновый поток сбрасывает их
+пачками — многострочный upsert свайпов и insert просмотров в одной транзакции —
+каждые WRITE_BEHIND_FLUSH_MS или по WRITE_BEHIND_MAX_BATCH событий. Строки
+пишутся в порядке ключей (одинаковый порядок блокировок у всех процессов),
+временные ошибки повторяются, а пачка с ошибкой данных делится пополам, пока
+не останутся только запросы с плохими событиями.
+
+Режимы (WRITE_BEHIND_MODE):
+  off     — запись в запросе, как раньше
+  async   — запрос подтверждается сразу после постановки в очередь; при падении
+            процесса теряются события последних миллисекунд
+  durable — запрос ждёт commit своей пачки; несколько запросов делят один commit/fsync
+"""
+
+from dataclasses import dataclass, field
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import uuid
+
+from sqlalchemy.exc import OperationalError
+
+from ..config import get_settings
+from ..crud.idea import insert_view_events, record_view_signals
+from ..crud.swipe import record_swipe_signals, upsert_swipe_events
+from ..database import SessionLocal
+
+settings = get_settings()
+
+WRITE_BEHIND_MODES = ("off", "async", "durable")
+DURABLE_WAIT_SECONDS = 30.0  # сколько запрос в режиме durable ждёт commit своей пачки
+
+
+class WriteBehindQueueFull(Exception):
+    """Очередь заполнена и не освободилась за WRITE_BEHIND_ENQUEUE_TIMEOUT_MS"""
+
+
+class WriteBehindFlushError(Exception):
+    """Пачка с событиями запроса не записалась (режим durable)"""
+
+
+class Ticket:
+    """Ожидание commit пачки в режиме durable; result — записанные свайпы по (user_id, idea_id)"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.result: Dict[Tuple[uuid.UUID, uuid.UUID], Any] = {}
+        self.error: Optional[BaseException] = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def _resolve(self, result=None, error: Optional[BaseException] = None):
+        self.result = result or {}
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> Dict[Tuple[uuid.UUID, uuid.UUID], Any]:
+        if not self._done.wait(timeout):
+            raise WriteBehindFlushError("Timed out waiting for group commit")
+        if self.error is not None:
+            raise WriteBehindFlushError(str(self.error)) from self.error
+        return self.result
+
+
+@dataclass
+class _Item:
+    swipes: List[Tuple[uuid.UUID, uuid.UUID, bool]] = field(default_factory=list)
+    views: List[Tuple[uuid.UUID, uuid.UUID]] = field(default_factory=list)
+    ticket: Optional[Ticket] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.swipes) + len(self.views)
+
+
+_STOP = object()
+
+
+class WriteBehindBuffer:
+    """Ограниченная очередь событий и поток, сбрасывающий их пачками.
+
+    Backpressure по числу событий: если в очереди нет места для событий запроса
+    дольше enqueue_timeout, submit_* бросает WriteBehindQueueFull — роутер
+    отвечает 503, и клиент повторяет позже. Запрос больше max_queue событий
+    принимается только в пустую очередь.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        mode: str = "off",
+        max_queue: int = 10_000,
+        max_batch: int = 500,
+        flush_interval_ms: int = 20,
+        enqueue_timeout_ms: int = 100,
+        max_retries: int = 3,
+        retry_backoff_ms: int = 50,
+    ):
+        if mode not in WRITE_BEHIND_MODES:
+            raise ValueError(f"Unknown write-behind mode: {mode}")
+        self.session_factory = session_factory
+        self.mode = mode
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval_ms / 1000
+        self.enqueue_timeout = enqueue_timeout_ms / 1000
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self.max_queue = max_queue
+        # Сама очередь не ограничена: место считается в событиях под _space
+        self._queue: "queue.Queue" = queue.Queue()
+        self._queued_events = 0
+        self._space = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            "events": 0, "batches": 0, "rejected_swipes": 0, "failed_events": 0, "queue_full": 0,
+            "retries": 0, "splits": 0, "flush_errors": 0, "signal_errors": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off" and self._thread is not None and self._thread.is_alive()
+
+    @property
+    def durable(self) -> bool:
+        return self.mode == "durable"
+
+    # --- жизненный цикл ------------------------------------------------------
+
+    def start(self):
+        if self.mode == "off" or self.enabled:
+            return
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        print(f"📝 Write-behind запущен: режим {self.mode}, пачка до {self.max_batch}, "
+              f"интервал {self.flush_interval * 1000:.0f} мс")
+
+    def stop(self, timeout: float = 30.0):
+        """Сбрасывает всё, что уже в очереди, и останавливает поток"""
+        if self._thread is None:
+            return
+        if self._thread.is_alive():
+            # Маркер встаёт после всех событий (очередь не ограничена по длине — put не ждёт)
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                print(f"⚠️ Write-behind: поток не успел сбросить очередь, {self._queued_events} событий не записаны")
+        else:
+            print(f"⚠️ Write-behind: поток сброса остановился раньше, {self._queued_events} событий не записаны")
+        self._thread = None
+        print(f"📝 Write-behind остановлен: {self.stats()}")
+
+    # --- постановка в очередь ------------------------------------------------
+
+    def _submit(self, item: _Item) -> Optional[Ticket]:
+        if self.durable:
+            item.ticket = Ticket()
+        with self._space:
+            has_space = self._space.wait_for(
+                lambda: self._queued_events == 0 or self._queued_events + item.size <= self.max_queue,
+                timeout=self.enqueue_timeout,
+            )
+            if not has_space:
+                self._stats["queue_full"] += 1
+                raise WriteBehindQueueFull("Write-behind queue is full")
+            self._queued_events += item.size
+        self._queue.put(item)
+        return item.ticket
+
+    def _take(self, timeout: Optional[float] = None, block: bool = True):
+        """Забирает элемент из очереди и освобождает место под его события"""
+        item = self._queue.get(block, timeout)
+        if item is not _STOP:
+            with self._space:
+                self._queued_events -= item.size
+                self._space.notify_all()
+        return item
+
+    def submit_swipes(self, user_id: uuid.UUID, swipes: Sequence[Tuple[uuid.UUID, bool]]) -> Optional[Ticket]:
+        """Ставит свайпы пользователя (idea_id, swipe) в очередь; в durable — возвращает Ticket"""
+        return self._submit(_Item(swipes=[(user_id, idea_id, swipe) for idea_id, swipe in swipes]))
+
+    def submit_views(self, user_id: uuid.UUID, idea_ids: Sequence[uuid.UUID]) -> Optional[Ticket]:
+        # Просмотренными идеи станут после commit пачки (record_view_signals)
+        return self._submit(_Item(views=[(user_id, idea_id) for idea_id in idea_ids]))
+
+    # --- сброс ---------------------------------------------------------------
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._take()
+            if first is _STOP:
+                break
+            batch, size = [first], first.size
+            deadline = time.monotonic() + self.flush_interval
+
+            # Добираем пачку до max_batch событий или до истечения интервала
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._take(timeout=remaining) if remaining > 0 else self._take(block=False)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += item.size
+
+            self._flush_guarded(batch)
+
+        # Остаток очереди после маркера (события, поставленные во время остановки)
+        leftover = []
+        while True:
+            try:
+                item = self._take(block=False)
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            self._flush_guarded(leftover)
+
+    def _flush_guarded(self, batch: List[_Item]):
+        """_flush, после которого поток живёт дальше: неожиданная ошибка не теряет очередь"""
+        try:
+            self._flush(batch)
+        except Exception as e:
+            self._stats["flush_errors"] += 1
+            print(f"❌ Write-behind: сбой сброса пачки: {e}")
+            # Тикеты, которые _flush не успел разрешить, не должны ждать до таймаута
+            for item in batch:
+                if item.ticket and not item.ticket.done:
+                    item.ticket._resolve(error=e)
+
+    def _flush(self, batch: List[_Item]):
+        """Пишет пачку; при ошибке данных делит её пополам до отдельных запросов"""
+
+        # Сортировка устойчивая: повторные свайпы одной пары сохраняют порядок, побеждает последний
+        swipes = sorted((event for item in batch for event in item.swipes), key=lambda e: (e[0], e[1]))
+        views = sorted(event for item in batch for event in item.views)
+
+        try:
+            writes, inserted_views = self._write_with_retry(swipes, views)
+        except Exception as e:
+            if len(batch) > 1 and not isinstance(e, OperationalError):
+                # Ошибка данных (например, FK) — ищем плохие события делением пачки
+                self._stats["splits"] += 1
+                middle = len(batch) // 2
+                self._flush(batch[:middle])
+                self._flush(batch[middle:])
+                return
+            self._stats["failed_events"] += len(swipes) + len(views)
+            print(f"❌ Write-behind: пачка из {len(swipes)} свайпов и {len(views)} просмотров не записана: {e}")
+            for item in batch:
+                if item.ticket:
+                    item.ticket._resolve(error=e)
+            return
+
+        self._stats["events"] += len(swipes) + len(views)
+        self._stats["batches"] += 1
+        self._stats["rejected_swipes"] += len({(u, i) for u, i, _ in swipes}) - len(writes)
+        # Пачка уже в БД: запросы отпускаются до обновления in-memory индексов
+        for item in batch:
+            if item.ticket:
+                item.ticket._resolve({
+                    (user_id, idea_id): writes.get((user_id, idea_id)) for user_id, idea_id, _ in item.swipes
+                })
+
+        try:
+            record_swipe_signals(writes.values())
+            record_view_signals(inserted_views)
+        except Exception as e:
+            # Индексы догонят БД при следующей пересборке; запись и поток от этого не страдают
+            self._stats["signal_errors"] += 1
+            print(f"⚠️ Write-behind: сигналы индексам не обновлены: {e}")
+
+    def _write_with_retry(self, swipes, views):
+        """Одна транзакция; дедлоки и обрывы соединения (OperationalError) повторяются с backoff"""
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._write(swipes, views)
+            except OperationalError:
+                if attempt == self.max_retries:
+                    raise
+                self._stats["retries"] += 1
+                time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def _write(self, swipes, views):
+        db = self.session_factory()
+        try:
+            writes = upsert_swipe_events(db, swipes, commit=False)
+            inserted_views = insert_view_events(db, views, commit=False)
+            db.commit()
+            return writes, inserted_views
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        batches = self._stats["batches"]
+        return {
+            "mode": self.mode,
+            "queued": self._queued_events,
+            **self._stats,
+            "avg_batch": round(self._stats["events"] / batches, 1) if batches else 0.0,
+        }
+
+
+# Глобальный буфер (один на процесс); поток запускается на старте приложения
+write_behind = WriteBehindBuffer(
+    mode=settings.WRITE_BEHIND_MODE,
+    max_queue=settings.WRITE_BEHIND_MAX_QUEUE,
+    max_batch=settings.WRITE_BEHIND_MAX_BATCH,
+    flush_interval_ms=settings.WRITE_BEHIND_FLUSH_MS,
+    enqueue_timeout_ms=settings.WRITE_BEHIND_ENQUEUE_TIMEOUT_MS,
+    max_retries=settings.WRITE_BEHIND_MAX_RETRIES,
+)
+
+
+def start_write_behind():
+    write_behind.start()
+
+
+def shutdown_write_behind():
+    write_behind.stop()
@@ -1,29 +1,34 @@
 #!/usr/bin/env bash
 set -e
 
-# Проверяем, существуют ли таблицы
+# Проверяем, существуют ли таблицы и таблица версий Alembic
 echo "🔍 Проверяем состояние базы данных..."
-if python -c "
+DB_STATE=$(python -c "
 import os
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect
 try:
-    engine = create_engine(os.getenv('DATABASE_URL'))
-    with engine.connect() as conn:
-        result = conn.execute(text(\"SELECT 1 FROM information_schema.tables WHERE table_name = 'users'\"))
-        if result.fetchone():
-            print('TABLES_EXIST')
-        else:
-            print('NO_TABLES')
+    tables = inspect(create_engine(os.getenv('DATABASE_URL'))).get_table_names()
+    if 'alembic_version' in tables:
+        print('VERSIONED')
+    elif 'users' in tables:
+        print('UNVERSIONED')
+    else:
+        print('NO_TABLES')
 except Exception as e:
     print('ERROR:', e)
-" | grep -q "TABLES_EXIST"; then
-    echo "✅ Таблицы уже существуют, помечаем миграции как примененные..."
-    alembic stamp head
-else
-    echo "🔄 Применяем миграции..."
-    alembic upgrade head
+")
+
+if [ "$DB_STATE" = "UNVERSIONED" ]; then
+    # Схема создана create_all без Alembic: помечаем базовую ревизию,
+    # дальнейшие миграции пропускают уже существующие колонки и индексы
+    echo "✅ Таблицы созданы без Alembic, помечаем базовую ревизию..."
+    alembic stamp 0003_add_domains_and_views
 fi
 
+# Новые миграции применяются и к уже существующим базам
+echo "🔄 Применяем миграции..."
+alembic upgrade head
+
 # Запускаем приложение
 echo "🚀 Запускаем приложение..."
 exec uvicorn backend.app.main:app --host 0.0.0.0 --port 8000 
\ No newline at end of file
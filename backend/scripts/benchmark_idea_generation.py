@@ -0,0 +1,120 @@
+"""
+Бенчмарк генерации идей на локальной заглушке OpenAI-клиента
+Заглушка отвечает через --latency секунд и с вероятностью --fail-rate отдаёт 429,
+так что видны параллельность, token bucket и повторы с jitter. Сравнивает
+последовательный запуск (IDEA_GEN_CONCURRENCY=1) с параллельным: время до первых
+идей в БД и общее время. Созданные идеи затем удаляются, счётчики пересчитываются.
+
+    python -m backend.scripts.benchmark_idea_generation --domains 8 --latency 2 --fail-rate 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from types import SimpleNamespace
+import uuid
+
+import httpx
+import openai
+from sqlalchemy import delete, func, select
+
+from backend.app.config import get_settings
+from backend.app.crud.counters import recount_counters
+from backend.app.database import SessionLocal
+from backend.app.ml.near_duplicates import near_duplicate_index
+from backend.app.models import Idea
+from backend.app.tasks.idea_generator import generate_ideas_for_domains
+
+settings = get_settings()
+
+DOMAINS = ["FinTech", "HealthTech", "EdTech", "E-commerce", "Gaming", "SaaS", "AI/ML", "Sustainability"]
+WORDS = ("ledger wallet clinic tutor cart quest cloud model solar grid audit score sensor market "
+         "mentor route badge stream vault forecast pantry fleet garden invoice").split()
+
+
+class StubLLM:
+    """AsyncOpenAI-совместимая заглушка: chat.completions.create с задержкой и случайными 429"""
+
+    def __init__(self, latency: float, fail_rate: float):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.calls = 0
+        self.failures = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            self.failures += 1
+            response = httpx.Response(429, request=httpx.Request("POST", "http://stub/v1/chat/completions"))
+            raise openai.RateLimitError("stub rate limit", response=response, body=None)
+
+        count = int(kwargs["messages"][1]["content"].split("Generate ")[1].split()[0])
+        ideas = [
+            {
+                "title": f"Stub {uuid.uuid4().hex[:12]}",
+                "description": " ".join(random.sample(WORDS, 12)) + f" {uuid.uuid4().hex}",
+                "tags": random.sample(WORDS, 3),
+            }
+            for _ in range(count)
+        ]
+        content = f"```json\n{json.dumps(ideas)}\n```"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+async def run(domains, ideas_per_domain: int, stub: StubLLM):
+    db = SessionLocal()
+    try:
+        started_at = db.execute(select(func.clock_timestamp())).scalar()
+        db.commit()  # created_at = начало транзакции вставки, а не этой
+        started = time.perf_counter()
+        created = await generate_ideas_for_domains(db, domains, ideas_per_domain, llm_client=stub)
+        total = time.perf_counter() - started
+
+        first = None
+        if created:
+            first_at = db.execute(
+                select(func.min(Idea.created_at)).where(Idea.id.in_([idea.id for idea in created]))
+            ).scalar()
+            first = (first_at - started_at).total_seconds()
+        return created, first, total
+    finally:
+        db.close()
+
+
+def cleanup(idea_ids):
+    db = SessionLocal()
+    try:
+        db.execute(delete(Idea).where(Idea.id.in_(idea_ids)))
+        recount_counters(db, commit=False)
+        db.commit()
+        near_duplicate_index.remove(idea_ids)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--domains", type=int, default=8)
+    parser.add_argument("--ideas-per-domain", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=2.0, help="секунд на ответ заглушки")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, settings.IDEA_GEN_CONCURRENCY])
+    args = parser.parse_args()
+
+    domains = DOMAINS[:args.domains]
+    for concurrency in args.concurrency:
+        settings.IDEA_GEN_CONCURRENCY = concurrency
+        stub = StubLLM(args.latency, args.fail_rate)
+        created, first, total = asyncio.run(run(domains, args.ideas_per_domain, stub))
+        first_text = f"{first:.1f} с" if first is not None else "—"
+        print(f"⚡ concurrency={concurrency}: {len(created)} идей, первые через {first_text}, "
+              f"всего {total:.1f} с, вызовов LLM {stub.calls} (429: {stub.failures})")
+        cleanup([idea.id for idea in created])
+
+
+if __name__ == "__main__":
+    main()
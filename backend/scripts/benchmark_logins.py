@@ -0,0 +1,130 @@
+"""
+Нагрузочный бенчмарк логинов
+Создаёт --users пользователей с одним паролем, запускает --logins логинов при
+--concurrency одновременных запросах и параллельно опрашивает лёгкий эндпоинт
+(/api/auth/available-domains), чтобы видеть, голодают ли остальные запросы.
+Режимы: pool — bcrypt в пуле процессов, inline — в потоке (как было до пула).
+
+    python -m backend.scripts.benchmark_logins --logins 200 --concurrency 32 --mode both
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import httpx
+from sqlalchemy import delete
+
+from backend.app.database import SessionLocal
+from backend.app.main import app
+from backend.app.models import User
+from backend.app.passwords import hash_password, password_hasher
+
+EMAIL_PREFIX = "bench-login-"
+PASSWORD = "bench-password-123"
+
+
+def seed_users(n_users: int) -> List[str]:
+    # Один хэш на всех: bcrypt при подготовке не интересен
+    hashed = hash_password(PASSWORD, password_hasher.rounds)
+    emails = [f"{EMAIL_PREFIX}{i}@example.com" for i in range(n_users)]
+    db = SessionLocal()
+    try:
+        db.execute(delete(User).where(User.email.like(f"{EMAIL_PREFIX}%")))
+        db.add_all(User(email=email, hashed_password=hashed, onboarding_completed=False) for email in emails)
+        db.commit()
+    finally:
+        db.close()
+    return emails
+
+
+def drop_users():
+    db = SessionLocal()
+    try:
+        db.execute(delete(User).where(User.email.like(f"{EMAIL_PREFIX}%")))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 else values[0]
+
+
+async def run(emails: List[str], n_logins: int, concurrency: int, probe_interval: float) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    login_ms: List[float] = []
+    probe_ms: List[float] = []
+    statuses: dict = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def login(i: int):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/api/auth/login", data={
+                    "username": emails[i % len(emails)], "password": PASSWORD
+                })
+                login_ms.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/api/auth/available-domains")
+                probe_ms.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(probe_interval)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(n_logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+    return {
+        "logins_per_s": round(n_logins / elapsed, 1),
+        "login_p50_ms": round(_percentile(login_ms, 50), 1),
+        "login_p95_ms": round(_percentile(login_ms, 95), 1),
+        "probe_p50_ms": round(_percentile(probe_ms, 50), 1),
+        "probe_p95_ms": round(_percentile(probe_ms, 95), 1),
+        "probe_max_ms": round(max(probe_ms, default=0.0), 1),
+        "statuses": statuses,
+    }
+
+
+async def warm_up():
+    # Процессы пула стартуют до замера
+    await asyncio.gather(*(password_hasher.hash_async("warmup") for _ in range(password_hasher.workers)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--probe-interval-ms", type=float, default=20)
+    parser.add_argument("--mode", choices=["pool", "inline", "both"], default="both")
+    args = parser.parse_args()
+
+    emails = seed_users(args.users)
+    modes = ["inline", "pool"] if args.mode == "both" else [args.mode]
+    try:
+        for mode in modes:
+            password_hasher.enabled = mode == "pool"
+            if password_hasher.enabled:
+                asyncio.run(warm_up())
+            result = asyncio.run(run(emails, args.logins, args.concurrency, args.probe_interval_ms / 1000))
+            print(f"🔐 {mode}: {result}")
+    finally:
+        password_hasher.shutdown()
+        drop_users()
+
+
+if __name__ == "__main__":
+    main()
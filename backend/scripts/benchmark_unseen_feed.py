@@ -0,0 +1,144 @@
+"""
+EXPLAIN-бенчмарк ленты непросмотренных идей
+Создаёт отдельную схему с синтетическими ideas/idea_views (по умолчанию 1M просмотров),
+сравнивает старый запрос (NOT IN) и ленту (NOT EXISTS + LATERAL + row_number)
+через EXPLAIN (ANALYZE, BUFFERS) и удаляет схему.
+
+    python -m backend.scripts.benchmark_unseen_feed --views 1000000
+"""
+
+import argparse
+import json
+import statistics
+
+from sqlalchemy import text
+
+from backend.app.crud.idea import _FEED_START, _UNSEEN_FEED_SQL
+from backend.app.database import engine
+
+SCHEMA = "feed_benchmark"
+DOMAINS = ["FinTech", "HealthTech", "EdTech", "E-commerce", "Gaming", "SaaS", "AI/ML", "Sustainability"]
+
+OLD_QUERY = text("""
+    SELECT ideas.* FROM ideas
+    WHERE ideas.domain = ANY(:domains)
+      AND ideas.id NOT IN (SELECT idea_views.idea_id FROM idea_views WHERE idea_views.user_id = :user_id)
+    LIMIT :limit
+""").bindparams(
+    *(param for name, param in _UNSEEN_FEED_SQL._bindparams.items() if name in ("domains", "user_id"))
+)
+
+
+def seed(conn, n_ideas: int, n_users: int, n_views: int, with_indexes: bool):
+    """Синтетические данные: просмотры распределены по пользователям неравномерно (квадрат)"""
+
+    conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    conn.execute(text(f"CREATE TABLE {SCHEMA}.ideas (LIKE public.ideas INCLUDING DEFAULTS)"))
+    conn.execute(text(f"CREATE TABLE {SCHEMA}.idea_views (LIKE public.idea_views INCLUDING DEFAULTS)"))
+    # Индексы, которые были до миграции 0005, и (опционально) индекс ленты
+    conn.execute(text(f"ALTER TABLE {SCHEMA}.ideas ADD PRIMARY KEY (id), ADD UNIQUE (title)"))
+    conn.execute(text(f"ALTER TABLE {SCHEMA}.idea_views ADD PRIMARY KEY (id), ADD UNIQUE (user_id, idea_id)"))
+    if with_indexes:
+        conn.execute(text(f"CREATE INDEX ON {SCHEMA}.ideas (domain, created_at, id)"))
+    conn.execute(text(f"CREATE TABLE {SCHEMA}.bench_users (id uuid PRIMARY KEY)"))
+
+    conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.ideas (id, title, description, tags, domain, created_at)
+        SELECT gen_random_uuid(), 'idea ' || g, 'description ' || g, '[]'::json,
+               (:domains)[1 + g % :n_domains], now() - (g || ' seconds')::interval
+        FROM generate_series(1, :n) g
+    """), {"domains": DOMAINS, "n_domains": len(DOMAINS), "n": n_ideas})
+    conn.execute(text(f"INSERT INTO {SCHEMA}.bench_users SELECT gen_random_uuid() FROM generate_series(1, :n)"),
+                 {"n": n_users})
+
+    # Каждый просмотр — случайная пара (пользователь, идея); дубликаты отбрасываются
+    conn.execute(text(f"""
+        WITH u AS (SELECT array_agg(id) AS ids FROM {SCHEMA}.bench_users),
+             i AS (SELECT array_agg(id) AS ids FROM {SCHEMA}.ideas),
+             pairs AS (
+                 SELECT 1 + floor(power(random(), 2) * :n_users)::int AS u_pos,
+                        1 + floor(random() * :n_ideas)::int AS i_pos
+                 FROM generate_series(1, :n)
+             )
+        INSERT INTO {SCHEMA}.idea_views (id, user_id, idea_id)
+        SELECT gen_random_uuid(), u.ids[pairs.u_pos], i.ids[pairs.i_pos]
+        FROM pairs, u, i
+        ON CONFLICT DO NOTHING
+    """), {"n": n_views, "n_users": n_users, "n_ideas": n_ideas})
+    conn.execute(text(f"ANALYZE {SCHEMA}.ideas"))
+    conn.execute(text(f"ANALYZE {SCHEMA}.idea_views"))
+
+
+def explain(conn, query, params) -> dict:
+    plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query.text}").bindparams(
+        *query._bindparams.values()
+    ), params).scalar()
+    plan = plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+    root = plan["Plan"]
+    return {
+        "execution_ms": plan["Execution Time"],
+        "planning_ms": plan["Planning Time"],
+        "shared_buffers": root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0),
+        "rows": root["Actual Rows"],
+        "plan": plan,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ideas", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--views", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--samples", type=int, default=20, help="пользователей в замере")
+    parser.add_argument("--no-indexes", action="store_true", help="без индексов миграции 0005")
+    parser.add_argument("--show-plans", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="не удалять схему после замера")
+    args = parser.parse_args()
+
+    with engine.begin() as conn:
+        seed(conn, args.ideas, args.users, args.views, with_indexes=not args.no_indexes)
+        views = conn.execute(text(f"SELECT count(*) FROM {SCHEMA}.idea_views")).scalar()
+        print(f"📦 {args.ideas} идей, {args.users} пользователей, {views} просмотров")
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL search_path TO {SCHEMA}, public"))
+            # Самые активные пользователи — худший случай для anti-join
+            users = conn.execute(text(
+                "SELECT user_id FROM idea_views GROUP BY user_id ORDER BY count(*) DESC LIMIT :n"
+            ), {"n": args.samples}).scalars().all()
+
+            results = {"old (NOT IN)": [], "feed (NOT EXISTS + LATERAL)": []}
+            for user_id in users:
+                domains = DOMAINS[:3]
+                params = {
+                    "domains": domains,
+                    "cursor_ats": [_FEED_START[0]] * len(domains),
+                    "cursor_ids": [_FEED_START[1]] * len(domains),
+                    "user_id": user_id,
+                    "per_domain": args.limit,
+                    "balance": True,
+                    "limit": args.limit,
+                }
+                results["old (NOT IN)"].append(explain(conn, OLD_QUERY, params))
+                results["feed (NOT EXISTS + LATERAL)"].append(explain(conn, _UNSEEN_FEED_SQL, params))
+
+            for name, runs in results.items():
+                times = sorted(run["execution_ms"] for run in runs)
+                print(
+                    f"⏱️ {name}: median {statistics.median(times):.2f} ms, "
+                    f"p95 {times[int(0.95 * (len(times) - 1))]:.2f} ms, "
+                    f"buffers {statistics.median(run['shared_buffers'] for run in runs):.0f}"
+                )
+                if args.show_plans:
+                    print(json.dumps(runs[0]["plan"]["Plan"], indent=2))
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
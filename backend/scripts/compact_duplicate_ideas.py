@@ -0,0 +1,46 @@
+"""
+Разовая компакция каталога: кластеры почти-дубликатов идей (MinHash LSH)
+По умолчанию только показывает кластеры; --apply переносит свайпы и просмотры
+на оставляемую идею и удаляет дубликаты одной транзакцией.
+
+    python -m backend.scripts.compact_duplicate_ideas --show 10
+    python -m backend.scripts.compact_duplicate_ideas --apply
+"""
+
+import argparse
+import time
+
+from backend.app.database import SessionLocal
+from backend.app.models import Idea
+from backend.app.tasks.idea_compaction import compact_duplicate_ideas, find_duplicate_clusters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="слить кластеры (иначе dry-run)")
+    parser.add_argument("--show", type=int, default=5, help="сколько кластеров напечатать")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        clusters = find_duplicate_clusters(db)
+        print(f"🔎 Найдено {len(clusters)} кластеров, {sum(len(c) - 1 for c in clusters)} дубликатов "
+              f"за {time.perf_counter() - started:.1f} с")
+
+        titles = dict(db.query(Idea.id, Idea.title).filter(
+            Idea.id.in_([idea_id for cluster in clusters[:args.show] for idea_id in cluster])
+        ).all())
+        for cluster in clusters[:args.show]:
+            print(f"   ✅ {titles.get(cluster[0])}")
+            for idea_id in cluster[1:]:
+                print(f"      ✖ {titles.get(idea_id)}")
+
+        if args.apply:
+            print(compact_duplicate_ideas(db, apply=True, rebuild=False))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
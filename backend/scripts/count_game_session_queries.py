@@ -0,0 +1,73 @@
+"""
+Проверка: число SQL-запросов на игровую сессию не зависит от её размера
+Считает выполненные запросы (before_cursor_execute) на GET /api/ideas/game-session
+для разных limit и падает, если число растёт вместе с числом карточек.
+
+    python -m backend.scripts.count_game_session_queries --limits 1 5 10 20
+"""
+
+import argparse
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from backend.app.database import SessionLocal, async_engine, engine
+from backend.app.dependencies import get_current_user, get_current_user_async
+from backend.app.main import app
+from backend.app.models import User
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # Эндпоинт работает через async-движок; его события — на async_engine.sync_engine
+    engines = (engine, async_engine.sync_engine)
+    for target in engines:
+        event.listen(target, "before_cursor_execute", _record)
+    try:
+        yield statements
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", _record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    user = db.query(User).filter(User.onboarding_completed.is_(True)).first()
+    if user is None:
+        raise SystemExit("❌ Нет пользователя с завершённым онбордингом")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_current_user_async] = lambda: user
+
+    counts = {}
+    with TestClient(app) as client:
+        client.get("/api/ideas/game-session", params={"limit": 1})  # прогрев in-memory индексов
+        for limit in args.limits:
+            with count_queries() as statements:
+                response = client.get("/api/ideas/game-session", params={"limit": limit})
+            response.raise_for_status()
+            cards = len(response.json()["ideas"])
+            counts[limit] = len(statements)
+            print(f"🃏 limit={limit}: {cards} карточек, {len(statements)} запросов")
+            if args.verbose:
+                for statement in statements:
+                    print("   ", " ".join(statement.split())[:120])
+
+    db.close()
+    if len(set(counts.values())) > 1:
+        raise SystemExit(f"❌ Число запросов зависит от размера сессии: {counts}")
+    print("✅ Число запросов на сессию постоянно")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Импорт идей из файла через COPY
+Файл — JSON-массив или JSON Lines с полями title, description, tags, domain
+(и необязательным generated_for_domains). Дубликаты по title пропускаются.
+
+    python -m backend.scripts.import_ideas ideas.jsonl --batch-size 50000
+"""
+
+import argparse
+import json
+import time
+
+from backend.app.crud.idea import copy_ideas
+from backend.app.database import SessionLocal
+from backend.app.schemas.idea import IdeaCreate
+
+
+def read_ideas(path: str):
+    with open(path, encoding="utf-8") as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from (IdeaCreate(**item) for item in json.load(f))
+        else:
+            yield from (IdeaCreate(**json.loads(line)) for line in f if line.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="идей на одну транзакцию COPY")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    started = time.perf_counter()
+    total = created = 0
+    batch = []
+    try:
+        for idea in read_ideas(args.path):
+            batch.append(idea)
+            if len(batch) >= args.batch_size:
+                created += len(copy_ideas(db, batch))
+                total += len(batch)
+                batch = []
+        if batch:
+            created += len(copy_ideas(db, batch))
+            total += len(batch)
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"📥 Импортировано {created} из {total} идей за {elapsed:.1f} с ({total / max(elapsed, 1e-9):.0f} идей/с)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Число SQL-запросов на игровую сессию не зависит от её размера
+Считает before_cursor_execute на обоих движках (async-эндпоинт и синхронные
+сессии в пуле потоков) для GET /api/ideas/game-session с разными limit.
+"""
+
+import asyncio
+from contextlib import contextmanager
+import uuid
+
+import pytest
+from fastapi import BackgroundTasks
+from sqlalchemy import event
+
+LIMITS = [1, 5, 10, 20]
+
+
+@contextmanager
+def count_queries():
+    from backend.app.database import async_engine, engine
+
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = (engine, async_engine.sync_engine)
+    for target in engines:
+        event.listen(target, "before_cursor_execute", _record)
+    try:
+        yield statements
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", _record)
+
+
+@pytest.fixture
+def onboarded_user(sync_db):
+    """Пользователь с одним доменом и идеями на все сессии теста"""
+    from backend.app.models import DomainCounter, Idea, User
+
+    domain = f"test-{uuid.uuid4().hex[:8]}"
+    user = User(
+        email=f"{domain}@example.com",
+        hashed_password="not-a-hash",
+        selected_domains=[domain],
+        onboarding_completed=True,
+    )
+    sync_db.add(user)
+    sync_db.add_all(
+        Idea(title=f"{domain} idea {i}", description="Test idea", tags=["test"], domain=domain)
+        for i in range(2 * (sum(LIMITS) + 1))
+    )
+    sync_db.commit()
+    sync_db.refresh(user)
+    sync_db.expunge(user)
+
+    yield user
+
+    # Просмотры и счётчики пользователя удаляются каскадом
+    sync_db.query(Idea).filter(Idea.domain == domain).delete(synchronize_session=False)
+    sync_db.query(DomainCounter).filter(DomainCounter.domain == domain).delete(synchronize_session=False)
+    sync_db.query(User).filter(User.id == user.id).delete(synchronize_session=False)
+    sync_db.commit()
+
+
+async def _session_query_counts(user):
+    from backend.app.database import AsyncSessionLocal, async_engine
+    from backend.app.routers.ideas import get_game_session
+
+    async def game_session(limit: int):
+        async with AsyncSessionLocal() as db:
+            return await get_game_session(
+                BackgroundTasks(), limit=limit, diversify=None, diversity_lambda=0.7,
+                current_user=user, db=db,
+            )
+
+    counts = {}
+    try:
+        await game_session(1)  # прогрев in-memory индексов
+        for limit in LIMITS:
+            with count_queries() as statements:
+                session = await game_session(limit)
+            assert len(session.ideas) == limit
+            counts[limit] = len(statements)
+    finally:
+        # Пул async-движка привязан к циклу событий asyncio.run
+        await async_engine.dispose()
+    return counts
+
+
+def test_game_session_query_count_is_constant(onboarded_user):
+    counts = asyncio.run(_session_query_counts(onboarded_user))
+    assert len(set(counts.values())) == 1, f"queries per session depend on its size: {counts}"
@@ -0,0 +1,222 @@
+"""
+Параллельная генерация идей с ограничением частоты
+generate_ideas_for_domains получает заглушку AsyncOpenAI-клиента и
+заглушку записи в БД: проверяются лимит параллельности, интервалы token
+bucket, повторы временных ошибок и запись каждого домена сразу по готовности.
+"""
+
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from backend.app.tasks import idea_generator
+from backend.app.tasks.idea_generator import TokenBucket, generate_ideas_for_domains
+
+
+def _ideas_json(domain: str, count: int = 2) -> str:
+    return json.dumps([
+        {"title": f"{domain} idea {i}", "description": "Test idea", "tags": ["test"]}
+        for i in range(count)
+    ])
+
+
+def _api_error(error_class, status_code: int):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return error_class("stub error", response=httpx.Response(status_code, request=request), body=None)
+
+
+class StubLLMClient:
+    """AsyncOpenAI-совместимая заглушка: chat.completions.create отвечает через respond(domain, attempt)"""
+
+    def __init__(self, domains, respond, delay: float = 0.0):
+        self.domains = list(domains)
+        self.respond = respond
+        self.delay = delay
+        self.calls = []  # (domain, monotonic-время начала запроса)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.events = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _domain(self, messages) -> str:
+        prompt = messages[0]["content"]
+        return next(domain for domain in self.domains if f"сферы {domain}" in prompt)
+
+    async def _create(self, messages, **kwargs):
+        domain = self._domain(messages)
+        attempt = sum(1 for called, _ in self.calls if called == domain)
+        self.calls.append((domain, time.monotonic()))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay = self.delay(domain) if callable(self.delay) else self.delay
+            if delay:
+                await asyncio.sleep(delay)
+            content = self.respond(domain, attempt)
+        finally:
+            self.in_flight -= 1
+        self.events.append(f"response {domain}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class StubSession:
+    def __init__(self):
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def inserts(monkeypatch):
+    """Подменяет bulk_create_ideas: вставки пишутся в список (домен, идеи)"""
+    recorded = []
+
+    def fake_bulk_create(db_session, ideas):
+        recorded.append((ideas[0].domain, list(ideas)))
+        return list(ideas)
+
+    monkeypatch.setattr(idea_generator, "bulk_create_ideas", fake_bulk_create)
+    return recorded
+
+
+@pytest.fixture
+def unlimited_rate(monkeypatch):
+    monkeypatch.setattr(idea_generator, "rate_limiter", TokenBucket(0, 1))
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Подменяет задержку между повторами на мгновенную и записывает номера попыток"""
+    attempts = []
+
+    def fake_backoff(attempt, error):
+        attempts.append((attempt, type(error)))
+        return 0.001
+
+    monkeypatch.setattr(idea_generator, "_backoff_seconds", fake_backoff)
+    return attempts
+
+
+def test_concurrency_cap_holds(monkeypatch, inserts, unlimited_rate):
+    monkeypatch.setattr(idea_generator.settings, "IDEA_GEN_CONCURRENCY", 2)
+    domains = [f"Domain{i}" for i in range(6)]
+    client = StubLLMClient(domains, lambda domain, attempt: _ideas_json(domain), delay=0.05)
+
+    created = asyncio.run(generate_ideas_for_domains(StubSession(), domains, 2, llm_client=client))
+
+    assert client.max_in_flight == 2
+    assert len(created) == 12
+    assert sorted(domain for domain, _ in inserts) == sorted(domains)
+
+
+def test_token_bucket_spaces_requests(monkeypatch, inserts):
+    rate = 20.0  # запросов в секунду: интервал 50 мс
+    monkeypatch.setattr(idea_generator, "rate_limiter", TokenBucket(rate, 1))
+    monkeypatch.setattr(idea_generator.settings, "IDEA_GEN_CONCURRENCY", 10)
+    domains = [f"Domain{i}" for i in range(5)]
+    client = StubLLMClient(domains, lambda domain, attempt: _ideas_json(domain))
+
+    asyncio.run(generate_ideas_for_domains(StubSession(), domains, 2, llm_client=client))
+
+    starts = sorted(started for _, started in client.calls)
+    gaps = [b - a for a, b in zip(starts, starts[1:])]
+    assert len(starts) == 5
+    assert min(gaps) >= 1 / rate * 0.8
+    assert starts[-1] - starts[0] >= (len(starts) - 1) / rate * 0.9
+
+
+def test_transient_errors_retry_with_backoff_auth_errors_do_not(monkeypatch, inserts, unlimited_rate, backoffs):
+    monkeypatch.setattr(idea_generator.settings, "IDEA_GEN_MAX_RETRIES", 3)
+    domains = ["Throttled", "Garbled", "Unauthorized"]
+
+    def respond(domain, attempt):
+        if domain == "Throttled" and attempt < 2:
+            raise _api_error(openai.RateLimitError, 429)
+        if domain == "Garbled" and attempt < 1:
+            return "not json at all"
+        if domain == "Unauthorized":
+            raise _api_error(openai.AuthenticationError, 401)
+        return _ideas_json(domain)
+
+    client = StubLLMClient(domains, respond)
+    asyncio.run(generate_ideas_for_domains(StubSession(), domains, 2, llm_client=client))
+
+    calls = [domain for domain, _ in client.calls]
+    assert calls.count("Throttled") == 3
+    assert calls.count("Garbled") == 2
+    assert calls.count("Unauthorized") == 1
+    assert sorted(domain for domain, _ in inserts) == ["Garbled", "Throttled"]
+
+    # Задержка перед каждым повтором, с растущим номером попытки; ошибка ключа не повторяется
+    assert sorted(attempt for attempt, error in backoffs if error is openai.RateLimitError) == [0, 1]
+    assert [attempt for attempt, error in backoffs if error is not openai.RateLimitError] == [0]
+    assert all(error is not openai.AuthenticationError for _, error in backoffs)
+
+
+def test_retries_give_up_after_max_retries(monkeypatch, inserts, unlimited_rate, backoffs):
+    monkeypatch.setattr(idea_generator.settings, "IDEA_GEN_MAX_RETRIES", 2)
+
+    def respond(domain, attempt):
+        raise _api_error(openai.InternalServerError, 503)
+
+    client = StubLLMClient(["Down"], respond)
+    created = asyncio.run(generate_ideas_for_domains(StubSession(), ["Down"], 2, llm_client=client))
+
+    assert created == []
+    assert len(client.calls) == 3
+    assert [attempt for attempt, _ in backoffs] == [0, 1]
+
+
+def test_backoff_is_capped_exponential_full_jitter(monkeypatch):
+    monkeypatch.setattr(idea_generator.settings, "IDEA_GEN_BACKOFF_BASE_SECONDS", 1.0)
+    monkeypatch.setattr(idea_generator.settings, "IDEA_GEN_BACKOFF_MAX_SECONDS", 5.0)
+    monkeypatch.setattr(idea_generator.random, "uniform", lambda low, high: high)
+    error = ValueError("bad json")
+
+    assert [idea_generator._backoff_seconds(attempt, error) for attempt in range(5)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+
+def test_each_domain_is_inserted_as_soon_as_it_completes(monkeypatch, unlimited_rate):
+    monkeypatch.setattr(idea_generator.settings, "IDEA_GEN_CONCURRENCY", 2)
+    client = StubLLMClient(
+        ["Fast", "Slow"],
+        lambda domain, attempt: _ideas_json(domain),
+        delay=lambda domain: 0.3 if domain == "Slow" else 0.0,
+    )
+
+    def fake_bulk_create(db_session, ideas):
+        client.events.append(f"insert {ideas[0].domain}")
+        return list(ideas)
+
+    monkeypatch.setattr(idea_generator, "bulk_create_ideas", fake_bulk_create)
+    asyncio.run(generate_ideas_for_domains(StubSession(), ["Slow", "Fast"], 2, llm_client=client))
+
+    assert client.events.index("insert Fast") < client.events.index("response Slow")
+    assert client.events[-1] == "insert Slow"
+
+
+def test_failed_insert_rolls_back_shared_session(monkeypatch, unlimited_rate):
+    monkeypatch.setattr(idea_generator.settings, "IDEA_GEN_CONCURRENCY", 1)
+    inserted = []
+
+    def fake_bulk_create(db_session, ideas):
+        domain = ideas[0].domain
+        if domain == "Broken":
+            raise RuntimeError("insert failed")
+        inserted.append(domain)
+        return list(ideas)
+
+    monkeypatch.setattr(idea_generator, "bulk_create_ideas", fake_bulk_create)
+    session = StubSession()
+    client = StubLLMClient(["Broken", "Healthy"], lambda domain, attempt: _ideas_json(domain))
+
+    asyncio.run(generate_ideas_for_domains(session, ["Broken", "Healthy"], 2, llm_client=client))
+
+    assert session.rollbacks == 1
+    assert inserted == ["Healthy"]
@@ -0,0 +1,106 @@
+"""
+Слияние кэшированной матрицы признаков с дельтой изменений
+Матрицы собираются вручную, без базы данных: проверяются замена изменённых
+строк на месте, дописывание новых свайпов по времени и пересчёт агрегатов
+только у пользователей из дельты.
+"""
+
+from datetime import datetime, timedelta, timezone
+import uuid
+
+import numpy as np
+
+from backend.app.ml.training_data import (
+    FEATURE_DTYPE,
+    N_FEATURES,
+    ORDER_WIDTH,
+    TrainingMatrix,
+    UserStats,
+    merge_training_delta,
+    order_key,
+)
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _at(minutes: int) -> datetime:
+    return T0 + timedelta(minutes=minutes)
+
+
+def _matrix(rows, users, watermark=None) -> TrainingMatrix:
+    """rows: (код пользователя, метка, created_at, id свайпа, маркер в признаке text_length)"""
+    X = np.zeros((len(rows), N_FEATURES), dtype=FEATURE_DTYPE)
+    X[:, 0] = [row[4] for row in rows]
+    X[:, 3] = 99  # агрегаты пользователя до обновления
+    y = np.array([row[1] for row in rows], dtype=np.int8)
+    return TrainingMatrix(
+        X=X,
+        y=y,
+        row_users=np.array([row[0] for row in rows], dtype=np.int32),
+        users=users,
+        watermark=watermark,
+        source_rows=len(rows),
+        row_order=np.array([order_key((row[2], row[3])) for row in rows], dtype=np.uint64).reshape(-1, ORDER_WIDTH),
+        source_likes=int(y.sum()),
+    )
+
+
+def test_changed_rows_are_replaced_and_new_rows_appended_in_time_order():
+    a, b, c, e = (uuid.uuid4() for _ in range(4))
+    ids = [uuid.uuid4() for _ in range(6)]
+    cached = _matrix(
+        [(0, 1, _at(1), ids[1], 1), (1, 0, _at(2), ids[2], 2), (0, 0, _at(3), ids[3], 3)],
+        users=[a, b],
+        watermark=(_at(3), ids[3]),
+    )
+    delta = _matrix(
+        [
+            (2, 1, _at(0), ids[0], 10),  # пересвайп строки, которой нет в кэше
+            (0, 0, _at(1), ids[1], 11),  # пересвайп строки из кэша: лайк -> дизлайк
+            (1, 1, _at(5), ids[5], 15),  # новый свайп
+        ],
+        users=[a, c, e],
+        watermark=(_at(6), ids[1]),
+    )
+    stats = {a: UserStats(2, 0, frozenset()), c: UserStats(1, 1, frozenset()), e: UserStats(4, 3, frozenset())}
+
+    merged = merge_training_delta(cached, delta, max_rows=100, delta_user_stats=stats)
+
+    assert merged.users == [a, b, c, e]
+    assert merged.X[:, 0].tolist() == [11, 2, 3, 15]
+    assert merged.y.tolist() == [0, 0, 0, 1]
+    assert merged.row_users.tolist() == [0, 1, 0, 2]
+    assert merged.watermark == (_at(6), ids[1])
+
+    # Агрегаты пересчитаны у a и c на всех их строках, у b — без изменений
+    assert merged.X[:, 3].tolist() == [2, 99, 2, 1]
+    assert merged.X[:, 4].tolist() == [0, 0, 0, 1]
+    assert merged.X[[0, 2, 3], 5].tolist() == [0, 0, 1]
+
+    # Поток: +1 новый свайп; лайки: 1 - 1 (замена) + 1 (новый) + 1 (пересвайп вне кэша)
+    assert merged.source_rows == 4
+    assert merged.source_likes == 2
+
+
+def test_max_rows_keeps_latest_rows_after_merge():
+    a = uuid.uuid4()
+    ids = [uuid.uuid4() for _ in range(4)]
+    cached = _matrix([(0, 1, _at(1), ids[1], 1), (0, 0, _at(2), ids[2], 2)], users=[a], watermark=(_at(2), ids[2]))
+    delta = _matrix([(0, 1, _at(3), ids[3], 3)], users=[a], watermark=(_at(3), ids[3]))
+
+    merged = merge_training_delta(cached, delta, max_rows=2, delta_user_stats={})
+
+    assert merged.X[:, 0].tolist() == [2, 3]
+    assert merged.row_order.tolist() == [list(order_key((_at(2), ids[2]))), list(order_key((_at(3), ids[3])))]
+
+
+def test_empty_delta_only_moves_watermark():
+    a = uuid.uuid4()
+    swipe_id = uuid.uuid4()
+    cached = _matrix([(0, 1, _at(1), swipe_id, 1)], users=[a], watermark=(_at(1), swipe_id))
+    delta = _matrix([], users=[], watermark=(_at(9), swipe_id))
+
+    merged = merge_training_delta(cached, delta, max_rows=10, delta_user_stats={})
+
+    assert merged.watermark == (_at(9), swipe_id)
+    assert merged.X is cached.X
@@ -0,0 +1,74 @@
+"""
+Стратифицированная выборка при инкрементальном обучении
+Кэш — выборка по первой части потока со своими ключами A-Res; после слияния
+с дельтой и повторной выборки до бюджета результат должен совпасть с
+выборкой, сделанной сразу по всему потоку с теми же ключами.
+"""
+
+from datetime import datetime, timedelta, timezone
+import uuid
+
+import numpy as np
+
+from backend.app.ml.sampling import StratifiedReservoirSampler
+from backend.app.ml.training_data import (
+    FEATURE_DTYPE,
+    N_FEATURES,
+    ORDER_WIDTH,
+    TrainingMatrix,
+    merge_training_delta,
+    order_key,
+    resample_training_matrix,
+)
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _stream(n: int, n_users: int = 5):
+    X = np.zeros((n, N_FEATURES), dtype=FEATURE_DTYPE)
+    X[:, 0] = np.arange(n)  # маркер позиции в потоке
+    y = (np.arange(n) % 2).astype(np.int8)
+    row_users = (np.arange(n) % n_users).astype(np.int32)
+    keys = [(T0 + timedelta(seconds=i), uuid.uuid4()) for i in range(n)]
+    order = np.array([order_key(key) for key in keys], dtype=np.uint64).reshape(-1, ORDER_WIDTH)
+    a_res_keys = np.log(np.random.default_rng(7).random(n))
+    return X, y, row_users, keys, order, a_res_keys
+
+
+def _class_counts(y: np.ndarray):
+    likes = int(y.sum())
+    return {1: likes, 0: len(y) - likes}
+
+
+def test_merge_then_resample_equals_sampling_full_stream():
+    n, split, budget = 1000, 600, 100
+    X, y, row_users, keys, order, a_res_keys = _stream(n)
+    users = [uuid.uuid4() for _ in range(5)]
+
+    full = StratifiedReservoirSampler(budget, _class_counts(y), N_FEATURES)
+    full.offer(X, y, row_users, keys=a_res_keys)
+    expected = full.result()
+
+    # Кэш: выборка по первым split строкам потока
+    head = StratifiedReservoirSampler(budget, _class_counts(y[:split]), N_FEATURES, order_width=ORDER_WIDTH)
+    head.offer(X[:split], y[:split], row_users[:split], order=order[:split], keys=a_res_keys[:split])
+    sample = head.result()
+    cached = TrainingMatrix(
+        sample.X, sample.y, sample.row_users, users, keys[split - 1],
+        source_rows=split, row_order=sample.row_order, sample_keys=sample.keys, source_likes=int(y[:split].sum()),
+    )
+    delta = TrainingMatrix(
+        X[split:], y[split:], row_users[split:], users, keys[-1],
+        source_rows=n - split, row_order=order[split:], sample_keys=a_res_keys[split:],
+        source_likes=int(y[split:].sum()),
+    )
+
+    merged = merge_training_delta(cached, delta, max_rows=len(cached.y) + len(delta.y), delta_user_stats={})
+    resampled = resample_training_matrix(merged, budget)
+
+    assert merged.source_class_counts() == _class_counts(y)
+    assert resampled.X[:, 0].tolist() == expected.X[:, 0].tolist()
+    assert resampled.y.tolist() == expected.y.tolist()
+    assert resampled.row_users.tolist() == expected.row_users.tolist()
+    np.testing.assert_array_equal(resampled.sample_keys, expected.keys)
+    np.testing.assert_array_equal(resampled.row_order, order[expected.X[:, 0].astype(int)])
@@ -0,0 +1,106 @@
+"""
+Write-behind буфер без базы данных
+_write подменяется заглушкой: проверяются деление пачки с ошибкой данных до
+одного запроса, разрешение тикетов до сигналов индексам и backpressure по
+числу событий, а не запросов.
+"""
+
+import uuid
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from backend.app.tasks import write_behind as write_behind_module
+from backend.app.tasks.write_behind import (
+    WriteBehindBuffer,
+    WriteBehindFlushError,
+    WriteBehindQueueFull,
+    _Item,
+)
+
+
+class StubWriter:
+    """Заглушка _write: пачка с плохой идеей падает целиком, как транзакция с нарушением FK"""
+
+    def __init__(self, bad_idea_id):
+        self.bad_idea_id = bad_idea_id
+        self.calls = []  # размеры пачек (свайпов) в порядке попыток
+
+    def __call__(self, swipes, views):
+        self.calls.append(len(swipes))
+        if any(idea_id == self.bad_idea_id for _, idea_id, _ in swipes):
+            raise IntegrityError("INSERT INTO swipes", {}, Exception("violates foreign key constraint"))
+        writes = {(user_id, idea_id): ("written", swipe) for user_id, idea_id, swipe in swipes}
+        return writes, list(views)
+
+
+@pytest.fixture
+def signals(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(write_behind_module, "record_swipe_signals", lambda writes: recorded.extend(writes))
+    monkeypatch.setattr(write_behind_module, "record_view_signals", lambda views: None)
+    return recorded
+
+
+def _durable_item(user_id, idea_id):
+    item = _Item(swipes=[(user_id, idea_id, True)])
+    item.ticket = write_behind_module.Ticket()
+    return item
+
+
+def test_bad_event_is_bisected_down_to_its_request(signals):
+    buffer = WriteBehindBuffer(session_factory=None, mode="durable")
+    bad_idea_id = uuid.uuid4()
+    buffer._write = StubWriter(bad_idea_id)
+
+    idea_ids = [uuid.uuid4() for _ in range(8)]
+    idea_ids[5] = bad_idea_id
+    batch = [_durable_item(uuid.uuid4(), idea_id) for idea_id in idea_ids]
+
+    buffer._flush(batch)
+
+    for index, item in enumerate(batch):
+        assert item.ticket.done
+        if index == 5:
+            with pytest.raises(WriteBehindFlushError):
+                item.ticket.wait(0)
+        else:
+            user_id, idea_id, _ = item.swipes[0]
+            assert item.ticket.wait(0) == {(user_id, idea_id): ("written", True)}
+
+    stats = buffer.stats()
+    assert stats["failed_events"] == 1
+    assert stats["events"] == 7
+    assert stats["splits"] > 0
+    assert len(signals) == 7
+
+
+def test_signal_failure_does_not_fail_committed_batch(monkeypatch):
+    def broken_signals(writes):
+        raise RuntimeError("index is broken")
+
+    monkeypatch.setattr(write_behind_module, "record_swipe_signals", broken_signals)
+    monkeypatch.setattr(write_behind_module, "record_view_signals", lambda views: None)
+    buffer = WriteBehindBuffer(session_factory=None, mode="durable")
+    buffer._write = StubWriter(bad_idea_id=None)
+    item = _durable_item(uuid.uuid4(), uuid.uuid4())
+
+    buffer._flush_guarded([item])
+
+    assert len(item.ticket.wait(0)) == 1
+    assert buffer.stats()["signal_errors"] == 1
+    assert buffer.stats()["flush_errors"] == 0
+
+
+def test_queue_limit_counts_events_not_requests():
+    buffer = WriteBehindBuffer(session_factory=None, mode="async", max_queue=10, enqueue_timeout_ms=0)
+    user_id = uuid.uuid4()
+
+    buffer.submit_views(user_id, [uuid.uuid4() for _ in range(8)])
+    with pytest.raises(WriteBehindQueueFull):
+        buffer.submit_views(user_id, [uuid.uuid4() for _ in range(3)])
+    buffer.submit_views(user_id, [uuid.uuid4() for _ in range(2)])
+    assert buffer.stats()["queued"] == 10
+
+    buffer._take(block=False)
+    assert buffer.stats()["queued"] == 2